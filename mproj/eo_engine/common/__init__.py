@@ -2,8 +2,6 @@ from datetime import datetime
 from functools import lru_cache
 from logging import Logger
 from pathlib import Path
-import paramiko
-from paramiko import AutoAddPolicy
 from celery.utils.log import get_task_logger
 
 from eo_engine.errors import AfriCultuReSFileDoesNotExist
@@ -29,6 +27,9 @@ def get_file_by_name_from_aux_folder(file_path: Union[str, Path]) -> Path:
 
 
 def draxis_upload_file(eo_product: EOProduct) -> str:
+    import paramiko
+    from paramiko import AutoAddPolicy
+
     rsa_key = get_file_by_name_from_aux_folder('/keys/id.rsa')
     domain = '18.159.85.240:2310'
     username = 'user1'
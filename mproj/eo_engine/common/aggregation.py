@@ -0,0 +1,291 @@
+"""
+Temporal aggregation of dekadal products into monthly or seasonal composites.
+
+An aggregation pipeline is a Pipeline with task_name 'task_temporal_aggregation'; its task_kwargs are the
+AggregationSpec fields (period, statistic, variable, packing of the output). The output product of a
+period has the reference date of the first day of the period.
+
+Every input dekad is folded, once, into an accumulator of its period when it becomes READY: running sum,
+count, min and max of the valid values, in physical units. When the last dekad of the period has been
+folded, the output product is written from the accumulator; the inputs are never read again.
+"""
+import datetime
+import os
+import shutil
+from logging import Logger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import netCDF4
+import numpy as np
+from affine import Affine
+from celery.utils.log import get_task_logger
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from rasterio.windows import Window
+
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.common.layout import product_spec
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, EOProductStateChoices, Pipeline
+
+logger: Logger = get_task_logger(__name__)
+
+AGGREGATION_TASK = 'task_temporal_aggregation'
+PERIODS = ('month', 'season')
+STATISTICS = ('mean', 'sum', 'min', 'max', 'count')
+
+# used when settings.TEMPORAL_AGGREGATION_SEASONS is not set
+DEFAULT_SEASONS: Dict[str, Sequence[int]] = {
+    'DJF': (12, 1, 2),
+    'MAM': (3, 4, 5),
+    'JJA': (6, 7, 8),
+    'SON': (9, 10, 11)
+}
+
+Period = NamedTuple('Period', [
+    # e.g. '202101' or '2020DJF'
+    ('name', str),
+    ('start', datetime.date),
+    # inclusive
+    ('end', datetime.date)
+])
+
+AggregationSpec = NamedTuple('AggregationSpec', [
+    ('period', str),
+    ('statistic', str),
+    # netCDF variable of the inputs. None for single band rasters
+    ('variable', Optional[str]),
+    # (min, max) of the valid input values, in physical units
+    ('valid_range', Optional[Tuple[float, float]]),
+    # the output variable
+    ('output_variable', str),
+    ('dtype', str),
+    ('fill_value', float),
+    ('scale_factor', Optional[float]),
+    ('add_offset', Optional[float]),
+    ('attrs', Dict[str, str])
+])
+
+
+def aggregation_spec(period: str = 'month', statistic: str = 'mean',
+                     variable: Optional[str] = None,
+                     valid_range: Optional[Sequence[float]] = None,
+                     output_variable: Optional[str] = None,
+                     dtype: str = 'f4',
+                     fill_value: float = -9999,
+                     scale_factor: Optional[float] = None,
+                     add_offset: Optional[float] = None,
+                     attrs: Optional[Dict[str, str]] = None) -> AggregationSpec:
+    """ AggregationSpec from the task_kwargs of a pipeline """
+    if period not in PERIODS:
+        raise AfriCultuReSError(f'Unknown aggregation period: {period}. Should be one of {PERIODS}')
+    if statistic not in STATISTICS:
+        raise AfriCultuReSError(f'Unknown aggregation statistic: {statistic}. Should be one of {STATISTICS}')
+    return AggregationSpec(
+        period=period, statistic=statistic, variable=variable,
+        valid_range=tuple(valid_range) if valid_range is not None else None,
+        output_variable=output_variable or variable or 'Band1',
+        dtype=dtype, fill_value=fill_value, scale_factor=scale_factor, add_offset=add_offset,
+        attrs=attrs or {})
+
+
+def is_aggregation_pipeline(pipeline: Pipeline) -> bool:
+    return pipeline.task_name.split('.')[-1] == AGGREGATION_TASK
+
+
+def period_of(reference_date: datetime.date, period: str = 'month') -> Period:
+    """ The period (month or season, see settings.TEMPORAL_AGGREGATION_SEASONS) of reference_date """
+    month_start = reference_date.replace(day=1)
+    if period == 'month':
+        start, months, name = month_start, 1, month_start.strftime('%Y%m')
+    elif period == 'season':
+        seasons: Dict[str, Sequence[int]] = getattr(settings, 'TEMPORAL_AGGREGATION_SEASONS', DEFAULT_SEASONS)
+        try:
+            season, months_of_season = next(
+                (k, v) for k, v in seasons.items() if reference_date.month in v)
+        except StopIteration:
+            raise AfriCultuReSError(f'Month {reference_date.month} is not in any season')
+        # seasons can cross the year, e.g. DJF
+        start = month_start - relativedelta(months=list(months_of_season).index(reference_date.month))
+        months, name = len(months_of_season), f'{start.year}{season}'
+    else:
+        raise AfriCultuReSError(f'Unknown aggregation period: {period}. Should be one of {PERIODS}')
+    end = start + relativedelta(months=months) - datetime.timedelta(days=1)
+    return Period(name=name, start=start, end=end)
+
+
+def period_dekads(period: Period) -> List[datetime.date]:
+    """ The start dates of the dekads of the period """
+    dekads: List[datetime.date] = []
+    month = period.start
+    while month <= period.end:
+        dekads.extend(month.replace(day=day) for day in (1, 11, 21))
+        month += relativedelta(months=1)
+    return dekads
+
+
+def aggregation_output(pipeline: Pipeline, eo_product: EOProduct) -> EOProduct:
+    """ The output product of the period of eo_product, created if needed """
+    spec = aggregation_spec(**pipeline.task_kwargs)
+    period = period_of(eo_product.reference_date, spec.period)
+    output_filename = pipeline.output_filename(**{
+        'YYYYMMDD': period.start.strftime('%Y%m%d'),
+        'YYYYMM': period.start.strftime('%Y%m'),
+        'YYYY': period.start.strftime('%Y'),
+        'PERIOD': period.name})
+    output, created = EOProduct.objects.get_or_create(
+        group=pipeline.output_group.as_eoproduct_group(),
+        reference_date=period.start,
+        defaults={'filename': output_filename, 'state': EOProductStateChoices.MISSING_SOURCE})
+    return output
+
+
+def accumulator_path(output: EOProduct) -> Path:
+    root = Path(getattr(settings, 'TEMPORAL_AGGREGATION_ROOT', settings.MEDIA_ROOT / 'accumulators'))
+    return root / output.group.name / f'{output.reference_date.strftime("%Y%m%d")}.nc'
+
+
+def folded_dates(acc_path: Path) -> List[str]:
+    """ ISO dates of the inputs folded in the accumulator """
+    if not acc_path.exists():
+        return []
+    with netCDF4.Dataset(acc_path) as acc:
+        token = acc.getncattr('reference_dates') if 'reference_dates' in acc.ncattrs() else ''
+    return [d for d in token.split(',') if d]
+
+
+def _input_path(product_path: Union[str, Path], variable: Optional[str]) -> str:
+    if variable is None:
+        return Path(product_path).as_posix()
+    return f'NETCDF:"{Path(product_path).as_posix()}":{variable}'
+
+
+def _create_accumulator(path: Path, src, chunksizes: Tuple[int, int]):
+    """ An empty accumulator on the grid of the rasterio dataset src. Rows are stored north-up. """
+    chunksizes = (min(chunksizes[0], src.height), min(chunksizes[1], src.width))
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as dst:
+        dst.createDimension('y', src.height)
+        dst.createDimension('x', src.width)
+        kwargs = dict(zlib=True, complevel=1, shuffle=True, chunksizes=chunksizes)
+        dst.createVariable('sum', 'f8', ('y', 'x'), fill_value=0, **kwargs)
+        dst.createVariable('count', 'u2', ('y', 'x'), fill_value=0, **kwargs)
+        dst.createVariable('min', 'f4', ('y', 'x'), fill_value=np.nan, **kwargs)
+        dst.createVariable('max', 'f4', ('y', 'x'), fill_value=np.nan, **kwargs)
+        dst.setncatts({
+            'transform': ' '.join(str(v) for v in src.transform.to_gdal()),
+            'crs': src.crs.to_wkt() if src.crs else '',
+            'reference_dates': ''})
+
+
+def fold_product(acc_path: Path, product_path: Union[str, Path], reference_date: datetime.date,
+                 spec: AggregationSpec, chunksizes: Tuple[int, int] = (256, 256), rows: int = 512) -> bool:
+    """ Folds one input into the accumulator. The accumulator is updated on a copy that replaces it at the
+    end, so a failed update leaves it untouched. Returns False if reference_date had already been folded. """
+    import rasterio
+
+    acc_path.parent.mkdir(parents=True, exist_ok=True)
+    with advisory_lock(f'aggregation:{acc_path}'), \
+            rasterio.open(_input_path(product_path, spec.variable)) as src, \
+            TemporaryDirectory(dir=acc_path.parent, prefix='.aggregation_') as temp_dir:
+        temp_path = Path(temp_dir) / acc_path.name
+        if acc_path.exists():
+            shutil.copyfile(acc_path, temp_path)
+        else:
+            _create_accumulator(temp_path, src, chunksizes)
+
+        with netCDF4.Dataset(temp_path, 'a') as acc:
+            acc.set_auto_maskandscale(False)
+            dates = [d for d in acc.getncattr('reference_dates').split(',') if d]
+            if reference_date.isoformat() in dates:
+                logger.info(f'{reference_date} is already folded in {acc_path.name}')
+                return False
+            if (len(acc.dimensions['y']), len(acc.dimensions['x'])) != (src.height, src.width) or \
+                    not np.allclose(Affine.from_gdal(*map(float, acc.getncattr('transform').split())),
+                                    src.transform, atol=1e-9):
+                raise AfriCultuReSError(f'{product_path} is not on the grid of the accumulator {acc_path.name}')
+
+            scale, offset = src.scales[0], src.offsets[0]
+            for row in range(0, src.height, rows):
+                height = min(rows, src.height - row)
+                window = Window(0, row, src.width, height)
+                rows_slice = slice(row, row + height)
+                raw = src.read(1, window=window)
+                valid = np.ones(raw.shape, dtype=bool) if src.nodata is None else raw != src.nodata
+                data = raw.astype('f8') * scale + offset
+                valid &= np.isfinite(data)
+                if spec.valid_range is not None:
+                    valid &= (data >= spec.valid_range[0]) & (data <= spec.valid_range[1])
+
+                acc.variables['sum'][rows_slice, :] = \
+                    acc.variables['sum'][rows_slice, :] + np.where(valid, data, 0)
+                acc.variables['count'][rows_slice, :] = \
+                    acc.variables['count'][rows_slice, :] + valid.astype('u2')
+                # fmin/fmax ignore the NaN of the pixels without values
+                current = acc.variables['min'][rows_slice, :]
+                acc.variables['min'][rows_slice, :] = np.where(valid, np.fmin(current, data), current)
+                current = acc.variables['max'][rows_slice, :]
+                acc.variables['max'][rows_slice, :] = np.where(valid, np.fmax(current, data), current)
+
+            acc.setncattr('reference_dates', ','.join(sorted(dates + [reference_date.isoformat()])))
+        os.replace(temp_path, acc_path)
+
+    logger.info(f'Folded {Path(product_path).name} ({reference_date}) into {acc_path.name}')
+    return True
+
+
+def _statistic_blocks(acc: netCDF4.Dataset, spec: AggregationSpec, rows: int) -> Iterator[Tuple[Window, np.ndarray]]:
+    height, width = len(acc.dimensions['y']), len(acc.dimensions['x'])
+    for row in range(0, height, rows):
+        rows_slice = slice(row, min(row + rows, height))
+        count = acc.variables['count'][rows_slice, :]
+        if spec.statistic == 'count':
+            values = count.astype('f8')
+        elif spec.statistic == 'mean':
+            values = np.divide(acc.variables['sum'][rows_slice, :], count,
+                               out=np.zeros(count.shape, dtype='f8'), where=count > 0)
+        else:
+            values = acc.variables[spec.statistic][rows_slice, :].astype('f8')
+
+        if spec.scale_factor is not None or spec.add_offset is not None:
+            values = np.rint((values - (spec.add_offset or 0)) / (spec.scale_factor or 1))
+        values = np.where(count > 0, values, spec.fill_value)
+        yield Window(0, row, width, values.shape[0]), values.astype(spec.dtype)
+
+
+def write_aggregation(acc_path: Path, file_out: Path, spec: AggregationSpec, group_name: str,
+                      rows: int = 512) -> Path:
+    """ Writes the statistic of the accumulator as a netCDF product """
+    with netCDF4.Dataset(acc_path) as acc:
+        acc.set_auto_maskandscale(False)
+        variable_spec = product_spec(VariableSpec(
+            name=spec.output_variable,
+            dtype=spec.dtype,
+            fill_value=spec.fill_value,
+            scale_factor=spec.scale_factor,
+            add_offset=spec.add_offset,
+            attrs={'cell_methods': f'time: {spec.statistic}', **spec.attrs}), group_name)
+        return write_netcdf_product(
+            file_out, _statistic_blocks(acc, spec, rows), variable_spec,
+            transform=Affine.from_gdal(*map(float, acc.getncattr('transform').split())),
+            crs=acc.getncattr('crs') or None,
+            width=len(acc.dimensions['x']), height=len(acc.dimensions['y']),
+            global_attrs={'reference_dates': acc.getncattr('reference_dates')})
+
+
+__all__ = [
+    'AGGREGATION_TASK',
+    'Period',
+    'AggregationSpec',
+    'aggregation_spec',
+    'is_aggregation_pipeline',
+    'period_of',
+    'period_dekads',
+    'aggregation_output',
+    'accumulator_path',
+    'folded_dates',
+    'fold_product',
+    'write_aggregation'
+]
@@ -23,6 +23,8 @@ from subprocess import Popen, PIPE
 
 from django.conf import settings
 
+from eo_engine.common.gdal_profile import command_line_args, translate_kwargs
+
 GDAL_TRANSLATE = settings.GDAL_TRANSLATE
 GDAL_WARP = settings.GDAL_WRAP
 
@@ -142,7 +144,7 @@ class H5Georef(object):
         outFileName = self.h5FilePath.as_posix() + "_ET.tif"
 
         # Prepare the gdal_translate command
-        translateCommand = [GDAL_TRANSLATE, '-r', 'bilinear', '-ot',
+        translateCommand = [GDAL_TRANSLATE, *command_line_args(GDAL_TRANSLATE), '-r', 'bilinear', '-ot',
                             'Float32', '-a_nodata', str(selectedArrays.get('missingValue')), \
                             '-a_srs', str(self.GEOSProjString), '-scale', str(selectedArrays.get('oldMin')), \
                             str(selectedArrays.get('oldMax')), str(selectedArrays.get('min')),
@@ -172,7 +174,7 @@ class H5Georef(object):
         inFileName = self.h5FilePath.as_posix() + "_ET.tif"
         outFileName = self.h5FilePath.as_posix() + "_ET_GCS.tif"
 
-        warpCommand = [GDAL_WARP, '-overwrite', '-r', 'bilinear', '-tr',
+        warpCommand = [GDAL_WARP, *command_line_args(GDAL_WARP), '-overwrite', '-r', 'bilinear', '-tr',
                        '0.0275', '0.0275', '-dstnodata', str(missingValue), '-te', '-30', '-40', '60', '40', '-s_srs',
                        str(self.GEOSProjString), \
                        '-t_srs', str(projectionString), inFileName, outFileName]
@@ -184,7 +186,7 @@ class H5Georef(object):
         # convert to netcdf
         tiffile = self.h5FilePath.as_posix() + "_ET_GCS.tif"
         # print("\nConverting file: %s" % tiffile)
-        optionsNC2 = gdal.TranslateOptions(format='netCDF')
+        optionsNC2 = gdal.TranslateOptions(format='netCDF', **translate_kwargs('netCDF'))
         # Use Gdal to open the file
         ds = gdal.Open(tiffile)
         gdal.Translate(srcDS=ds, destName=myfile.as_posix(), options=optionsNC2)
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, NamedTuple
 
 from more_itertools import chunked
@@ -356,14 +357,8 @@ cube_measures = {
     'L3_LAM_QUAL_NDVI_LT': [['ACC', 'Accuracy']], 'L3_ODN_QUAL_NDVI_LT': [['ACC', 'Accuracy']],
     'L3_ZAN_QUAL_NDVI_LT': [['ACC', 'Accuracy']]}
 
-cubes: List[Cube] = [
-    Cube(
-        code=code,
-        caption=description,
-        dimensions=[Dimension(*v) for v in cube_dimension[code]],
-        measure=[Measure(*v) for v in cube_measures[code]]
-    )
-    for code, description in _by_twos([
+# code, caption of every cube
+_cube_captions = [
         "L1_GBWP_A",
         "Gross Biomass Water Productivity",
         "L1_NBWP_A",
@@ -912,7 +907,27 @@ cubes: List[Cube] = [
         "Quality of Normalized Difference Vegetation Index (Office du Niger, Mali - Long Term)",
         "L3_ZAN_QUAL_NDVI_LT",
         "Quality of Normalized Difference Vegetation Index (Zankalon, Egypt - Long Term)"
-    ])]
+]
+
+
+@lru_cache(maxsize=None)
+def get_cubes() -> List[Cube]:
+    """ The cubes of the catalogue. Built on first use: the workers that never touch WAPOR don't pay for it """
+    return [
+        Cube(
+            code=code,
+            caption=description,
+            dimensions=[Dimension(*v) for v in cube_dimension[code]],
+            measure=[Measure(*v) for v in cube_measures[code]]
+        )
+        for code, description in _by_twos(_cube_captions)]
+
+
+def __getattr__(name: str):
+    # `cubes` is still importable from the module
+    if name == 'cubes':
+        return get_cubes()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 @dataclass
@@ -1,6 +1,6 @@
 import re
 from datetime import datetime
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import Optional, Dict, Type, TypeVar, Iterator, Union
 from uuid import UUID
 
@@ -9,7 +9,7 @@ from dateutil.relativedelta import relativedelta
 from requests import HTTPError
 
 from eo_engine.errors import AfriCultuReSMisconfiguration
-from .wapor2_wapor_data import cubes, WAPORVersion, Variable, BBox, default_wapor_version
+from .wapor2_wapor_data import get_cubes, WAPORVersion, Variable, BBox, default_wapor_version
 
 _D = TypeVar("_D")
 
@@ -37,16 +37,17 @@ def requires_login(method):
     return wrapper
 
 
-_products = [Variable(cube=cube) for cube in cubes]
-
-
+@lru_cache(maxsize=None)
 def _build_index() -> Dict[str, Variable]:
-    return dict((r.cube.code.upper(), r) for r in _products)
-
+    """ The variables by (upper case) cube code. Built on first lookup """
+    return dict((cube.code.upper(), Variable(cube=cube)) for cube in get_cubes())
 
-_by_name = _build_index()
 
-variable_by_name = _by_name
+def __getattr__(name: str):
+    # the index used to be built on import, `variable_by_name` is still importable
+    if name == 'variable_by_name':
+        return _build_index()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 class NotFound:
@@ -57,7 +58,7 @@ class _VariableLookup:
     @staticmethod
     def get(key: str, default=Type[NotFound]):
         key = key.upper()
-        r = _by_name.get(key, default)
+        r = _build_index().get(key, default)
 
         if r == NotFound:
             raise KeyError(key)
@@ -67,10 +68,10 @@ class _VariableLookup:
     __getitem__ = get
 
     def __len__(self) -> int:
-        return len(_products)
+        return len(_build_index())
 
     def __iter__(self) -> Iterator[Variable]:
-        return iter(_products)
+        return iter(_build_index().values())
 
     def __contains__(self, item: str) -> bool:
         try:
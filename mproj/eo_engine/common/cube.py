@@ -0,0 +1,244 @@
+"""
+Time-chunked cube store of the products of a group.
+
+The products are stored one file per date, so the time series of a pixel opens one file per date. For the
+groups in settings.CUBE_STORE_GROUPS, every READY product is also appended to a netCDF cube with an
+unlimited time dimension, chunked (time_chunk, chunk, chunk): a pixel time series reads one column of
+chunks and a bbox time series only the chunks that intersect the bbox.
+
+The cube keeps the raw values of the products and their scale_factor/add_offset/_FillValue; the extraction
+functions return physical values. A product that is appended again (e.g. regenerated) overwrites its slice.
+The cubes are derived data: `manage.py cube_extract --rebuild` makes a cube again from the products.
+"""
+import datetime
+import os
+from fnmatch import fnmatchcase
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import netCDF4
+import numpy as np
+from affine import Affine
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from rasterio.windows import Window
+
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.common.raster import Bounds, iter_row_windows
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct
+
+logger: Logger = get_task_logger(__name__)
+
+TIME_UNITS = 'days since 1970-01-01'
+
+CubeConfig = NamedTuple('CubeConfig', [
+    # netCDF variable of the products. None for single band rasters
+    ('variable', Optional[str]),
+    ('time_chunk', int),
+    # spatial chunk size (rows and cols)
+    ('chunk', int),
+    ('complevel', int)
+])
+
+DEFAULT_CUBE_CONFIG = CubeConfig(variable=None, time_chunk=36, chunk=128, complevel=1)
+
+TimeSeries = NamedTuple('TimeSeries', [
+    ('dates', List[datetime.date]),
+    # (time, rows, cols) physical values, NaN where there is no value
+    ('values', np.ndarray),
+    # transform of the extracted window
+    ('transform', Affine)
+])
+
+
+def cube_config(group_name: str) -> Optional[CubeConfig]:
+    """ The cube configuration of a product group (first matching pattern), or None if it has no cube """
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'CUBE_STORE_GROUPS', {})
+    for pattern, values in configured.items():
+        if fnmatchcase(group_name, pattern):
+            return DEFAULT_CUBE_CONFIG._replace(**values)
+    return None
+
+
+def cube_path(group_name: str) -> Path:
+    root = Path(getattr(settings, 'CUBE_STORE_ROOT', settings.MEDIA_ROOT / 'cubes'))
+    return root / f'{group_name}.nc'
+
+
+def cube_lock_key(group_name: str) -> str:
+    """ advisory_lock key of the cube of a group. The lock is reentrant within a database session """
+    return f'cube:{group_name}'
+
+
+def _input_path(file_path: Path, config: CubeConfig) -> str:
+    path = file_path.as_posix()
+    return path if config.variable is None else f'NETCDF:"{path}":{config.variable}'
+
+
+def _create_cube(path: Path, src, config: CubeConfig):
+    """ An empty cube on the (north-up) grid of the rasterio dataset src """
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('y', src.height)
+        dst.createDimension('x', src.width)
+        time_var = dst.createVariable('time', 'f8', ('time',))
+        time_var.setncatts({'units': TIME_UNITS, 'calendar': 'standard', 'standard_name': 'time'})
+        # mtime of the product file of every slice, to skip appending the same file twice
+        dst.createVariable('source_mtime', 'f8', ('time',))
+        dst.createVariable('y', 'f8', ('y',))[:] = src.transform.f + src.transform.e * (np.arange(src.height) + 0.5)
+        dst.createVariable('x', 'f8', ('x',))[:] = src.transform.c + src.transform.a * (np.arange(src.width) + 0.5)
+
+        chunksizes = (config.time_chunk, min(config.chunk, src.height), min(config.chunk, src.width))
+        # no nodata: every value is valid, no _FillValue (None would set the netCDF default one)
+        var = dst.createVariable('values', src.dtypes[0], ('time', 'y', 'x'),
+                                 fill_value=False if src.nodata is None else src.nodata, chunksizes=chunksizes,
+                                 zlib=config.complevel > 0, complevel=config.complevel, shuffle=True)
+        var.setncatts({'scale_factor': src.scales[0], 'add_offset': src.offsets[0]})
+        dst.setncatts({
+            'transform': ' '.join(str(v) for v in src.transform.to_gdal()),
+            'crs': src.crs.to_wkt() if src.crs else ''})
+
+
+def append_file(path: Path, file_path: Path, reference_date: datetime.date, config: CubeConfig,
+                rows: int = 1024) -> bool:
+    """ Writes the product file file_path into the slice of reference_date of the cube at path (a new slice or
+    the one of its date). Returns False if the cube already has this file. The caller holds the lock of the cube. """
+    import rasterio
+
+    mtime = os.path.getmtime(file_path)
+    days = (reference_date - datetime.date(1970, 1, 1)).days
+
+    with rasterio.open(_input_path(file_path, config)) as src:
+        if not path.exists():
+            _create_cube(path, src, config)
+        with netCDF4.Dataset(path, 'a') as cube:
+            cube.set_auto_maskandscale(False)
+            if (len(cube.dimensions['y']), len(cube.dimensions['x'])) != (src.height, src.width) or \
+                    not np.allclose(Affine.from_gdal(*map(float, cube.getncattr('transform').split())),
+                                    src.transform, atol=1e-9):
+                raise AfriCultuReSError(f'{file_path.name} is not on the grid of the cube {path.name}')
+
+            times = cube.variables['time'][:]
+            existing = np.flatnonzero(times == days)
+            if existing.size:
+                index = int(existing[0])
+                if cube.variables['source_mtime'][index] == mtime:
+                    return False
+            else:
+                index = times.size
+            var = cube.variables['values']
+            for window in iter_row_windows(src.width, src.height, rows=rows):
+                row = int(window.row_off)
+                var[index, row:row + int(window.height), :] = src.read(1, window=window)
+            cube.variables['time'][index] = days
+            cube.variables['source_mtime'][index] = mtime
+
+    logger.info(f'Appended {file_path.name} to the cube {path.name} at {index}')
+    return True
+
+
+def append_product(eo_product: EOProduct, rows: int = 1024) -> bool:
+    """ Writes the product into its slice of the cube of its group (a new one or the one of its date).
+    Returns False if the cube already has this file. """
+    config = cube_config(eo_product.group.name)
+    if config is None:
+        raise AfriCultuReSError(f'The group {eo_product.group.name} has no cube store')
+    path = cube_path(eo_product.group.name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with advisory_lock(cube_lock_key(eo_product.group.name)):
+        return append_file(path, Path(eo_product.file.path), eo_product.reference_date, config, rows=rows)
+
+
+def _time_indices(cube: netCDF4.Dataset,
+                  date_from: Optional[datetime.date],
+                  date_to: Optional[datetime.date]) -> Tuple[np.ndarray, List[datetime.date]]:
+    """ Indices of the slices in [date_from, date_to], in date order """
+    times = np.asarray(cube.variables['time'][:])
+    selected = np.ones(times.shape, dtype=bool)
+    if date_from is not None:
+        selected &= times >= (date_from - datetime.date(1970, 1, 1)).days
+    if date_to is not None:
+        selected &= times <= (date_to - datetime.date(1970, 1, 1)).days
+    indices = np.flatnonzero(selected)
+    indices = indices[np.argsort(times[indices], kind='stable')]
+    return indices, [datetime.date(1970, 1, 1) + datetime.timedelta(days=int(times[i])) for i in indices]
+
+
+def _read(cube: netCDF4.Dataset, indices: np.ndarray, window: Window) -> np.ndarray:
+    """ Physical values of the window at the time indices. Reads one contiguous time range. """
+    var = cube.variables['values']
+    var.set_auto_maskandscale(False)
+    rows = slice(int(window.row_off), int(window.row_off + window.height))
+    cols = slice(int(window.col_off), int(window.col_off + window.width))
+    if indices.size == 0:
+        return np.empty((0, rows.stop - rows.start, cols.stop - cols.start), dtype='f8')
+    first, last = int(indices.min()), int(indices.max())
+    raw = var[first:last + 1, rows, cols][indices - first]
+    values = raw.astype('f8') * getattr(var, 'scale_factor', 1.0) + getattr(var, 'add_offset', 0.0)
+    fill = getattr(var, '_FillValue', None)
+    if fill is not None:
+        values[raw == fill] = np.nan
+    return values
+
+
+def _extract(group_name: str, window_of, date_from: Optional[datetime.date],
+             date_to: Optional[datetime.date]) -> TimeSeries:
+    """ window_of(transform, height, width) -> the Window of the cube to read """
+    path = cube_path(group_name)
+    if not path.exists():
+        raise AfriCultuReSError(f'There is no cube for {group_name}')
+    with netCDF4.Dataset(path) as cube:
+        transform = Affine.from_gdal(*map(float, cube.getncattr('transform').split()))
+        window = window_of(transform, len(cube.dimensions['y']), len(cube.dimensions['x']))
+        indices, dates = _time_indices(cube, date_from, date_to)
+        return TimeSeries(dates=dates, values=_read(cube, indices, window),
+                          transform=transform * Affine.translation(int(window.col_off), int(window.row_off)))
+
+
+def extract_window(group_name: str, bounds: Bounds,
+                   date_from: Optional[datetime.date] = None,
+                   date_to: Optional[datetime.date] = None) -> TimeSeries:
+    """ Time series of the pixels of the cube that intersect bounds (xmin, ymin, xmax, ymax) """
+
+    def window_of(transform: Affine, height: int, width: int) -> Window:
+        xmin, ymin, xmax, ymax = bounds
+        col_min, row_min = ~transform * (xmin, ymax)
+        col_max, row_max = ~transform * (xmax, ymin)
+        col_min, row_min = max(int(np.floor(col_min)), 0), max(int(np.floor(row_min)), 0)
+        col_max, row_max = min(int(np.ceil(col_max)), width), min(int(np.ceil(row_max)), height)
+        if col_min >= col_max or row_min >= row_max:
+            raise AfriCultuReSError(f'{bounds} does not intersect the cube of {group_name}')
+        return Window(col_min, row_min, col_max - col_min, row_max - row_min)
+
+    return _extract(group_name, window_of, date_from, date_to)
+
+
+def extract_point(group_name: str, x: float, y: float,
+                  date_from: Optional[datetime.date] = None,
+                  date_to: Optional[datetime.date] = None) -> List[Tuple[datetime.date, Optional[float]]]:
+    """ Time series of the pixel at (x, y), in the crs of the cube. None where there is no value """
+
+    def window_of(transform: Affine, height: int, width: int) -> Window:
+        col, row = (int(np.floor(v)) for v in ~transform * (x, y))
+        if not (0 <= col < width and 0 <= row < height):
+            raise AfriCultuReSError(f'({x}, {y}) is outside of the cube of {group_name}')
+        return Window(col, row, 1, 1)
+
+    series = _extract(group_name, window_of, date_from, date_to)
+    return [(d, None if np.isnan(v) else float(v)) for d, v in zip(series.dates, series.values[:, 0, 0])]
+
+
+__all__ = [
+    'CubeConfig',
+    'TimeSeries',
+    'cube_config',
+    'cube_path',
+    'cube_lock_key',
+    'append_file',
+    'append_product',
+    'extract_window',
+    'extract_point'
+]
@@ -1,18 +1,33 @@
+import datetime
+import re
+from contextlib import contextmanager
 from logging import Logger
 
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
 from django.utils.timezone import now
-from typing import TypedDict, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, TypedDict, Union
 
+from eo_engine.common.dependencies import enqueue_memberships
 from eo_engine.common.misc import str_to_date
+from eo_engine.common.readiness import recount_memberships
 from eo_engine.common import RemoteFile
-from eo_engine.errors import AfriCultuReSFileDoesNotExist, AfriCultuReSFileInUse
+from eo_engine.errors import AfriCultuReSError, AfriCultuReSFileDoesNotExist, AfriCultuReSFileInUse
 from eo_engine.models import CrawlerConfiguration
 from eo_engine.models import Credentials, EOSourceGroup
 from eo_engine.models import EOProduct, EOProductStateChoices
 from eo_engine.models import EOSource, EOSourceStateChoices
+from eo_engine.models import transition_eo_product, transition_eo_source
 
 DeletedReport = TypedDict('DeletedReport', {'eo_source': int, 'eo_product': int})
+IngestionReport = NamedTuple('IngestionReport', [
+    ('seen', int),
+    ('skipped', int),
+    ('created', int),
+    ('attached', int)
+])
 
 logger: Logger = get_task_logger(__name__)
 
@@ -81,8 +96,7 @@ def delete_eo_product(eo_product_pk: int) -> DeletedReport:
     if safe_self_to_remove_row:
         self.delete()
     else:
-        self.state = EOProductStateChoices.IGNORE
-        self.save()
+        transition_eo_product(self.pk, EOProductStateChoices.IGNORE)
 
     return {"eo_source": 1,
             # +1 because we delete self
@@ -116,30 +130,114 @@ def delete_eo_source(eo_source_pk: int) -> DeletedReport:
     to_delete_eo_products.delete()
 
     eo_source.file.delete(save=False)
-    eo_source.state = EOSourceStateChoices.IGNORE
-    eo_source.save()
+    transition_eo_source(eo_source.pk, EOSourceStateChoices.IGNORE, file=None)
 
     return {"eo_source": 1, "eo_product": deleted_eo_products}
 
 
-def add_to_db(remote_file: RemoteFile, eo_source_group: Union[str, EOSourceGroup]):
-    """ Adds entry in the database. Checks if entry exists based on filename"""
+def _as_group(eo_source_group: Union[str, EOSourceGroup]) -> EOSourceGroup:
     if isinstance(eo_source_group, EOSourceGroup):
-        group = eo_source_group
-    else:
-        group = EOSourceGroup.objects.get(name=eo_source_group)
-    reference_date = str_to_date(remote_file.filename, group.date_regex)
-
-    obj, created = EOSource.objects.get_or_create(
-        filename=remote_file.filename,
-        defaults={
-            'domain': remote_file.domain,
-            'url': remote_file.url,
-            'reference_date': reference_date,
-            'credentials': Credentials.objects.get(domain=remote_file.domain),
-            'datetime_seen': now(),
-            'filesize_reported': remote_file.filesize_reported,
-        }
-    )
+        return eo_source_group
+    return EOSourceGroup.objects.get(name=eo_source_group)
+
+
+def bulk_add_eo_sources(eo_sources: Iterable[EOSource], eo_source_group: EOSourceGroup,
+                        batch_size: int = 1000) -> IngestionReport:
+    """ Inserts the new eo_sources (by filename) and attaches all of them to eo_source_group: a few queries per
+    batch_size sources. Existing sources are not updated, like get_or_create. No post_save is sent, new sources
+    should be AVAILABLE_REMOTELY; no m2m_changed either: the readiness counters of the batch are recounted, and
+    the keys of the AVAILABLE_LOCALLY sources that join the group are queued. """
+    eo_sources = list({eo_source.filename: eo_source for eo_source in eo_sources}.values())
+    through = EOSource.group.through
+    created = attached = 0
+    for start in range(0, len(eo_sources), batch_size):
+        batch = eo_sources[start:start + batch_size]
+        filenames = [eo_source.filename for eo_source in batch]
+        with transaction.atomic():
+            existing = set(EOSource.objects.filter(filename__in=filenames).values_list('filename', flat=True))
+            new = [eo_source for eo_source in batch if eo_source.filename not in existing]
+            # ignore_conflicts: a concurrent scan may have inserted the same files
+            EOSource.objects.bulk_create(new, ignore_conflicts=True)
+            pks = list(EOSource.objects.filter(filename__in=filenames).values_list('pk', flat=True))
+            members = set(through.objects.filter(eosourcegroup_id=eo_source_group.pk, eosource_id__in=pks)
+                          .values_list('eosource_id', flat=True))
+            through.objects.bulk_create([
+                through(eosource_id=pk, eosourcegroup_id=eo_source_group.pk) for pk in pks
+            ], ignore_conflicts=True)
+            recount_memberships(pks, [eo_source_group.pk])
+            enqueue_memberships([pk for pk in pks if pk not in members], [eo_source_group.pk])
+        created += len(new)
+        attached += len(existing)
+    return IngestionReport(seen=len(eo_sources), skipped=0, created=created, attached=attached)
+
+
+def high_water_mark(eo_source_group: EOSourceGroup) -> Optional[datetime.date]:
+    """ The latest reference date of the group, less settings.INGESTION_LOOKBACK_DAYS for late files """
+    latest = EOSource.objects.filter(group=eo_source_group).aggregate(latest=Max('reference_date'))['latest']
+    if latest is None:
+        return None
+    return latest - datetime.timedelta(days=getattr(settings, 'INGESTION_LOOKBACK_DAYS', 7))
+
+
+def ingest_remote_files(remote_files: Iterable[RemoteFile], eo_source_group: Union[str, EOSourceGroup],
+                        use_high_water_mark: bool = True) -> IngestionReport:
+    """ Adds the entries of a remote listing to the database in bulk.
+    The entries are parsed and filtered in memory: the filenames that do not match the date_regex of the group
+    and (use_high_water_mark) the ones older than high_water_mark never reach the database. """
+    group = _as_group(eo_source_group)
+    pattern = re.compile(group.date_regex, re.IGNORECASE)
+    mark = high_water_mark(group) if use_high_water_mark else None
+    credentials: Dict[str, Optional[Credentials]] = {}
+    seen_at = now()
+
+    seen = skipped = 0
+    eo_sources: List[EOSource] = []
+    for remote_file in remote_files:
+        seen += 1
+        try:
+            reference_date = str_to_date(remote_file.filename, pattern)
+        except AfriCultuReSError:
+            logger.warning(f'{remote_file.filename} does not match the date_regex of {group.name}, skipped')
+            skipped += 1
+            continue
+        if mark is not None and reference_date < mark:
+            skipped += 1
+            continue
+        if remote_file.domain not in credentials:
+            credentials[remote_file.domain] = Credentials.objects.filter(domain=remote_file.domain).first()
+        eo_sources.append(EOSource(
+            filename=remote_file.filename,
+            domain=remote_file.domain,
+            url=remote_file.url,
+            reference_date=reference_date,
+            credentials=credentials[remote_file.domain],
+            datetime_seen=seen_at,
+            filesize_reported=remote_file.filesize_reported,
+            state=EOSourceStateChoices.AVAILABLE_REMOTELY
+        ))
+
+    report = bulk_add_eo_sources(eo_sources, group)
+    report = report._replace(seen=seen, skipped=skipped)
+    logger.info(f'{group.name}: {report.seen} entries, {report.skipped} skipped (high-water mark {mark}), '
+                f'{report.created} new, {report.attached} known')
+    return report
 
-    obj.group.add(group)
+
+def add_to_db(remote_file: RemoteFile, eo_source_group: Union[str, EOSourceGroup]):
+    """ Adds entry in the database. Checks if entry exists based on filename"""
+    ingest_remote_files([remote_file], eo_source_group, use_high_water_mark=False)
+
+
+@contextmanager
+def advisory_lock(key: str):
+    """ Cross-process (and cross-worker) lock, a PostgreSQL session advisory lock on the hash of key.
+    Blocks until the lock is free. """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(hashtext(%s))', [key])
+    logger.info(f'Acquired lock: {key}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', [key])
+        logger.info(f'Released lock: {key}')
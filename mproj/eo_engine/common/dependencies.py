@@ -0,0 +1,157 @@
+"""
+Debounced dependency resolution: which products can be made from the available sources.
+
+Saving an EOSource that is AVAILABLE_LOCALLY only queues its (group, reference_date) keys (PendingDependency,
+one upsert). The resolver task takes the keys that have been quiet for settings.DEPENDENCY_RESOLVER_DEBOUNCE
+seconds and resolves them in batches: per pipeline that uses the groups, one query reads the readiness
+counters of all the dates (eo_engine.common.readiness), then the missing products are bulk-created and the
+state of the existing ones bulk-updated. A burst of saves of the same key (download states, re-saves) is resolved once.
+
+Only AVAILABLE, MISSING_SOURCE and FAILED products are updated (a FAILED product whose inputs are available
+again becomes AVAILABLE); SCHEDULED, GENERATING, READY and IGNOREd products are left alone.
+"""
+import datetime
+from collections import defaultdict
+from logging import Logger
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from eo_engine.common.readiness import is_ready, pipeline_readiness
+from eo_engine.models import (EOProduct, EOProductStateChoices, EOSource, EOSourceGroup, EOSourceStateChoices,
+                              PendingDependency, Pipeline, StateTransition)
+
+logger: Logger = get_task_logger(__name__)
+
+DependencyKey = Tuple[int, datetime.date]
+
+# the states of a product that the resolution sets
+RESOLVED_STATES = (EOProductStateChoices.AVAILABLE, EOProductStateChoices.MISSING_SOURCE)
+# the states of a product that the resolution may change
+UPDATABLE_STATES = RESOLVED_STATES + (EOProductStateChoices.FAILED,)
+
+ResolutionReport = NamedTuple('ResolutionReport', [
+    ('keys', int),
+    ('created', int),
+    ('updated', int)
+])
+
+
+def enqueue_dependencies(eo_source: Union[EOSource, StateTransition]):
+    """ Queues (or refreshes) the (group, reference_date) keys of all the groups of eo_source (or of the source of
+    a transition) """
+    through = EOSource.group.through._meta
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {PendingDependency._meta.db_table} (group_id, reference_date, enqueued_at) '
+            f'SELECT {through.get_field("eosourcegroup").column}, %s, %s FROM {through.db_table} '
+            f'WHERE {through.get_field("eosource").column} = %s '
+            f'ON CONFLICT (group_id, reference_date) DO UPDATE SET enqueued_at = EXCLUDED.enqueued_at',
+            [eo_source.reference_date, timezone.now(), eo_source.pk])
+
+
+def enqueue_memberships(eo_source_pks: Iterable[int], group_pks: Iterable[int]):
+    """ Queues the (group, reference_date) keys of the AVAILABLE_LOCALLY sources of eo_source_pks in the groups of
+    group_pks, in one statement: the bulk inserts of memberships send no m2m_changed """
+    through = EOSource.group.through._meta
+    group_column = through.get_field('eosourcegroup').column
+    source_column = through.get_field('eosource').column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {PendingDependency._meta.db_table} (group_id, reference_date, enqueued_at) '
+            f'SELECT DISTINCT m.{group_column}, s.reference_date, %s::timestamptz FROM {through.db_table} m '
+            f'JOIN {EOSource._meta.db_table} s ON s.id = m.{source_column} '
+            f'WHERE m.{source_column} = ANY(%s) AND m.{group_column} = ANY(%s) AND s.state = %s '
+            f'ON CONFLICT (group_id, reference_date) DO UPDATE SET enqueued_at = EXCLUDED.enqueued_at',
+            [timezone.now(), list(eo_source_pks), list(group_pks), EOSourceStateChoices.AVAILABLE_LOCALLY])
+
+
+def resolve_pipeline(pipeline: Pipeline, dates: Iterable[datetime.date]) -> Tuple[int, int]:
+    """ Creates or updates the output products of pipeline for dates. Returns (created, updated) """
+    dates = sorted(set(dates))
+    if not dates:
+        return 0, 0
+    input_group_ids = [group.pk for group in pipeline.input_groups.all()]
+    if EOSourceGroup.objects.filter(pk__in=input_group_ids).count() != len(input_group_ids):
+        logger.error(f'{pipeline}: all the input groups should be EOSource groups, skipped')
+        return 0, 0
+    output_group = pipeline.output_group.as_eoproduct_group()
+
+    target: Dict[datetime.date, str] = {
+        date: EOProductStateChoices.AVAILABLE if is_ready(expected, available) else EOProductStateChoices.MISSING_SOURCE
+        for date, (expected, available) in pipeline_readiness(pipeline, dates).items()}
+    existing: Dict[datetime.date, str] = dict(
+        EOProduct.objects.filter(group=output_group, reference_date__in=target).values_list('reference_date', 'state'))
+
+    created = EOProduct.objects.bulk_create([
+        EOProduct(filename=pipeline.output_filename(YYYYMMDD=date.strftime('%Y%m%d'), YYYY=date.strftime('%Y')),
+                  group=output_group, reference_date=date, state=state)
+        for date, state in target.items() if date not in existing], ignore_conflicts=True)
+
+    updated = 0
+    for state in RESOLVED_STATES:
+        stale = [date for date, current in existing.items()
+                 if target[date] == state and current != state and current in UPDATABLE_STATES]
+        if stale:
+            updated += EOProduct.objects.filter(group=output_group, reference_date__in=stale,
+                                                state__in=UPDATABLE_STATES).update(state=state)
+    return len(created), updated
+
+
+def resolve_keys(keys: Iterable[DependencyKey]) -> ResolutionReport:
+    """ Resolves the products of all the pipelines that use the groups of keys """
+    dates_of_group: Dict[int, Set[datetime.date]] = defaultdict(set)
+    for group_id, reference_date in keys:
+        dates_of_group[group_id].add(reference_date)
+
+    created = updated = 0
+    pipelines = Pipeline.objects.filter(input_groups__in=list(dates_of_group)).distinct() \
+        .select_related('output_group').prefetch_related('input_groups')
+    for pipeline in pipelines:
+        dates = set().union(*(dates_of_group.get(group.pk, ()) for group in pipeline.input_groups.all()))
+        pipeline_created, pipeline_updated = resolve_pipeline(pipeline, dates)
+        created += pipeline_created
+        updated += pipeline_updated
+    return ResolutionReport(keys=sum(len(d) for d in dates_of_group.values()), created=created, updated=updated)
+
+
+def drain_pending_dependencies(debounce: Optional[float] = None, batch_size: Optional[int] = None) -> ResolutionReport:
+    """ Resolves the pending keys that are quiet for debounce seconds, batch_size keys per transaction.
+    Concurrent resolvers skip the keys that another one holds. """
+    if debounce is None:
+        debounce = getattr(settings, 'DEPENDENCY_RESOLVER_DEBOUNCE', 30)
+    if batch_size is None:
+        batch_size = getattr(settings, 'DEPENDENCY_RESOLVER_BATCH_SIZE', 5000)
+    cutoff = timezone.now() - datetime.timedelta(seconds=debounce)
+
+    total = ResolutionReport(keys=0, created=0, updated=0)
+    while True:
+        with transaction.atomic():
+            batch: List[Tuple[int, int, datetime.date]] = list(
+                PendingDependency.objects.select_for_update(skip_locked=True)
+                .filter(enqueued_at__lte=cutoff)
+                .order_by('enqueued_at')
+                .values_list('pk', 'group_id', 'reference_date')[:batch_size])
+            if not batch:
+                break
+            report = resolve_keys((group_id, reference_date) for _, group_id, reference_date in batch)
+            PendingDependency.objects.filter(pk__in=[pk for pk, _, _ in batch]).delete()
+        logger.info(f'Resolved {report.keys} keys: {report.created} products created, {report.updated} updated')
+        total = ResolutionReport(*(a + b for a, b in zip(total, report)))
+        if len(batch) < batch_size:
+            break
+    return total
+
+
+__all__ = [
+    'DependencyKey',
+    'ResolutionReport',
+    'enqueue_dependencies',
+    'enqueue_memberships',
+    'resolve_pipeline',
+    'resolve_keys',
+    'drain_pending_dependencies'
+]
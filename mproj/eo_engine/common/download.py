@@ -5,20 +5,32 @@ from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import List, TypedDict
 
-import sentinelsat
 from celery.utils.log import get_task_logger
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.db import connections
 from requests import HTTPError, Response
-from sentinelsat import InvalidChecksumError
 
 from eo_engine.errors import AfriCultuReSRetriableError, AfriCultuReSError
-from eo_engine.models import EOSource, EOSourceStateChoices, EOSourceGroupChoices
+from eo_engine.models import EOSource, EOSourceStateChoices, EOSourceGroupChoices, transition_eo_source
 
 logger: Logger = get_task_logger(__name__)
 
 
+def mark_downloaded(eo_source: EOSource) -> bool:
+    """ The file of eo_source is stored: sets it and AVAILABLE_LOCALLY in one conditional update (see
+    eo_engine.models.transitions). A source IGNOREd during the download stays IGNOREd """
+    downloaded = transition_eo_source(
+        eo_source.pk, EOSourceStateChoices.AVAILABLE_LOCALLY,
+        from_states=[state for state in EOSourceStateChoices.values if state != EOSourceStateChoices.IGNORE],
+        file=eo_source.file)
+    if downloaded:
+        eo_source.state = EOSourceStateChoices.AVAILABLE_LOCALLY
+    else:
+        logger.warning(f'{eo_source.filename} was IGNOREd during the download')
+    return downloaded
+
+
 def download_http_eosource(pk_eosource: int) -> str:
     import requests
 
@@ -60,8 +72,6 @@ def download_http_eosource(pk_eosource: int) -> str:
         FILE_LENGTH = headers.get('Content-Length', None)
         logger.info(f'LOG:INFO: File length is {FILE_LENGTH} bytes')
 
-        eo_source.set_status(EOSourceStateChoices.DOWNLOADING)
-
         with NamedTemporaryFile() as file_handle:
             # TemporaryFile has noname, and will cease to exist when it is closed.
 
@@ -81,8 +91,7 @@ def download_http_eosource(pk_eosource: int) -> str:
             eo_source.file.save(name=eo_source.filename, content=content, save=False)
 
             eo_source.filesize = eo_source.file.size
-            eo_source.state = EOSourceStateChoices.AVAILABLE_LOCALLY
-            eo_source.save()
+            mark_downloaded(eo_source)
 
         if len(manifest['auxiliary_files']) > 0:
             aux_file_url: str
@@ -129,9 +138,7 @@ def download_ftp_eosource(pk_eosource: int) -> str:
         eo_source = EOSource.objects.get(pk=pk_eosource)
         eo_source.file.save(name=eo_source.filename, content=content, save=False)
         eo_source.filesize = eo_source.file.size
-        eo_source.set_status(EOSourceStateChoices.AVAILABLE_LOCALLY)
-
-        eo_source.save()
+        mark_downloaded(eo_source)
 
     return eo_source.file.name
 
@@ -151,9 +158,7 @@ def download_sftp_eosource(pk_eosource: int) -> str:
         content = File(temp_file)
         eo_source.file.save(name=eo_source.filename, content=content, save=False)
         eo_source.filesize = eo_source.file.size
-        eo_source.set_status(EOSourceStateChoices.AVAILABLE_LOCALLY)
-
-        eo_source.save()
+        mark_downloaded(eo_source)
 
     return eo_source.file.name
 
@@ -169,7 +174,7 @@ def download_wapor_eosource(pk_eosource: int) -> str:
             remoteVariable.set_api_key(api_key=eo_source.credentials.api_key)
             remoteJob = remoteVariable.submit()
             eo_source.url = f'wapor://{remoteJob.job_id}'
-            eo_source.save()
+            eo_source.save(update_fields=['url'])
 
             raise AfriCultuReSRetriableError('Job Submitted. ')
         # case II
@@ -182,7 +187,7 @@ def download_wapor_eosource(pk_eosource: int) -> str:
         logger.info(f'job_status:{remoteJob.job_status}')
         if remoteJob.response_status == 404:
             eo_source.url = 'wapor://'
-            eo_source.save()
+            eo_source.save(update_fields=['url'])
             raise AfriCultuReSError('job was not found on remote server')
         elif remoteJob.response_status == 200 and remoteJob.job_status == 'RUNNING':
             raise AfriCultuReSRetriableError('Job is currently Running')
@@ -191,14 +196,11 @@ def download_wapor_eosource(pk_eosource: int) -> str:
         elif remoteJob.response_status == 200 and remoteJob.job_status == 'COMPLETED WITH ERRORS':
             error_log: List[str] = remoteJob.process_log()
             eo_source.url = 'wapor://'
-            eo_source.save()
+            eo_source.save(update_fields=['url'])
             error_log.insert(0, f'--WAPOR ERROR LOG--\n{remoteJob.job_url()}')
             raise AfriCultuReSError('\n'.join(error_log))
         elif remoteJob.response_status == 200 and remoteJob.job_status == 'COMPLETED':
             with NamedTemporaryFile() as file_handle:
-                eo_source.set_status(EOSourceStateChoices.DOWNLOADING)
-                eo_source.save()
-
                 url = remoteJob.download_url()
                 response = wp.get(url, stream=True)
                 for chunk in response.iter_content(chunk_size=2 * 1024):
@@ -211,18 +213,17 @@ def download_wapor_eosource(pk_eosource: int) -> str:
                 eosource.file.save(name=eosource.filename, content=content, save=False)
 
                 eosource.filesize = eosource.file.size
-                eosource.state = EOSourceStateChoices.AVAILABLE_LOCALLY
-                eosource.save()
+                mark_downloaded(eosource)
 
                 return eo_source.filename
         else:
             eo_source.url = 'wapor://'
-            eo_source.save()
+            eo_source.save(update_fields=['url'])
             raise AfriCultuReSError(f'Unhandled case!!. Job_url: {remoteJob.job_url()}')
 
 
 def download_sentinel_resource(pk_eosource: int) -> str:
-    from sentinelsat import SentinelAPI
+    from sentinelsat import InvalidChecksumError, LTATriggered, SentinelAPI
     eo_source = EOSource.objects.get(pk=pk_eosource)
     credentials = eo_source.credentials
     username = credentials.username
@@ -239,7 +240,7 @@ def download_sentinel_resource(pk_eosource: int) -> str:
         except InvalidChecksumError as e:
             logger.error('The download file failed the checksum')
             raise AfriCultuReSError('Checksum Mismatch') from e
-        except sentinelsat.LTATriggered as e:
+        except LTATriggered as e:
             raise AfriCultuReSError(
                 "Download failed due to product being in the Long Term Archive and retrieval from LTA was triggered") from e
         except BaseException as e:
@@ -253,7 +254,6 @@ def download_sentinel_resource(pk_eosource: int) -> str:
         eosource.file.save(name=eosource.filename, content=content, save=False)
 
         eosource.filesize = eosource.file.size
-        eosource.state = EOSourceStateChoices.AVAILABLE_LOCALLY
-        eosource.save()
+        mark_downloaded(eosource)
 
     return eo_source.filename
@@ -0,0 +1,211 @@
+"""
+GDAL performance profiles.
+
+A profile carries the GDAL knobs that depend on the node a task runs on: threads, warp memory, block cache,
+VSI cache and the creation options of the written rasters. Profiles are configured per task name in
+settings.GDAL_PERFORMANCE_PROFILES; the 'default' entry is the base that every task profile overrides.
+
+The profile of a task is activated by the task_prerun signal (see mproj.celery). Activation exports the
+configuration options to the environment, so they apply to osgeo.gdal, to rasterio and to the GDAL command
+line tools that the tasks run as subprocesses. The helpers below translate the active profile to
+gdal.Warp/gdal.Translate keyword arguments, rasterio creation options and command line arguments.
+
+The tiling, block size, compression and predictor of the GeoTIFF products of a group are set by the layout of the
+group (settings.PRODUCT_LAYOUT_PROFILES, see eo_engine.common.layout): when a writer passes group_name, the layout
+options replace the GTiff options of the profile. The GTiff options of the profile apply to the other rasters
+(intermediate files, writers without a group) and to the options the layout does not set, e.g. BIGTIFF.
+"""
+import os
+import sys
+from logging import Logger
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+logger: Logger = get_task_logger(__name__)
+
+GDALProfile = NamedTuple('GDALProfile', [
+    # GDAL_NUM_THREADS and the warper NUM_THREADS. An int or 'ALL_CPUS'
+    ('num_threads', Union[int, str]),
+    # gdalwarp -wm, in MB
+    ('warp_memory_mb', int),
+    # GDAL_CACHEMAX, in MB
+    ('cache_max_mb', int),
+    # VSI_CACHE / VSI_CACHE_SIZE, for reads of /vsizip/, /vsigzip/ and /vsicurl/ files
+    ('vsi_cache', bool),
+    ('vsi_cache_size_mb', int),
+    # {driver: {OPTION: value}}, e.g. {'GTiff': {'TILED': 'YES', 'COMPRESS': 'LZW'}}
+    ('creation_options', Dict[str, Dict[str, Any]])
+])
+
+DEFAULT_PROFILE = GDALProfile(
+    num_threads='ALL_CPUS',
+    warp_memory_mb=512,
+    cache_max_mb=512,
+    vsi_cache=True,
+    vsi_cache_size_mb=64,
+    creation_options={
+        'GTiff': {'TILED': 'YES', 'BLOCKXSIZE': 512, 'BLOCKYSIZE': 512, 'COMPRESS': 'LZW', 'BIGTIFF': 'IF_SAFER'},
+        'netCDF': {'FORMAT': 'NC4', 'COMPRESS': 'DEFLATE', 'ZLEVEL': 4}
+    }
+)
+
+# the GTiff options set by the layout of a product group (eo_engine.common.layout.gtiff_creation_options)
+LAYOUT_GTIFF_OPTIONS = ('TILED', 'BLOCKXSIZE', 'BLOCKYSIZE', 'COMPRESS', 'PREDICTOR')
+
+_active_profile: Optional[GDALProfile] = None
+_previous_environment: Dict[str, Optional[str]] = {}
+# gdal.GetCacheMax() before the activation, restored on deactivation: pool processes run many tasks
+_previous_cache_max: Optional[int] = None
+
+
+def _merge(profile: GDALProfile, overrides: Dict[str, Any]) -> GDALProfile:
+    values = profile._asdict()
+    for key, value in overrides.items():
+        if key not in values:
+            logger.warning(f'Unknown GDAL profile option: {key}')
+            continue
+        if key == 'creation_options':
+            merged = {driver: dict(options) for driver, options in values[key].items()}
+            for driver, options in value.items():
+                merged.setdefault(driver, {}).update(options)
+            value = merged
+        values[key] = value
+    return GDALProfile(**values)
+
+
+def get_gdal_profile(task_name: Optional[str] = None) -> GDALProfile:
+    """ The profile of task_name (short or full dotted name): the defaults updated by the 'default' and by
+    the task entry of settings.GDAL_PERFORMANCE_PROFILES """
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'GDAL_PERFORMANCE_PROFILES', {})
+    profile = _merge(DEFAULT_PROFILE, configured.get('default', {}))
+    if task_name:
+        profile = _merge(profile, configured.get(task_name.split('.')[-1], {}))
+    return profile
+
+
+def current_gdal_profile() -> GDALProfile:
+    """ The profile activated for the running task, or the default profile """
+    return _active_profile or get_gdal_profile()
+
+
+def config_options(profile: Optional[GDALProfile] = None) -> Dict[str, str]:
+    profile = profile or current_gdal_profile()
+    return {
+        'GDAL_NUM_THREADS': str(profile.num_threads),
+        'GDAL_CACHEMAX': str(profile.cache_max_mb),
+        'VSI_CACHE': 'TRUE' if profile.vsi_cache else 'FALSE',
+        'VSI_CACHE_SIZE': str(profile.vsi_cache_size_mb * 1024 * 1024)
+    }
+
+
+def activate_gdal_profile(task_name: Optional[str] = None) -> GDALProfile:
+    """ Applies the profile of task_name to the environment and, if loaded, to osgeo.gdal.
+    Undone by deactivate_gdal_profile. """
+    global _active_profile, _previous_cache_max
+    deactivate_gdal_profile()
+    profile = get_gdal_profile(task_name)
+    for key, value in config_options(profile).items():
+        _previous_environment[key] = os.environ.get(key)
+        os.environ[key] = value
+    if 'osgeo.gdal' in sys.modules:
+        from osgeo import gdal
+        for key, value in config_options(profile).items():
+            gdal.SetConfigOption(key, value)
+        _previous_cache_max = gdal.GetCacheMax()
+        gdal.SetCacheMax(profile.cache_max_mb * 1024 * 1024)
+    _active_profile = profile
+    return profile
+
+
+def deactivate_gdal_profile():
+    global _active_profile, _previous_cache_max
+    if _active_profile is None:
+        return
+    for key, value in _previous_environment.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    if 'osgeo.gdal' in sys.modules:
+        from osgeo import gdal
+        for key, value in _previous_environment.items():
+            gdal.SetConfigOption(key, value)
+        if _previous_cache_max is not None:
+            gdal.SetCacheMax(_previous_cache_max)
+    _previous_cache_max = None
+    _previous_environment.clear()
+    _active_profile = None
+
+
+def _driver_options(driver: str, profile: Optional[GDALProfile], group_name: Optional[str]) -> Dict[str, Any]:
+    """ The options of driver in the profile; for a GeoTIFF of group_name, the layout of the group wins """
+    profile = profile or current_gdal_profile()
+    options = dict(profile.creation_options.get(driver, {}))
+    if driver == 'GTiff' and group_name is not None:
+        # netCDF4: not on import, the profiles are activated by every worker
+        from eo_engine.common.layout import get_layout_profile, gtiff_creation_options
+
+        options = {key: value for key, value in options.items() if key.upper() not in LAYOUT_GTIFF_OPTIONS}
+        for key, value in gtiff_creation_options(get_layout_profile(group_name)).items():
+            options[key.upper()] = ('YES' if value else 'NO') if isinstance(value, bool) else value
+    return options
+
+
+def creation_options(driver: str = 'GTiff', profile: Optional[GDALProfile] = None,
+                     group_name: Optional[str] = None) -> List[str]:
+    """ Creation options of driver as a list of 'KEY=VALUE' (gdal.Warp/gdal.Translate creationOptions) """
+    return [f'{key}={value}' for key, value in _driver_options(driver, profile, group_name).items()]
+
+
+def rasterio_creation_options(driver: str = 'GTiff', profile: Optional[GDALProfile] = None,
+                              group_name: Optional[str] = None) -> Dict[str, Any]:
+    """ Creation options of driver as keyword arguments of rasterio.open(.., 'w') """
+    options = {key.lower(): value for key, value in _driver_options(driver, profile, group_name).items()}
+    if 'tiled' in options:
+        options['tiled'] = str(options['tiled']).upper() in ('YES', 'TRUE', '1')
+    return options
+
+
+def warp_kwargs(driver: str = 'GTiff', profile: Optional[GDALProfile] = None) -> Dict[str, Any]:
+    """ Keyword arguments of gdal.Warp/gdal.WarpOptions """
+    profile = profile or current_gdal_profile()
+    return dict(
+        multithread=True,
+        warpOptions=[f'NUM_THREADS={profile.num_threads}'],
+        warpMemoryLimit=profile.warp_memory_mb,
+        creationOptions=creation_options(driver, profile))
+
+
+def translate_kwargs(driver: str = 'GTiff', profile: Optional[GDALProfile] = None) -> Dict[str, Any]:
+    """ Keyword arguments of gdal.Translate/gdal.TranslateOptions """
+    return dict(creationOptions=creation_options(driver, profile))
+
+
+def command_line_args(tool: str, driver: str = 'GTiff', profile: Optional[GDALProfile] = None) -> List[str]:
+    """ Arguments for the gdalwarp/gdal_translate command line tools """
+    profile = profile or current_gdal_profile()
+    args: List[str] = []
+    for key, value in config_options(profile).items():
+        args += ['--config', key, value]
+    if tool.endswith('gdalwarp'):
+        args += ['-multi', '-wo', f'NUM_THREADS={profile.num_threads}', '-wm', str(profile.warp_memory_mb)]
+    for option in creation_options(driver, profile):
+        args += ['-co', option]
+    return args
+
+
+__all__ = [
+    'GDALProfile',
+    'get_gdal_profile',
+    'current_gdal_profile',
+    'config_options',
+    'activate_gdal_profile',
+    'deactivate_gdal_profile',
+    'creation_options',
+    'rasterio_creation_options',
+    'warp_kwargs',
+    'translate_kwargs',
+    'command_line_args'
+]
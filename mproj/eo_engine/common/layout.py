@@ -0,0 +1,109 @@
+"""
+Output layout profiles: on-disk chunking and compression of the products, per product group.
+
+Every product file is one 2D slice of a time series. THREDDS users that extract the time series of a pixel
+decompress one chunk per file, so a whole-slice chunk (the nccopy/gdal_translate default for small rasters)
+makes every point read as expensive as reading the whole file. Smaller chunks make point and time-series
+reads cheap, at the cost of slightly worse compression and more chunk lookups for full-slice reads.
+
+Profiles are configured in settings.PRODUCT_LAYOUT_PROFILES, keyed by product group name or by a glob
+pattern of group names (e.g. 'S02P02_NDVIA_250M_*'). The first matching key wins, 'default' otherwise.
+`eo_engine.management.commands.benchmark_layouts` measures the read latency of every profile.
+"""
+from fnmatch import fnmatchcase
+from logging import Logger
+from typing import Any, Dict, NamedTuple, Tuple
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from eo_engine.common.netcdf import VariableSpec
+
+logger: Logger = get_task_logger(__name__)
+
+LayoutProfile = NamedTuple('LayoutProfile', [
+    # netCDF chunk shape (rows, cols) of the 2D variables
+    ('chunksizes', Tuple[int, int]),
+    ('shuffle', bool),
+    # netCDF compression filter: 'zlib' or 'zstd' (needs netCDF4 >= 1.6 built with the zstd plugin)
+    ('compression', str),
+    ('complevel', int),
+    # GeoTIFF internal tiling and compression
+    ('tiled', bool),
+    ('blocksize', int),
+    ('gtiff_compress', str),
+    ('predictor', int)
+])
+
+DEFAULT_LAYOUT = LayoutProfile(
+    chunksizes=(256, 256),
+    shuffle=True,
+    compression='zlib',
+    complevel=4,
+    tiled=True,
+    blocksize=256,
+    gtiff_compress='DEFLATE',
+    predictor=1
+)
+
+
+def _profile(values: Dict[str, Any]) -> LayoutProfile:
+    fields = DEFAULT_LAYOUT._asdict()
+    for key, value in values.items():
+        if key not in fields:
+            logger.warning(f'Unknown layout option: {key}')
+            continue
+        fields[key] = tuple(value) if key == 'chunksizes' else value
+    return LayoutProfile(**fields)
+
+
+def get_layout_profile(group_name: str) -> LayoutProfile:
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'PRODUCT_LAYOUT_PROFILES', {})
+    base = configured.get('default', {})
+    for key, values in configured.items():
+        if key != 'default' and fnmatchcase(group_name, key):
+            return _profile({**base, **values})
+    return _profile(base)
+
+
+def layout_profiles() -> Dict[str, LayoutProfile]:
+    """ All the configured profiles by key """
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'PRODUCT_LAYOUT_PROFILES', {})
+    base = configured.get('default', {})
+    profiles = {'default': _profile(base)}
+    profiles.update({key: _profile({**base, **values}) for key, values in configured.items() if key != 'default'})
+    return profiles
+
+
+def apply_layout(spec: VariableSpec, layout: LayoutProfile) -> VariableSpec:
+    """ spec with the chunking and compression of the layout """
+    return spec._replace(
+        chunksizes=layout.chunksizes,
+        shuffle=layout.shuffle,
+        compression=layout.compression,
+        complevel=layout.complevel)
+
+
+def product_spec(spec: VariableSpec, group_name: str) -> VariableSpec:
+    """ spec with the layout of the product group """
+    return apply_layout(spec, get_layout_profile(group_name))
+
+
+def gtiff_creation_options(layout: LayoutProfile) -> Dict[str, Any]:
+    """ rasterio creation options of a GeoTIFF product """
+    options: Dict[str, Any] = {'compress': layout.gtiff_compress, 'tiled': layout.tiled}
+    if layout.tiled:
+        options.update(blockxsize=layout.blocksize, blockysize=layout.blocksize)
+    if layout.predictor > 1:
+        options.update(predictor=layout.predictor)
+    return options
+
+
+__all__ = [
+    'LayoutProfile',
+    'get_layout_profile',
+    'layout_profiles',
+    'apply_layout',
+    'product_spec',
+    'gtiff_creation_options'
+]
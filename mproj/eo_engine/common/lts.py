@@ -0,0 +1,235 @@
+"""
+Incremental long-term statistics (LTS) of the NDVI 1km.
+
+For every dekad of the year (keyed by the MMDD of the dekad start, like the CGLS LTS files) an accumulator
+netCDF holds the running min and max and, optionally, the sum and count of the valid NDVI values of every
+year folded in so far. Folding a product reads it and the accumulator once, in row bands, so keeping the
+statistics current costs one product instead of a recompute over the archive.
+
+The accumulators keep the raw digital numbers of the product. export_lts writes the statistics in the
+layout the VCI task reads: cgls_NDVI-LTS_<MMDD>_V3_min.nc / _max.nc (and _mean.nc), with the scaling of
+the NDVI.
+"""
+import datetime
+import os
+import shutil
+from logging import Logger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Optional, Union
+
+import netCDF4
+import numpy as np
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils import timezone
+
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.common.layout import get_layout_profile
+from eo_engine.common.time import dekad_startdate
+from eo_engine.errors import AfriCultuReSError
+
+logger: Logger = get_task_logger(__name__)
+
+# raw values of the CGLS NDVI: 0-250 valid, 251-255 flags
+NDVI_VALID_MAX = 250
+NDVI_FILL = 255
+NDVI_SCALE_FACTOR = 0.004
+NDVI_ADD_OFFSET = -0.08
+
+# group of the layout profile of the accumulators (see eo_engine.common.layout)
+LTS_LAYOUT_GROUP = 'NDVI_LTS'
+
+
+def lts_key(reference_date: datetime.date) -> str:
+    """ MMDD of the start of the dekad of reference_date """
+    return dekad_startdate(reference_date).strftime('%m%d')
+
+
+def lts_root() -> Path:
+    return Path(getattr(settings, 'NDVI_LTS_ROOT', settings.AUX_FILES_ROOT / 'NDVI_LTS_INCREMENTAL'))
+
+
+def accumulator_path(key: str, root: Optional[Path] = None) -> Path:
+    return (root or lts_root()) / 'accumulators' / f'ndvi_lts_{key}.nc'
+
+
+def folded_dates(ds: netCDF4.Dataset) -> List[str]:
+    """ ISO dates of the products folded in the accumulator """
+    token = ds.getncattr('reference_dates') if 'reference_dates' in ds.ncattrs() else ''
+    return [d for d in token.split(',') if d]
+
+
+def _copy_variable(src: netCDF4.Dataset, dst: netCDF4.Dataset, name: str):
+    var = src.variables[name]
+    out = dst.createVariable(name, var.dtype, var.dimensions)
+    out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+    if var.shape:
+        out[:] = var[:]
+
+
+def _create_accumulator(path: Path, product: netCDF4.Dataset, variable: str, with_mean: bool):
+    """ An empty accumulator on the grid of product """
+    row_dim, col_dim = product.variables[variable].dimensions[-2:]
+    layout = get_layout_profile(LTS_LAYOUT_GROUP)
+    chunksizes = (min(layout.chunksizes[0], len(product.dimensions[row_dim])),
+                  min(layout.chunksizes[1], len(product.dimensions[col_dim])))
+    kwargs = dict(zlib=True, complevel=1, shuffle=True, chunksizes=chunksizes)
+
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as dst:
+        for dim in (row_dim, col_dim):
+            dst.createDimension(dim, len(product.dimensions[dim]))
+            if dim in product.variables:
+                _copy_variable(product, dst, dim)
+        grid_mapping = getattr(product.variables[variable], 'grid_mapping', None)
+        if grid_mapping in product.variables:
+            _copy_variable(product, dst, grid_mapping)
+
+        for name in ('min', 'max'):
+            dst.createVariable(name, 'u1', (row_dim, col_dim), fill_value=NDVI_FILL, **kwargs)
+        if with_mean:
+            dst.createVariable('sum', 'u4', (row_dim, col_dim), fill_value=0, **kwargs)
+            dst.createVariable('count', 'u2', (row_dim, col_dim), fill_value=0, **kwargs)
+        dst.setncatts({'variable': variable, 'reference_dates': ''})
+
+
+def _check_grid(acc: netCDF4.Dataset, product: netCDF4.Dataset, variable: str):
+    row_dim, col_dim = product.variables[variable].dimensions[-2:]
+    for dim in (row_dim, col_dim):
+        if dim not in acc.dimensions or len(acc.dimensions[dim]) != len(product.dimensions[dim]):
+            raise AfriCultuReSError(f'The product is not on the grid of the LTS accumulator (dimension: {dim})')
+        if dim in acc.variables and dim in product.variables and \
+                not np.allclose(acc.variables[dim][:], product.variables[dim][:], atol=1e-6):
+            raise AfriCultuReSError(f'The product is not on the grid of the LTS accumulator (coordinate: {dim})')
+
+
+def fold_product(product_path: Union[str, Path], reference_date: datetime.date,
+                 variable: str = 'NDVI',
+                 root: Optional[Path] = None,
+                 with_mean: Optional[bool] = None,
+                 rows: int = 512) -> bool:
+    """ Folds the product into the accumulator of its dekad. The accumulator is updated on a copy that
+    replaces it at the end, so a failed update leaves the statistics untouched.
+
+    Returns False if the reference date had already been folded. """
+    if with_mean is None:
+        with_mean = getattr(settings, 'NDVI_LTS_WITH_MEAN', True)
+    key = lts_key(reference_date)
+    path = accumulator_path(key, root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with advisory_lock(f'ndvi_lts:{key}'), \
+            netCDF4.Dataset(product_path) as product, \
+            TemporaryDirectory(dir=path.parent, prefix='.ndvi_lts_') as temp_dir:
+        product.set_auto_maskandscale(False)
+        temp_path = Path(temp_dir) / path.name
+        if path.exists():
+            shutil.copyfile(path, temp_path)
+        else:
+            _create_accumulator(temp_path, product, variable, with_mean)
+
+        with netCDF4.Dataset(temp_path, 'a') as acc:
+            acc.set_auto_maskandscale(False)
+            dates = folded_dates(acc)
+            if reference_date.isoformat() in dates:
+                logger.info(f'{reference_date} is already in the NDVI LTS {key}')
+                return False
+            _check_grid(acc, product, variable)
+
+            var = product.variables[variable]
+            height = var.shape[-2]
+            has_mean = 'sum' in acc.variables
+            for row in range(0, height, rows):
+                rows_slice = slice(row, min(row + rows, height))
+                data = var[..., rows_slice, :].reshape(-1, var.shape[-1])
+                valid = data <= NDVI_VALID_MAX
+
+                current_min = acc.variables['min'][rows_slice, :]
+                acc.variables['min'][rows_slice, :] = np.where(valid, np.minimum(current_min, data), current_min)
+                current_max = acc.variables['max'][rows_slice, :]
+                acc.variables['max'][rows_slice, :] = np.where(
+                    valid, np.where(current_max == NDVI_FILL, data, np.maximum(current_max, data)), current_max)
+                if has_mean:
+                    acc.variables['sum'][rows_slice, :] = \
+                        acc.variables['sum'][rows_slice, :] + np.where(valid, data, 0).astype('u4')
+                    acc.variables['count'][rows_slice, :] = \
+                        acc.variables['count'][rows_slice, :] + valid.astype('u2')
+
+            acc.setncatts({
+                'reference_dates': ','.join(sorted(dates + [reference_date.isoformat()])),
+                'last_update': timezone.now().isoformat()})
+        os.replace(temp_path, path)
+
+    logger.info(f'Folded {product_path} ({reference_date}) into the NDVI LTS {key}')
+    return True
+
+
+def _write_statistic(acc: netCDF4.Dataset, name: str, data_rows, out_path: Path):
+    """ Writes one statistic in the layout of the CGLS LTS files, then moves it to out_path """
+    row_dim, col_dim = acc.variables['min'].dimensions
+    temp_path = out_path.with_name(f'.{out_path.name}')
+    with netCDF4.Dataset(temp_path, 'w', format='NETCDF4') as dst:
+        for dim in (row_dim, col_dim):
+            dst.createDimension(dim, len(acc.dimensions[dim]))
+            if dim in acc.variables:
+                _copy_variable(acc, dst, dim)
+        var = dst.createVariable(name, 'u1', (row_dim, col_dim), fill_value=NDVI_FILL,
+                                 zlib=True, complevel=4, shuffle=True,
+                                 chunksizes=acc.variables['min'].chunking())
+        var.setncatts({
+            'scale_factor': NDVI_SCALE_FACTOR,
+            'add_offset': NDVI_ADD_OFFSET,
+            'long_name': f'NDVI long term statistics: {name}',
+            'valid_range': [0, NDVI_VALID_MAX]})
+        if 'crs' in acc.variables:
+            _copy_variable(acc, dst, 'crs')
+            var.setncattr('grid_mapping', 'crs')
+        var.set_auto_maskandscale(False)
+        for rows_slice, data in data_rows:
+            var[rows_slice, :] = data
+        dst.setncatts({'reference_dates': acc.getncattr('reference_dates')})
+    os.replace(temp_path, out_path)
+
+
+def export_lts(key: str, out_dir: Optional[Path] = None, root: Optional[Path] = None,
+               rows: int = 512) -> List[Path]:
+    """ Writes the min/max (and mean) of the accumulator of key as cgls_NDVI-LTS_<key>_V3_<stat>.nc.
+    Every file is replaced atomically, a task reading the previous version is not affected. """
+    path = accumulator_path(key, root)
+    if not path.exists():
+        raise AfriCultuReSError(f'There is no NDVI LTS accumulator for {key}')
+    out_dir = out_dir or (root or lts_root())
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    written: List[Path] = []
+    with advisory_lock(f'ndvi_lts:{key}'), netCDF4.Dataset(path) as acc:
+        acc.set_auto_maskandscale(False)
+        height = len(acc.dimensions[acc.variables['min'].dimensions[0]])
+        bands = [slice(row, min(row + rows, height)) for row in range(0, height, rows)]
+
+        for name in ('min', 'max'):
+            out_path = out_dir / f'cgls_NDVI-LTS_{key}_V3_{name}.nc'
+            _write_statistic(acc, name, ((s, acc.variables[name][s, :]) for s in bands), out_path)
+            written.append(out_path)
+
+        if 'sum' in acc.variables:
+            def mean_rows():
+                for s in bands:
+                    total, count = acc.variables['sum'][s, :], acc.variables['count'][s, :]
+                    mean = np.divide(total, count, out=np.zeros(count.shape, dtype='f8'), where=count > 0)
+                    yield s, np.where(count > 0, np.floor(mean + 0.5), NDVI_FILL).astype('u1')
+
+            out_path = out_dir / f'cgls_NDVI-LTS_{key}_V3_mean.nc'
+            _write_statistic(acc, 'mean', mean_rows(), out_path)
+            written.append(out_path)
+    return written
+
+
+__all__ = [
+    'lts_key',
+    'lts_root',
+    'accumulator_path',
+    'folded_dates',
+    'fold_product',
+    'export_lts'
+]
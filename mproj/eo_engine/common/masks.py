@@ -0,0 +1,209 @@
+"""
+Cached cutline masks.
+
+Rasterizing a border shapefile against an output grid is the expensive part of `gdalwarp -cutline`.
+The result only depends on the shapefile and on the grid, so it is rasterized once per
+(shapefile, grid) pair into a 1-bit GeoTIFF under AUX_FILES_ROOT/mask_cache and reused.
+A cached mask is invalidated when any of the shapefile's sidecar files changes (mtime/size).
+"""
+import hashlib
+import os
+from logging import Logger
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional, Iterator, Tuple
+
+import numpy as np
+import rasterio
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from osgeo import gdal
+from rasterio.windows import Window
+
+from eo_engine.common.gdal_profile import rasterio_creation_options
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+from eo_engine.common.raster import GridSignature, grid_signature, grid_digest, iter_row_windows
+from eo_engine.common.verify import check_file_exists
+from eo_engine.errors import AfriCultuReSError
+
+logger: Logger = get_task_logger(__name__)
+
+SHAPEFILE_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def get_mask_cache_dir() -> Path:
+    return_path: Path = settings.AUX_FILES_ROOT / 'mask_cache'
+    if not return_path.exists():
+        logger.info(f'{return_path.name} does not exist. Making it')
+        return_path.mkdir(parents=True, exist_ok=True)
+
+    return return_path
+
+
+def shapefile_fingerprint(shapefile: Path) -> str:
+    """ Token that changes whenever the shapefile (or any of its sidecar files) is modified """
+    h = hashlib.sha1(shapefile.resolve().as_posix().encode('utf-8'))
+    for suffix in SHAPEFILE_SIDECARS:
+        sidecar = shapefile.with_suffix(suffix)
+        if sidecar.exists():
+            stat = sidecar.stat()
+            h.update(f'{suffix}:{stat.st_mtime_ns}:{stat.st_size}'.encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def mask_path(shapefile: Path, grid: GridSignature) -> Path:
+    return get_mask_cache_dir() / f'{shapefile.stem}_{shapefile_fingerprint(shapefile)}_{grid_digest(grid)}.tif'
+
+
+def get_cutline_mask(shapefile: Path, grid: GridSignature) -> Path:
+    """ Returns the path of the (cached) mask of shapefile on grid. Rasterizes it if it does not exist.
+    Pixels whose centre falls inside the polygons are 1, the rest 0 (same rule as gdalwarp -cutline). """
+    check_file_exists(shapefile)
+    target = mask_path(shapefile, grid)
+    if target.exists():
+        logger.info(f'Using cached mask {target.name}')
+        return target
+
+    logger.info(f'Rasterizing {shapefile.name} to {target.name}')
+    # write next to the target and rename, so concurrent workers never see a half-written mask
+    with NamedTemporaryFile(dir=target.parent, suffix='.tif', delete=False) as fh:
+        temp_path = Path(fh.name)
+    try:
+        driver = gdal.GetDriverByName('GTiff')
+        ds = driver.Create(temp_path.as_posix(), grid.width, grid.height, 1, gdal.GDT_Byte,
+                           ['NBITS=1', 'COMPRESS=DEFLATE', 'TILED=YES'])
+        ds.SetProjection(grid.crs)
+        ds.SetGeoTransform((grid.transform[2], grid.transform[0], grid.transform[1],
+                            grid.transform[5], grid.transform[3], grid.transform[4]))
+        result = gdal.Rasterize(ds, shapefile.as_posix(), burnValues=[1])
+        ds = None
+        if result != 1:
+            raise AfriCultuReSError(f'Could not rasterize {shapefile.as_posix()}')
+        os.replace(temp_path, target)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+    return target
+
+
+def read_cutline_mask(shapefile: Path, grid: GridSignature, window: Optional[Window] = None) -> np.ndarray:
+    """ Boolean mask of shapefile on grid. True is inside. """
+    with rasterio.open(get_cutline_mask(shapefile, grid)) as mask_ds:
+        return mask_ds.read(1, window=window).astype(bool)
+
+
+def mask_bounding_window(mask_file: Path, block_rows: int = 2048) -> Window:
+    """ Smallest window that contains all the inside pixels of a cached mask. Streams the mask by row bands """
+    row_min = row_max = col_min = col_max = None
+    with rasterio.open(mask_file) as mask_ds:
+        for w in iter_row_windows(mask_ds.width, mask_ds.height, rows=block_rows):
+            block = mask_ds.read(1, window=w).astype(bool)
+            rows = np.flatnonzero(block.any(axis=1))
+            if rows.size == 0:
+                continue
+            cols = np.flatnonzero(block.any(axis=0))
+            if row_min is None:
+                row_min = int(w.row_off) + int(rows[0])
+            row_max = int(w.row_off) + int(rows[-1])
+            col_min = int(cols[0]) if col_min is None else min(col_min, int(cols[0]))
+            col_max = int(cols[-1]) if col_max is None else max(col_max, int(cols[-1]))
+    if row_min is None:
+        raise AfriCultuReSError(f'The cutline of {mask_file.name} does not intersect the raster')
+    return Window(col_off=col_min, row_off=row_min, width=col_max - col_min + 1, height=row_max - row_min + 1)
+
+
+def iter_masked_windows(src, shapefile: Path, nodata: float, crop: bool = False,
+                        band: int = 1, block_rows: int = 1024) -> Iterator[Tuple[Window, np.ndarray]]:
+    """ Yields (window, 2D array) row bands of src with the pixels outside the shapefile set to nodata.
+    Windows are relative to the cropped grid when crop is True (see cutline_window). """
+    with rasterio.open(get_cutline_mask(shapefile, grid_signature(src))) as mask_ds:
+        window = mask_bounding_window(Path(mask_ds.name)) if crop else Window(0, 0, src.width, src.height)
+        for w in iter_row_windows(int(window.width), int(window.height), rows=block_rows):
+            src_window = Window(col_off=int(window.col_off), row_off=int(window.row_off) + int(w.row_off),
+                                width=w.width, height=w.height)
+            inside = mask_ds.read(1, window=src_window).astype(bool)
+            yield w, np.where(inside, src.read(band, window=src_window), nodata)
+
+
+def cutline_window(src, shapefile: Path, crop: bool = False) -> Window:
+    """ The window of src that a clip to shapefile covers: all of it, or the bounding window of the cutline """
+    if not crop:
+        return Window(0, 0, src.width, src.height)
+    return mask_bounding_window(get_cutline_mask(shapefile, grid_signature(src)))
+
+
+def clip_to_cutline(file_in: Path,
+                    file_out: Path,
+                    shapefile: Path,
+                    crop: bool = False,
+                    nodata: Optional[float] = None,
+                    dtype: Optional[str] = None,
+                    driver: str = 'GTiff',
+                    block_rows: int = 1024,
+                    **creation_options) -> Path:
+    """ Sets every pixel of file_in outside the polygons of shapefile to nodata and writes it to file_out.
+    Equivalent to `gdalwarp -cutline` (crop=False) / `gdalwarp -cutline -crop_to_cutline` (crop=True)
+    for rasters that are already in the target grid, but the polygon is rasterized only once per grid.
+
+    If nodata is not set, the nodata of the input is used, and 0 if the input has none.
+    The creation options default to the ones of the active GDAL profile (see common.gdal_profile). """
+
+    with rasterio.open(file_in) as src:
+        out_nodata = nodata if nodata is not None else (src.nodata if src.nodata is not None else 0)
+
+        window = cutline_window(src, shapefile, crop=crop)
+        profile = src.profile.copy()
+        if driver != src.driver:
+            for creation_option in ('tiled', 'blockxsize', 'blockysize', 'compress', 'interleave', 'photometric'):
+                profile.pop(creation_option, None)
+        profile.update(
+            driver=driver,
+            count=1,
+            width=int(window.width),
+            height=int(window.height),
+            transform=src.window_transform(window),
+            nodata=out_nodata,
+            dtype=dtype or src.dtypes[0],
+            **{**rasterio_creation_options(driver), **creation_options})
+
+        with rasterio.open(file_out, 'w', **profile) as dst:
+            for w, data in iter_masked_windows(src, shapefile, out_nodata, crop=crop, block_rows=block_rows):
+                dst.write(data.astype(profile['dtype']), 1, window=w)
+
+    return Path(file_out)
+
+
+def clip_to_netcdf(file_in: Path,
+                   file_out: Path,
+                   shapefile: Path,
+                   spec: VariableSpec,
+                   crop: bool = False,
+                   block_rows: int = 1024,
+                   **kwargs) -> Path:
+    """ clip_to_cutline straight to a netCDF product (see write_netcdf_product), without an intermediate GeoTIFF.
+    The fill value defaults to the nodata of the input, and 0 if the input has none. """
+    with rasterio.open(file_in) as src:
+        if spec.dtype is None:
+            spec = spec._replace(dtype=src.dtypes[0])
+        if spec.fill_value is None:
+            spec = spec._replace(fill_value=src.nodata if src.nodata is not None else 0)
+
+        window = cutline_window(src, shapefile, crop=crop)
+        return write_netcdf_product(
+            file_out,
+            iter_masked_windows(src, shapefile, spec.fill_value, crop=crop, block_rows=block_rows),
+            spec,
+            transform=src.window_transform(window), crs=src.crs,
+            width=int(window.width), height=int(window.height), **kwargs)
+
+
+__all__ = [
+    'get_cutline_mask',
+    'read_cutline_mask',
+    'mask_bounding_window',
+    'iter_masked_windows',
+    'cutline_window',
+    'clip_to_cutline',
+    'clip_to_netcdf'
+]
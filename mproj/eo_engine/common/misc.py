@@ -3,7 +3,7 @@ import re
 from collections import defaultdict
 from datetime import datetime, date as dt_date
 from pathlib import Path
-from typing import List
+from typing import List, Pattern, Union
 
 from eo_engine.errors import AfriCultuReSError
 
@@ -40,9 +40,10 @@ def list_spiders() -> List[str]:
 rec_dd = defaultdict(lambda: rec_dd)
 
 
-def str_to_date(token: str, regex_string: str, re_flags=re.IGNORECASE) -> dt_date:
+def str_to_date(token: str, regex_string: Union[str, Pattern], re_flags=re.IGNORECASE) -> dt_date:
+    """ regex_string can be compiled already (re_flags is ignored then), to parse many tokens """
     from eo_engine.errors import AfriCultuReSError
-    pat = re.compile(regex_string, re_flags)
+    pat = regex_string if isinstance(regex_string, re.Pattern) else re.compile(regex_string, re_flags)
     try:
         match = pat.match(token)
         groupdict = match.groupdict()
@@ -0,0 +1,324 @@
+"""
+In-process netCDF helpers.
+
+clip_netcdf replaces the `ncks -d lat,.. -d lon,..` + `ncatted` pair. It reads only the requested
+hyperslab of the (global) input file, in blocks aligned with the input chunking, and writes the subset
+with its final attributes, chunking and compression in one go.
+
+write_netcdf_product replaces the `gdal_translate -of netCDF` -> `nccopy` -> `ncrename` -> `ncatted` chains.
+It takes an array (or an iterator of (window, array) blocks) and a declarative VariableSpec and writes the
+final NETCDF4 product in a single pass.
+"""
+from logging import Logger
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union, Any, Iterable, NamedTuple
+
+import netCDF4
+import numpy as np
+from affine import Affine
+from celery.utils.log import get_task_logger
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+from eo_engine.common.raster import iter_raster_windows
+from eo_engine.errors import AfriCultuReSError
+
+logger: Logger = get_task_logger(__name__)
+
+# (first, last) index, both inclusive, like ncks -d dim,first,last
+IndexRange = Tuple[int, int]
+
+# attributes that can only be set when a variable is created
+CREATION_ONLY_ATTRIBUTES = ('_FillValue',)
+
+
+def _variables_to_copy(src: netCDF4.Dataset, variables: Optional[List[str]]) -> List[str]:
+    """ The requested variables plus their coordinate, grid_mapping and bounds variables (what ncks -v does) """
+    if variables is None:
+        return list(src.variables.keys())
+
+    selected: List[str] = []
+
+    def add(name: str):
+        if name in selected or name not in src.variables:
+            return
+        selected.append(name)
+        var = src.variables[name]
+        for dim in var.dimensions:
+            add(dim)
+        for linked_attr in ('grid_mapping', 'bounds'):
+            if linked_attr in var.ncattrs():
+                add(var.getncattr(linked_attr))
+        if 'coordinates' in var.ncattrs():
+            for coord in str(var.getncattr('coordinates')).split():
+                add(coord)
+
+    for variable in variables:
+        if variable not in src.variables:
+            raise AfriCultuReSError(f'Variable {variable} was not found in {src.filepath()}')
+        add(variable)
+    return selected
+
+
+def _source_block_rows(var: netCDF4.Variable, dim_idx: int, min_rows: int = 256) -> int:
+    """ Number of rows to read per block so that every read covers whole input chunks """
+    chunking = var.chunking()
+    if chunking == 'contiguous' or chunking is None:
+        return min_rows
+    chunk_rows = chunking[dim_idx]
+    return max(1, min_rows // chunk_rows) * chunk_rows
+
+
+def clip_netcdf(file_in: Union[str, Path],
+                file_out: Union[str, Path],
+                lat: IndexRange,
+                lon: IndexRange,
+                variables: Optional[List[str]] = None,
+                attrs: Optional[Dict[str, Dict[str, Any]]] = None,
+                global_attrs: Optional[Dict[str, Any]] = None,
+                complevel: int = 4,
+                lat_dim: str = 'lat',
+                lon_dim: str = 'lon',
+                layout=None) -> Path:
+    """ Copy the lat/lon index ranges (inclusive) of file_in to a new NETCDF4 file_out.
+
+    @param variables: variables to keep (with their coordinates). All if None.
+    @param attrs: {variable: {attribute: value}} set/overwritten on the output variables.
+    @param global_attrs: attributes set/overwritten on the output dataset.
+    @param layout: a LayoutProfile (see common.layout) for the chunking and compression of the 2D variables.
+     If not set, the chunking of the input and complevel are used.
+    """
+    attrs = attrs or {}
+    slices = {lat_dim: slice(lat[0], lat[1] + 1), lon_dim: slice(lon[0], lon[1] + 1)}
+
+    with netCDF4.Dataset(file_in, 'r') as src, \
+            netCDF4.Dataset(file_out, 'w', format='NETCDF4') as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+
+        names = _variables_to_copy(src, variables)
+        logger.info(f'Clipping {Path(file_in).name}; variables: {names}')
+
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+        if global_attrs:
+            dst.setncatts(global_attrs)
+
+        used_dims = {dim for name in names for dim in src.variables[name].dimensions}
+        for name, dim in src.dimensions.items():
+            if name not in used_dims:
+                continue
+            if name in slices:
+                size = len(range(dim.size)[slices[name]])
+            else:
+                size = None if dim.isunlimited() else dim.size
+            dst.createDimension(name, size)
+
+        for name in names:
+            src_var = src.variables[name]
+            src_attrs = {k: src_var.getncattr(k) for k in src_var.ncattrs()}
+            src_attrs.update(attrs.get(name, {}))
+            fill_value = src_attrs.pop('_FillValue', None)
+
+            shape = tuple(len(dst.dimensions[d]) for d in src_var.dimensions)
+            src_chunking = src_var.chunking()
+            chunksizes = None
+            if src_var.dimensions and src_chunking not in ('contiguous', None):
+                chunksizes = tuple(max(1, min(c, s)) for c, s in zip(src_chunking, shape))
+            compression, level, shuffle = 'zlib', complevel if src_var.dimensions else 0, True
+            if layout is not None and src_var.dimensions[-2:] == (lat_dim, lon_dim):
+                chunksizes = (1,) * (len(shape) - 2) + tuple(
+                    max(1, min(c, s)) for c, s in zip(layout.chunksizes, shape[-2:]))
+                compression, level, shuffle = layout.compression, layout.complevel, layout.shuffle
+
+            dst_var = dst.createVariable(
+                name, src_var.datatype, src_var.dimensions,
+                shuffle=shuffle, chunksizes=chunksizes, fill_value=fill_value,
+                **_compression_kwargs(compression, level))
+            # Dataset.set_auto_maskandscale only applies to the variables that exist already
+            dst_var.set_auto_maskandscale(False)
+            dst_var.setncatts(src_attrs)
+
+            if not set(slices.keys()).intersection(src_var.dimensions):
+                dst_var[...] = src_var[...]
+                continue
+
+            # 1D coordinate variables, or variables that don't span the row (lat) dimension
+            if lat_dim not in src_var.dimensions:
+                dst_var[...] = src_var[tuple(slices.get(d, slice(None)) for d in src_var.dimensions)]
+                continue
+
+            row_idx = src_var.dimensions.index(lat_dim)
+            first, last = lat[0], lat[1] + 1
+            block_rows = _source_block_rows(src_var, row_idx)
+            row = first
+            while row < last:
+                # align the end of every block on a chunk boundary of the input
+                block_end = min(last, (row // block_rows + 1) * block_rows)
+                src_idx = [slices.get(d, slice(None)) for d in src_var.dimensions]
+                dst_idx = [slice(None)] * len(src_var.dimensions)
+                src_idx[row_idx] = slice(row, block_end)
+                dst_idx[row_idx] = slice(row - first, block_end - first)
+                dst_var[tuple(dst_idx)] = src_var[tuple(src_idx)]
+                row = block_end
+
+    return Path(file_out)
+
+
+class VariableSpec(NamedTuple):
+    """ Declarative description of the (single) data variable of a product.
+    dtype None keeps the data type of the input. """
+    name: str
+    dtype: Optional[str] = None
+    attrs: Dict[str, Any] = {}
+    fill_value: Optional[Union[int, float]] = None
+    scale_factor: Optional[float] = None
+    add_offset: Optional[float] = None
+    complevel: int = 4
+    shuffle: bool = True
+    chunksizes: Optional[Tuple[int, int]] = None
+    # 'zlib', or any other filter of netCDF4.Dataset.createVariable(compression=..) e.g. 'zstd'
+    compression: str = 'zlib'
+
+
+def _compression_kwargs(compression: str, complevel: int) -> Dict[str, Any]:
+    """ createVariable keyword arguments. Only netCDF4 >= 1.6 knows the `compression` keyword """
+    if compression == 'zlib' or complevel <= 0:
+        return dict(zlib=complevel > 0, complevel=complevel)
+    return dict(compression=compression, complevel=complevel)
+
+
+DEFAULT_CHUNK = 512
+
+Blocks = Iterable[Tuple[Window, np.ndarray]]
+
+
+def _create_grid(dst: netCDF4.Dataset, transform: Affine, crs: Optional[CRS],
+                 width: int, height: int, bottom_up: bool) -> Tuple[str, str]:
+    """ Creates the dimensions, coordinate variables and grid mapping variable of a north-up grid.
+    Returns the names of the (row, column) dimensions. """
+    geographic = crs is None or crs.is_geographic
+    row_dim, col_dim = ('lat', 'lon') if geographic else ('y', 'x')
+
+    dst.createDimension(row_dim, height)
+    dst.createDimension(col_dim, width)
+
+    # pixel centres
+    cols = transform.c + transform.a * (np.arange(width) + 0.5)
+    rows = transform.f + transform.e * (np.arange(height) + 0.5)
+    if bottom_up:
+        rows = rows[::-1]
+
+    col_var = dst.createVariable(col_dim, 'f8', (col_dim,))
+    row_var = dst.createVariable(row_dim, 'f8', (row_dim,))
+    if geographic:
+        col_var.setncatts({'standard_name': 'longitude', 'long_name': 'longitude', 'units': 'degrees_east'})
+        row_var.setncatts({'standard_name': 'latitude', 'long_name': 'latitude', 'units': 'degrees_north'})
+    else:
+        col_var.setncatts({'standard_name': 'projection_x_coordinate', 'long_name': 'x coordinate of projection',
+                           'units': 'm'})
+        row_var.setncatts({'standard_name': 'projection_y_coordinate', 'long_name': 'y coordinate of projection',
+                           'units': 'm'})
+    col_var[:] = cols
+    row_var[:] = rows
+
+    crs_var = dst.createVariable('crs', 'c')
+    wkt = (crs or CRS.from_epsg(4326)).to_wkt()
+    crs_var.setncatts({
+        'grid_mapping_name': 'latitude_longitude' if geographic else 'unknown',
+        'crs_wkt': wkt,
+        'spatial_ref': wkt,
+        'GeoTransform': ' '.join(str(v) for v in transform.to_gdal())
+    })
+    return row_dim, col_dim
+
+
+def write_netcdf_product(file_out: Union[str, Path],
+                         data: Union[np.ndarray, Blocks],
+                         spec: VariableSpec,
+                         transform: Affine,
+                         crs: Optional[Union[CRS, str]] = None,
+                         width: Optional[int] = None,
+                         height: Optional[int] = None,
+                         global_attrs: Optional[Dict[str, Any]] = None,
+                         bottom_up: bool = True) -> Path:
+    """ Write a single-variable, CF (lat/lon) NETCDF4 product in one pass.
+
+    @param data: a 2D array, or an iterable of (window, 2D array) blocks in grid (north-up) coordinates.
+     Values are written as they are (already scaled/packed); scale_factor/add_offset are only metadata.
+    @param transform: affine transform of the north-up grid.
+    @param width, height: grid size. Required when data is an iterator of blocks.
+    @param bottom_up: store the rows south to north, like the GDAL netCDF driver does.
+    """
+    if isinstance(data, np.ndarray):
+        if data.ndim == 3:
+            data = data[0]
+        height, width = data.shape
+        blocks: Blocks = [(Window(0, 0, width, height), data)]
+        if spec.dtype is None:
+            spec = spec._replace(dtype=data.dtype.str)
+    else:
+        if width is None or height is None:
+            raise AfriCultuReSError('width and height are required when writing blocks')
+        if spec.dtype is None:
+            raise AfriCultuReSError('dtype is required when writing blocks')
+        blocks = data
+    if isinstance(crs, str):
+        crs = CRS.from_user_input(crs)
+
+    with netCDF4.Dataset(file_out, 'w', format='NETCDF4') as dst:
+        dst.set_auto_maskandscale(False)
+        dst.setncatts({'Conventions': 'CF-1.5'})
+        if global_attrs:
+            dst.setncatts(global_attrs)
+
+        row_dim, col_dim = _create_grid(dst, transform, crs, width, height, bottom_up)
+
+        chunksizes = spec.chunksizes or (DEFAULT_CHUNK, DEFAULT_CHUNK)
+        chunksizes = (max(1, min(chunksizes[0], height)), max(1, min(chunksizes[1], width)))
+        var = dst.createVariable(
+            spec.name, spec.dtype, (row_dim, col_dim),
+            shuffle=spec.shuffle, chunksizes=chunksizes, fill_value=spec.fill_value,
+            **_compression_kwargs(spec.compression, spec.complevel))
+        # the blocks are packed already. Dataset.set_auto_maskandscale only applies to the existing variables
+        var.set_auto_maskandscale(False)
+        attrs = dict(spec.attrs)
+        if spec.scale_factor is not None:
+            attrs['scale_factor'] = spec.scale_factor
+        if spec.add_offset is not None:
+            attrs['add_offset'] = spec.add_offset
+        attrs['grid_mapping'] = 'crs'
+        var.setncatts(attrs)
+
+        for window, block in blocks:
+            row_off, col_off = int(window.row_off), int(window.col_off)
+            block_height, block_width = block.shape[-2:]
+            block = block.reshape(block_height, block_width).astype(spec.dtype, copy=False)
+            if bottom_up:
+                first_row = height - row_off - block_height
+                var[first_row:first_row + block_height, col_off:col_off + block_width] = block[::-1, :]
+            else:
+                var[row_off:row_off + block_height, col_off:col_off + block_width] = block
+
+    logger.info(f'Wrote {spec.name} to {Path(file_out).name}')
+    return Path(file_out)
+
+
+def raster_to_netcdf(dataset, file_out: Union[str, Path], spec: VariableSpec,
+                     band: int = 1, rows: int = 512, **kwargs) -> Path:
+    """ write_netcdf_product for an open rasterio dataset (or WarpedVRT), streamed by row bands.
+    The fill value defaults to the nodata of the dataset. """
+    if spec.dtype is None:
+        spec = spec._replace(dtype=dataset.dtypes[band - 1])
+    if spec.fill_value is None and dataset.nodata is not None:
+        spec = spec._replace(fill_value=np.array(dataset.nodata).astype(spec.dtype).item())
+    return write_netcdf_product(
+        file_out, iter_raster_windows(dataset, band=band, rows=rows), spec,
+        transform=dataset.transform, crs=dataset.crs, width=dataset.width, height=dataset.height, **kwargs)
+
+
+__all__ = [
+    'clip_netcdf',
+    'VariableSpec',
+    'write_netcdf_product',
+    'raster_to_netcdf'
+]
@@ -0,0 +1,93 @@
+"""
+Water thresholds of the Sentinel-1 scenes per (AOI, relative orbit, date).
+
+Replaces the append-only Listparams_<aoi>.csv files. Lookups hit the unique (aoi, relative_orbit, date)
+index; writes are single-row upserts, so parallel scene processing can not corrupt the history.
+An OrbitThresholdStore caches the lookups of one task.
+"""
+import csv
+import datetime
+from logging import Logger
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from celery.utils.log import get_task_logger
+from django.db import IntegrityError, transaction
+
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.models import OrbitThreshold
+
+logger: Logger = get_task_logger(__name__)
+
+OrbitLine = NamedTuple('OrbitLine', [
+    ('date', datetime.date), ('threshold', float), ('relative_orbit', int)
+])
+
+
+def import_orbit_thresholds_csv(aoi: str, csv_file_path: Path) -> int:
+    """ Imports a legacy Listparams csv (date,threshold,relative_orbit). Rows that exist are skipped.
+    Returns the number of rows read. """
+    rows = []
+    with csv_file_path.open() as fh:
+        for record in csv.reader(fh):
+            try:
+                date = datetime.date.fromisoformat(record[0].strip()[:10])
+                threshold, relative_orbit = float(record[1]), int(float(record[2]))
+            except (ValueError, IndexError):
+                # header, or a malformed line
+                continue
+            rows.append(OrbitThreshold(aoi=aoi, relative_orbit=relative_orbit, date=date, threshold=threshold))
+    OrbitThreshold.objects.bulk_create(rows, ignore_conflicts=True)
+    logger.info(f'Imported {len(rows)} orbit thresholds of {aoi} from {csv_file_path.name}')
+    return len(rows)
+
+
+class OrbitThresholdStore(object):
+    """ The thresholds of an AOI, with the lookups cached for the lifetime of the object (one task) """
+
+    def __init__(self, aoi: str, legacy_csv_file_path: Optional[Path] = None):
+        self.aoi = aoi
+        self._latest: Dict[int, Optional[OrbitLine]] = {}
+        if legacy_csv_file_path is not None:
+            self._import_legacy(legacy_csv_file_path)
+
+    def _import_legacy(self, csv_file_path: Path):
+        """ The first time an AOI is used, carry over its csv history """
+        if not csv_file_path.exists() or OrbitThreshold.objects.filter(aoi=self.aoi).exists():
+            return
+        with advisory_lock(f'orbit_thresholds:{self.aoi}'):
+            if not OrbitThreshold.objects.filter(aoi=self.aoi).exists():
+                import_orbit_thresholds_csv(self.aoi, csv_file_path)
+
+    def latest(self, relative_orbit: int) -> Optional[OrbitLine]:
+        """ The most recent threshold of the relative orbit, or None """
+        if relative_orbit not in self._latest:
+            record = OrbitThreshold.objects.filter(
+                aoi=self.aoi, relative_orbit=relative_orbit).order_by('-date').first()
+            self._latest[relative_orbit] = None if record is None else OrbitLine(
+                date=record.date, threshold=record.threshold, relative_orbit=record.relative_orbit)
+        return self._latest[relative_orbit]
+
+    def add(self, relative_orbit: int, date: datetime.date, threshold: float) -> OrbitLine:
+        """ Inserts (or replaces) the threshold of the relative orbit at date """
+        try:
+            with transaction.atomic():
+                OrbitThreshold.objects.update_or_create(
+                    aoi=self.aoi, relative_orbit=relative_orbit, date=date,
+                    defaults={'threshold': threshold})
+        except IntegrityError:
+            # a concurrent insert of the same key won the race, overwrite it
+            OrbitThreshold.objects.filter(
+                aoi=self.aoi, relative_orbit=relative_orbit, date=date).update(threshold=threshold)
+        line = OrbitLine(date=date, threshold=threshold, relative_orbit=relative_orbit)
+        cached = self._latest.get(relative_orbit)
+        if relative_orbit in self._latest and (cached is None or cached.date <= date):
+            self._latest[relative_orbit] = line
+        return line
+
+
+__all__ = [
+    'OrbitLine',
+    'OrbitThresholdStore',
+    'import_orbit_thresholds_csv'
+]
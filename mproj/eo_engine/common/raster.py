@@ -0,0 +1,79 @@
+""" Small helpers around rasterio datasets that are shared by the processing tasks. """
+import hashlib
+from typing import NamedTuple, Tuple, Iterator, Union
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+# (xmin, ymin, xmax, ymax), like gdalwarp -te
+Bounds = Tuple[float, float, float, float]
+
+GridSignature = NamedTuple('GridSignature', [
+    ('crs', str),
+    ('transform', Tuple[float, float, float, float, float, float]),
+    ('width', int),
+    ('height', int)
+])
+
+
+def grid_signature(dataset) -> GridSignature:
+    """ The (crs, transform, shape) of an open rasterio dataset. Two rasters with the same signature
+    are pixel-aligned. """
+    return GridSignature(
+        crs=dataset.crs.to_wkt() if dataset.crs else '',
+        transform=tuple(round(v, 12) for v in dataset.transform[:6]),
+        width=dataset.width,
+        height=dataset.height
+    )
+
+
+def grid_digest(grid: GridSignature) -> str:
+    """ A short, stable token of a grid signature. Used for naming cached files. """
+    return hashlib.sha1(repr(tuple(grid)).encode('utf-8')).hexdigest()[:16]
+
+
+def iter_row_windows(width: int, height: int, rows: int = 512,
+                     col_off: int = 0, row_off: int = 0) -> Iterator[Window]:
+    """ Yields full-width windows of at most `rows` rows, top to bottom. """
+    for offset in range(0, height, rows):
+        yield Window(col_off=col_off, row_off=row_off + offset,
+                     width=width, height=min(rows, height - offset))
+
+
+def iter_raster_windows(dataset, band: int = 1, rows: int = 512) -> Iterator[Tuple[Window, np.ndarray]]:
+    """ Yields (window, 2D array) row bands of a band of an open rasterio dataset (or WarpedVRT). """
+    for window in iter_row_windows(dataset.width, dataset.height, rows=rows):
+        yield window, dataset.read(band, window=window)
+
+
+def warped_vrt(dataset, bounds: Bounds, resolution: float,
+               resampling: Union[Resampling, str] = Resampling.nearest,
+               crs: str = 'EPSG:4326') -> WarpedVRT:
+    """ A virtual, on-the-fly warp of dataset to a regular grid (the in-process `gdalwarp -te .. -tr ..`).
+    Nothing is written to disk; pixels are warped when windows of the VRT are read. """
+    xmin, ymin, xmax, ymax = bounds
+    width = int((xmax - xmin) / resolution + 0.5)
+    height = int((ymax - ymin) / resolution + 0.5)
+    if isinstance(resampling, str):
+        resampling = Resampling[resampling]
+    return WarpedVRT(
+        dataset,
+        crs=CRS.from_user_input(crs),
+        transform=from_origin(xmin, ymax, resolution, resolution),
+        width=width, height=height,
+        resampling=resampling)
+
+
+__all__ = [
+    'Bounds',
+    'GridSignature',
+    'grid_signature',
+    'grid_digest',
+    'iter_row_windows',
+    'iter_raster_windows',
+    'warped_vrt'
+]
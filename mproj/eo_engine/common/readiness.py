@@ -0,0 +1,142 @@
+"""
+Per pipeline readiness counters.
+
+PipelineReadiness holds, per (pipeline, reference_date), the input files the date needs and the ones that are
+AVAILABLE_LOCALLY. The files a date needs are Pipeline.expected_inputs or, if not set, all the discovered sources of
+the date in the input groups. The EOSource signals (post_save and the state transitions of
+eo_engine.models.transitions) increment or decrement the counters of all the pipelines of a source in one statement
+when the source enters or leaves AVAILABLE_LOCALLY, so whether the inputs of a product are complete is a single row
+lookup. A source that joins or leaves a group (m2m_changed, bulk ingestion) or is deleted recounts the dates of the
+pipelines of its groups.
+
+Updates that bypass the signals (QuerySet.update, raw SQL) are not counted: recount_readiness rebuilds the
+counters from the sources.
+"""
+import datetime
+from logging import Logger
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from celery.utils.log import get_task_logger
+from django.db import connection, transaction
+from django.utils import timezone
+
+from eo_engine.models import EOSource, EOSourceStateChoices, Pipeline, PipelineReadiness, StateTransition
+
+logger: Logger = get_task_logger(__name__)
+
+
+def _tables() -> Dict[str, str]:
+    return {
+        'readiness': PipelineReadiness._meta.db_table,
+        'pipeline': Pipeline._meta.db_table,
+        'inputs': Pipeline.input_groups.through._meta.db_table,
+        'source': EOSource._meta.db_table,
+        'source_groups': EOSource.group.through._meta.db_table
+    }
+
+
+# expected inputs of the pipeline p for the date: expected_inputs, or the discovered sources of its input groups
+_EXPECTED = """COALESCE(p.expected_inputs, (
+    SELECT COUNT(DISTINCT d.id) FROM {source} d
+    JOIN {source_groups} dg ON dg.eosource_id = d.id
+    JOIN {inputs} di ON di.eogroup_id = dg.eosourcegroup_id
+    WHERE di.pipeline_id = p.id AND d.reference_date = %(reference_date)s))"""
+
+_UPDATE_SQL = """
+INSERT INTO {readiness} (pipeline_id, reference_date, expected, available, updated_at)
+SELECT DISTINCT p.id, %(reference_date)s, """ + _EXPECTED + """, GREATEST(%(delta)s, 0), %(now)s
+FROM {pipeline} p
+JOIN {inputs} pi ON pi.pipeline_id = p.id
+JOIN {source_groups} sg ON sg.eosourcegroup_id = pi.eogroup_id
+WHERE sg.eosource_id = %(eo_source)s
+ON CONFLICT (pipeline_id, reference_date) DO UPDATE
+SET available = GREATEST({readiness}.available + %(delta)s, 0), updated_at = EXCLUDED.updated_at
+"""
+
+# the counters of the dates that have no source anymore; the others are overwritten by _RECOUNT_SQL
+_RESET_SQL = """
+UPDATE {readiness} r SET expected = COALESCE(p.expected_inputs, 0), available = 0, updated_at = %(now)s
+FROM {pipeline} p
+WHERE p.id = r.pipeline_id
+  AND (%(pipelines)s::bigint[] IS NULL OR r.pipeline_id = ANY(%(pipelines)s::bigint[]))
+  AND (%(dates)s::date[] IS NULL OR r.reference_date = ANY(%(dates)s::date[]))
+"""
+
+_RECOUNT_SQL = """
+INSERT INTO {readiness} (pipeline_id, reference_date, expected, available, updated_at)
+SELECT p.id, s.reference_date, COALESCE(p.expected_inputs, COUNT(DISTINCT s.id)),
+       COUNT(DISTINCT s.id) FILTER (WHERE s.state = %(available)s), %(now)s
+FROM {pipeline} p
+JOIN {inputs} pi ON pi.pipeline_id = p.id
+JOIN {source_groups} sg ON sg.eosourcegroup_id = pi.eogroup_id
+JOIN {source} s ON s.id = sg.eosource_id
+WHERE (%(pipelines)s::bigint[] IS NULL OR p.id = ANY(%(pipelines)s::bigint[]))
+  AND (%(dates)s::date[] IS NULL OR s.reference_date = ANY(%(dates)s::date[]))
+GROUP BY p.id, p.expected_inputs, s.reference_date
+ON CONFLICT (pipeline_id, reference_date) DO UPDATE
+SET expected = EXCLUDED.expected, available = EXCLUDED.available, updated_at = EXCLUDED.updated_at
+"""
+
+
+def update_readiness(eo_source: Union[EOSource, StateTransition], delta: int):
+    """ Adds delta (+1: the source became AVAILABLE_LOCALLY, -1: it is not anymore) to the available inputs
+    of all the pipelines of eo_source (or of the source of a transition), for its reference date """
+    with connection.cursor() as cursor:
+        cursor.execute(_UPDATE_SQL.format(**_tables()), {
+            'reference_date': eo_source.reference_date, 'delta': delta, 'now': timezone.now(),
+            'eo_source': eo_source.pk})
+
+
+def recount_readiness(pipelines: Optional[Iterable[Pipeline]] = None,
+                      reference_dates: Optional[Iterable[datetime.date]] = None) -> int:
+    """ Rebuilds the counters (of pipelines and reference_dates, or of all of them) from the sources.
+    Returns the rows of the dates that have sources """
+    params = {'available': EOSourceStateChoices.AVAILABLE_LOCALLY, 'now': timezone.now(),
+              'pipelines': None if pipelines is None else [pipeline.pk for pipeline in pipelines],
+              'dates': None if reference_dates is None else list(set(reference_dates))}
+    if params['pipelines'] == [] or params['dates'] == []:
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(_RESET_SQL.format(**_tables()), params)
+        cursor.execute(_RECOUNT_SQL.format(**_tables()), params)
+        return cursor.rowcount
+
+
+def recount_memberships(eo_source_pks: Iterable[int], group_pks: Iterable[int]) -> int:
+    """ Recounts the dates of the sources eo_source_pks in the pipelines of the groups group_pks, after the sources
+    joined or left the groups: the expected (discovered) and the available inputs of those dates changed """
+    pipelines = list(Pipeline.objects.filter(input_groups__in=list(group_pks)).distinct())
+    if not pipelines:
+        return 0
+    reference_dates = EOSource.objects.filter(pk__in=list(eo_source_pks)) \
+        .values_list('reference_date', flat=True).distinct()
+    return recount_readiness(pipelines, reference_dates)
+
+
+def is_ready(expected: int, available: int) -> bool:
+    """ The rule of the counters: a date with no expected (discovered) input is not ready """
+    return 0 < expected <= available
+
+
+def pipeline_readiness(pipeline: Pipeline,
+                       dates: Iterable[datetime.date]) -> Dict[datetime.date, Tuple[int, int]]:
+    """ {reference_date: (expected, available)} of the dates that have a counter """
+    return {reference_date: (expected, available) for reference_date, expected, available in
+            PipelineReadiness.objects.filter(pipeline=pipeline, reference_date__in=list(dates))
+            .values_list('reference_date', 'expected', 'available')}
+
+
+def inputs_ready(pipeline: Pipeline, reference_date: datetime.date) -> bool:
+    """ True if all the inputs of pipeline for reference_date are AVAILABLE_LOCALLY """
+    expected, available = pipeline_readiness(pipeline, [reference_date]).get(reference_date, (0, 0))
+    return is_ready(expected, available)
+
+
+__all__ = [
+    'update_readiness',
+    'recount_readiness',
+    'recount_memberships',
+    'is_ready',
+    'pipeline_readiness',
+    'inputs_ready'
+]
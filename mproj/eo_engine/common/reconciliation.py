@@ -0,0 +1,99 @@
+"""
+Set-based reconciliation of the EOProducts with their inputs.
+
+Rebuilds the readiness counters from the sources, then for every pipeline creates the missing products and
+updates the stale ones in bulk, a few queries per pipeline and chunk of dates:
+- pipelines of EOSource groups: the dates of the readiness counters, resolved like the dependency resolver
+  does (eo_engine.common.dependencies.resolve_pipeline);
+- pipelines of EOProduct groups: an AVAILABLE output for every date with a READY input and no output yet.
+Temporal aggregation pipelines are skipped, their outputs follow the folds of their inputs.
+
+No row is saved one by one, so no post-save signal cascade runs.
+"""
+import datetime
+from logging import Logger
+from typing import Callable, List, NamedTuple, Optional
+
+from celery.utils.log import get_task_logger
+from django.db.models import Q
+
+from eo_engine.common.dependencies import resolve_pipeline
+from eo_engine.common.readiness import recount_readiness
+from eo_engine.models import EOProduct, EOProductGroup, EOProductStateChoices, EOSourceGroup, Pipeline
+
+logger: Logger = get_task_logger(__name__)
+
+# the 10m flood products are made from mid August to mid October, see eo_engine.models.eo_product.should_create
+FLOODS_10M_TASK = 'task_s04p03_floods10m'
+FLOODS_10M_SEASON = (Q(reference_date__month=8, reference_date__day__gte=14) | Q(reference_date__month=9) |
+                     Q(reference_date__month=10, reference_date__day__lte=16))
+
+ReconciliationReport = NamedTuple('ReconciliationReport', [
+    ('pipelines', int),
+    ('created', int),
+    ('updated', int)
+])
+
+# progress(pipelines done, pipelines, report so far)
+ProgressCallback = Callable[[int, int, ReconciliationReport], None]
+
+
+def _chunks(dates: List[datetime.date], size: int):
+    for start in range(0, len(dates), size):
+        yield dates[start:start + size]
+
+
+def reconcile_product_pipeline(pipeline: Pipeline) -> int:
+    """ Creates the missing outputs of a pipeline of EOProduct groups. Returns the created products """
+    output_group = pipeline.output_group.as_eoproduct_group()
+    missing = EOProduct.objects.filter(group__in=pipeline.input_groups.all(), state=EOProductStateChoices.READY) \
+        .exclude(reference_date__in=EOProduct.objects.filter(group=output_group).values('reference_date')) \
+        .order_by('reference_date').distinct('reference_date')
+    if pipeline.task_name == FLOODS_10M_TASK:
+        missing = missing.filter(FLOODS_10M_SEASON)
+    created = EOProduct.objects.bulk_create([
+        EOProduct(filename=pipeline.output_filename(YYYYMMDD=eo_product.reference_date.strftime('%Y%m%d'),
+                                                    YYYY=eo_product.reference_date.strftime('%Y')),
+                  group=output_group, reference_date=eo_product.reference_date,
+                  state=EOProductStateChoices.AVAILABLE)
+        for eo_product in missing], ignore_conflicts=True)
+    return len(created)
+
+
+def reconcile_products(progress: Optional[ProgressCallback] = None, chunk_size: int = 1000) -> ReconciliationReport:
+    """ Reconciles the products of all the pipelines. progress is called after every pipeline """
+    # netCDF4/rasterio: not on import, the module is imported by the lightweight workers
+    from eo_engine.common.aggregation import is_aggregation_pipeline
+
+    counters = recount_readiness()
+    logger.info(f'Recounted {counters} readiness counters')
+
+    pipelines = list(Pipeline.objects.select_related('output_group').prefetch_related('input_groups'))
+    created = updated = 0
+    for done, pipeline in enumerate(pipelines, start=1):
+        input_group_ids = [group.pk for group in pipeline.input_groups.all()]
+        if is_aggregation_pipeline(pipeline) or not input_group_ids:
+            pass
+        elif EOSourceGroup.objects.filter(pk__in=input_group_ids).count() == len(input_group_ids):
+            dates = list(pipeline.readiness.order_by('reference_date').values_list('reference_date', flat=True))
+            for dates_chunk in _chunks(dates, chunk_size):
+                chunk_created, chunk_updated = resolve_pipeline(pipeline, dates_chunk)
+                created += chunk_created
+                updated += chunk_updated
+        elif EOProductGroup.objects.filter(pk__in=input_group_ids).count() == len(input_group_ids):
+            created += reconcile_product_pipeline(pipeline)
+        else:
+            logger.error(f'{pipeline}: mixed EOSource/EOProduct input groups, skipped')
+
+        report = ReconciliationReport(pipelines=done, created=created, updated=updated)
+        logger.info(f'Reconciled {pipeline} ({done}/{len(pipelines)}): {created} created, {updated} updated so far')
+        if progress is not None:
+            progress(done, len(pipelines), report)
+    return ReconciliationReport(pipelines=len(pipelines), created=created, updated=updated)
+
+
+__all__ = [
+    'ReconciliationReport',
+    'reconcile_product_pipeline',
+    'reconcile_products'
+]
@@ -0,0 +1,147 @@
+"""
+Integer-factor aggregation of rasters (e.g. 300m -> 1km, a factor of 3).
+
+When every target pixel covers exactly factor x factor source pixels, resampling is a block reduction:
+the source is read in row bands, every band is reshaped to (h, factor, w, factor) and reduced over the
+two factor axes. That is much cheaper than a general warp, which transforms the coordinates of every pixel.
+
+Reading is done in the calling thread (rasterio datasets must not be shared between threads); the
+reductions run in a thread pool (numpy releases the GIL). Celery prefork workers are daemonic processes
+and can not start child processes, so threads are used instead of a process pool.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Iterator, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from affine import Affine
+from celery.utils.log import get_task_logger
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from eo_engine.common.raster import Bounds
+from eo_engine.errors import AfriCultuReSError
+
+logger: Logger = get_task_logger(__name__)
+
+# how far (in source pixels) the target grid may be from an exact alignment
+ALIGNMENT_TOLERANCE = 1e-3
+
+AggregatedGrid = NamedTuple('AggregatedGrid', [
+    ('transform', Affine),
+    ('width', int),
+    ('height', int),
+    # offset of the first target pixel in the source grid, in source pixels. Can be negative.
+    ('col_off', int),
+    ('row_off', int)
+])
+
+
+def aggregated_grid(src, factor: int, bounds: Optional[Bounds] = None) -> AggregatedGrid:
+    """ The target grid of an aggregation of src by factor, optionally limited/extended to bounds.
+    Raises AfriCultuReSError if the target grid is not aligned with the source pixels. """
+    src_transform: Affine = src.transform
+    if src_transform.b != 0 or src_transform.d != 0:
+        raise AfriCultuReSError('Only north-up rasters can be aggregated')
+    res_x, res_y = src_transform.a, -src_transform.e
+
+    if bounds is None:
+        xmin, ymax = src_transform.c, src_transform.f
+        width, height = src.width // factor, src.height // factor
+    else:
+        xmin, ymin, xmax, ymax = bounds
+        width = int((xmax - xmin) / (res_x * factor) + 0.5)
+        height = int((ymax - ymin) / (res_y * factor) + 0.5)
+
+    col_off = (xmin - src_transform.c) / res_x
+    row_off = (src_transform.f - ymax) / res_y
+    for offset in (col_off, row_off):
+        if abs(offset - round(offset)) > ALIGNMENT_TOLERANCE:
+            raise AfriCultuReSError(f'The target grid is not aligned with the source grid (offset: {offset} pixels)')
+
+    return AggregatedGrid(
+        transform=from_origin(xmin, ymax, res_x * factor, res_y * factor),
+        width=width, height=height,
+        col_off=int(round(col_off)), row_off=int(round(row_off)))
+
+
+def flag_aware_mean(block: np.ndarray, factor: int, nodata: float,
+                    flags: Sequence[int] = (), dtype: Optional[str] = None) -> np.ndarray:
+    """ Mean of every factor x factor cell of block, ignoring nodata and the flag values.
+    Cells without any valid pixel get their most frequent flag, or nodata if they have only nodata.
+    Integer outputs are rounded half up, like the GDAL average resampling. """
+    dtype = np.dtype(dtype or block.dtype)
+    h, w = block.shape[0] // factor, block.shape[1] // factor
+    cells = block[:h * factor, :w * factor].reshape(h, factor, w, factor)
+
+    valid = cells != nodata
+    for flag in flags:
+        valid &= cells != flag
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, cells, 0).sum(axis=(1, 3), dtype='f8')
+    mean = np.divide(total, count, out=np.zeros(count.shape, dtype='f8'), where=count > 0)
+    if np.issubdtype(dtype, np.integer):
+        mean = np.floor(mean + 0.5)
+
+    fallback = np.full(count.shape, nodata, dtype='f8')
+    if flags:
+        flag_counts = np.stack([(cells == flag).sum(axis=(1, 3)) for flag in flags])
+        most_frequent = np.asarray(flags, dtype='f8')[flag_counts.argmax(axis=0)]
+        fallback = np.where(flag_counts.max(axis=0) > 0, most_frequent, fallback)
+
+    return np.where(count > 0, mean, fallback).astype(dtype)
+
+
+def iter_aggregated_windows(src, factor: int,
+                            bounds: Optional[Bounds] = None,
+                            band: int = 1,
+                            nodata: Optional[float] = None,
+                            flags: Sequence[int] = (),
+                            dtype: Optional[str] = None,
+                            rows: int = 256,
+                            workers: Optional[int] = None) -> Iterator[Tuple[Window, np.ndarray]]:
+    """ Yields (window, 2D array) row bands of the target grid (see aggregated_grid), top to bottom.
+
+    @param nodata: nodata of the source (and of the output). Defaults to the nodata of src.
+    @param flags: source values that are not averaged (e.g. 251-255 of the CGLS NDVI).
+    @param rows: number of target rows per band.
+    @param workers: number of reduction threads. Defaults to the number of CPUs (max 8).
+    """
+    if nodata is None:
+        nodata = src.nodata
+    if nodata is None:
+        raise AfriCultuReSError('A nodata value is needed for the aggregation')
+    grid = aggregated_grid(src, factor, bounds)
+    workers = workers or min(8, os.cpu_count() or 1)
+    logger.info(f'Aggregating {src.name} by {factor}x{factor} to {grid.width}x{grid.height}; threads: {workers}')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for target_row in range(0, grid.height, rows):
+            band_rows = min(rows, grid.height - target_row)
+            window = Window(0, target_row, grid.width, band_rows)
+            src_window = Window(grid.col_off, grid.row_off + target_row * factor,
+                                grid.width * factor, band_rows * factor)
+            # boundless reads are slower, only use them where the target grid is outside of the source
+            inside = (src_window.col_off >= 0 and src_window.row_off >= 0
+                      and src_window.col_off + src_window.width <= src.width
+                      and src_window.row_off + src_window.height <= src.height)
+            data = src.read(band, window=src_window, boundless=not inside, fill_value=nodata)
+            pending.append((window, executor.submit(flag_aware_mean, data, factor, nodata, flags, dtype)))
+            # bound the number of bands in memory
+            if len(pending) > 2 * workers:
+                w, future = pending.popleft()
+                yield w, future.result()
+        while pending:
+            w, future = pending.popleft()
+            yield w, future.result()
+
+
+__all__ = [
+    'AggregatedGrid',
+    'aggregated_grid',
+    'flag_aware_mean',
+    'iter_aggregated_windows'
+]
@@ -1,13 +1,9 @@
-from eo_engine.models import EOSource, EOSourceGroup, EOSourceStateChoices
+from eo_engine.common.readiness import inputs_ready
+from eo_engine.models import EOSource, EOSourceGroup, Pipeline
 
 
 def is_s04p03_fld_complete_for_group(eo_source: EOSource, input_group: EOSourceGroup) -> bool:
-    # this batch is comprised by 25 entries.
+    # this batch is comprised by 25 entries: the expected inputs of the pipelines of the group
 
-    reference_date = eo_source.reference_date
-    qs = EOSource.objects.filter(group=input_group)
-    qs = qs.filter(reference_date=reference_date)
-    qs = qs.filter(state=EOSourceStateChoices.AVAILABLE_LOCALLY)
-    count = qs.count()
-
-    return count == 25
+    pipelines = list(Pipeline.objects.filter(input_groups=input_group))
+    return bool(pipelines) and all(inputs_ready(pipeline, eo_source.reference_date) for pipeline in pipelines)
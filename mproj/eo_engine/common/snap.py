@@ -0,0 +1,64 @@
+"""
+Process-wide SNAP (snappy) state.
+
+Registering the GPF operators and reading the static aux products are paid on every SNAP task. Both are
+done once per worker process here, so the products of a batch task (see eo_engine.tasks.batch) reuse them.
+"""
+import os
+import sys
+from functools import lru_cache
+from logging import Logger
+from typing import Optional
+
+from celery.utils.log import get_task_logger
+
+logger: Logger = get_task_logger(__name__)
+
+
+@lru_cache(maxsize=None)
+def load_operator_spis():
+    from snappy import GPF
+
+    logger.info('Loading the SNAP GPF operators')
+    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+
+
+@lru_cache(maxsize=None)
+def java_type(name: str):
+    import snappy
+
+    return snappy.jpy.get_type(name)
+
+
+@lru_cache(maxsize=16)
+def _read_aux_product(path: str, mtime: float):
+    from snappy import ProductIO
+
+    logger.info(f'Reading the aux product {path}')
+    return ProductIO.readProduct(path)
+
+
+def read_aux_product(path: str):
+    """ A read-only aux product (e.g. an NDVI LTS file), read once per process and file version.
+    The returned product is shared: it must not be modified or disposed. """
+    return _read_aux_product(path, os.path.getmtime(path))
+
+
+def jvm_heap_used_mb() -> Optional[float]:
+    """ Heap in use by the JVM of snappy, in MB. None if no SNAP task started the JVM in this process """
+    if 'jpy' not in sys.modules:
+        return None
+    import jpy
+
+    if not jpy.has_jvm():
+        return None
+    runtime = jpy.get_type('java.lang.Runtime').getRuntime()
+    return (runtime.totalMemory() - runtime.freeMemory()) / 1024 ** 2
+
+
+__all__ = [
+    'load_operator_spis',
+    'java_type',
+    'read_aux_product',
+    'jvm_heap_used_mb'
+]
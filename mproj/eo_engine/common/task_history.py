@@ -0,0 +1,94 @@
+"""
+Queries and retention of the task history: GeopTask/GeopGroupTask and the celery results (django_celery_results).
+
+The tables grow with every task. purge_task_history deletes, in batches of settings.TASK_HISTORY_PURGE_BATCH_SIZE:
+- the finished GeopTasks submitted more than settings.TASK_HISTORY_RETENTION_DAYS ago, with their EOSource/EOProduct
+  links. Tasks still waiting or running are kept, whatever their age;
+- the GeopGroupTasks of that age with no task left;
+- the TaskResults/GroupResults done more than settings.TASK_RESULT_RETENTION_DAYS ago.
+Every batch is a short transaction: the workers recording tasks are not blocked behind one long delete.
+"""
+import datetime
+from logging import Logger
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from eo_engine.models import GeopGroupTask, GeopTask
+
+logger: Logger = get_task_logger(__name__)
+
+# the tasks that will not change anymore
+PURGEABLE_STATUSES = [
+    GeopTask.TaskTypeChoices.SUCCESS,
+    GeopTask.TaskTypeChoices.FAILURE,
+    GeopTask.TaskTypeChoices.REVOKED,
+    GeopTask.TaskTypeChoices.UNKNOWN
+]
+
+PurgeReport = NamedTuple('PurgeReport', [
+    ('tasks', int),
+    ('group_tasks', int),
+    ('results', int)
+])
+
+
+def latest_tasks(eo_product_pks: Iterable[int]) -> Dict[int, GeopTask]:
+    """ The latest task of each EOProduct, by pk. Products without tasks are missing.
+    Two queries whatever the number of products, served by geoptask_eo_product_latest_idx """
+    through = GeopTask.eo_product.through
+    task_pks = dict(through.objects.filter(eoproduct_id__in=list(eo_product_pks))
+                    .order_by('eoproduct_id', '-geoptask_id').distinct('eoproduct_id')
+                    .values_list('eoproduct_id', 'geoptask_id'))
+    tasks = GeopTask.objects.in_bulk(list(task_pks.values()))
+    return {eo_product_pk: tasks[task_pk] for eo_product_pk, task_pk in task_pks.items() if task_pk in tasks}
+
+
+def _delete_in_batches(qs: QuerySet, batch_size: int, delete) -> int:
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            pks: List[int] = list(qs.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            delete(pks)
+        deleted += len(pks)
+
+
+def purge_task_history(now: Optional[datetime.datetime] = None, batch_size: Optional[int] = None) -> PurgeReport:
+    """ Deletes the task history older than the retention settings, see the module """
+    from django_celery_results.models import GroupResult, TaskResult
+
+    now = now or timezone.now()
+    batch_size = batch_size or settings.TASK_HISTORY_PURGE_BATCH_SIZE
+    tasks_before = now - datetime.timedelta(days=settings.TASK_HISTORY_RETENTION_DAYS)
+    results_before = now - datetime.timedelta(days=settings.TASK_RESULT_RETENTION_DAYS)
+
+    tasks = _delete_in_batches(
+        GeopTask.objects.filter(status__in=PURGEABLE_STATUSES, datetime_submitted__lt=tasks_before),
+        # the EOSource/EOProduct links go with the tasks, one statement per table
+        batch_size, lambda pks: GeopTask.objects.filter(pk__in=pks).delete())
+    group_tasks = _delete_in_batches(
+        GeopGroupTask.objects.filter(timestamp__lt=tasks_before, geop_task__isnull=True),
+        batch_size, lambda pks: GeopGroupTask.objects.filter(pk__in=pks).delete())
+    results = 0
+    for model in (TaskResult, GroupResult):
+        results += _delete_in_batches(
+            model.objects.filter(date_done__lt=results_before),
+            batch_size, lambda pks, model=model: model.objects.filter(pk__in=pks).delete())
+
+    report = PurgeReport(tasks=tasks, group_tasks=group_tasks, results=results)
+    logger.info(f'Task history purge: {report}')
+    return report
+
+
+__all__ = [
+    'PURGEABLE_STATUSES',
+    'PurgeReport',
+    'latest_tasks',
+    'purge_task_history'
+]
@@ -0,0 +1,72 @@
+"""
+Lazy task registry.
+
+eo_engine.tasks only maps the task names to their modules (eo_engine.tasks.TASK_MODULES); importing a task
+module pulls its dependencies (snappy starts a JVM, GDAL/rasterio/netCDF4 load their drivers). A worker
+imports the modules of the tasks routed to the queues it consumes (settings.CELERY_ROUTES, the celery
+default queue for the rest), on the celeryd_after_setup signal, before the pool forks. The download and
+crawl workers start without the processing stack; the process worker pays for it once, in the parent.
+
+Set settings.LAZY_TASK_IMPORTS = False to import every task module on every worker.
+"""
+from fnmatch import fnmatchcase
+from importlib import import_module
+from logging import Logger
+from typing import Dict, Iterable, List
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+logger: Logger = get_task_logger(__name__)
+
+TASKS_PACKAGE = 'eo_engine.tasks'
+
+
+def task_modules() -> Dict[str, List[str]]:
+    """ {full module name: [full task names]} """
+    from eo_engine.tasks import TASK_MODULES
+
+    return {f'{TASKS_PACKAGE}.{module}': [f'{TASKS_PACKAGE}.{module}.{task}' for task in tasks]
+            for module, tasks in TASK_MODULES.items()}
+
+
+def default_queue() -> str:
+    return getattr(settings, 'CELERY_TASK_DEFAULT_QUEUE', 'celery')
+
+
+def task_queue(task_name: str) -> str:
+    """ The queue of a task (full name), following the glob patterns of settings.CELERY_ROUTES """
+    routes: Dict[str, str] = getattr(settings, 'CELERY_ROUTES', {})
+    for pattern, route in routes.items():
+        if fnmatchcase(task_name, pattern):
+            return route['queue'] if isinstance(route, dict) else route
+    return default_queue()
+
+
+def queue_modules(queues: Iterable[str]) -> List[str]:
+    """ The task modules that have at least one task routed to one of queues """
+    queues = set(queues)
+    return [module for module, tasks in task_modules().items()
+            if any(task_queue(task) in queues for task in tasks)]
+
+
+def import_queue_tasks(queues: Iterable[str]) -> List[str]:
+    """ Imports (registers the tasks of) the task modules of queues. Returns the imported modules """
+    queues = list(queues)
+    if getattr(settings, 'LAZY_TASK_IMPORTS', True):
+        modules = queue_modules(queues)
+    else:
+        modules = list(task_modules())
+    for module in modules:
+        import_module(module)
+    logger.info(f'Queues {", ".join(queues)}: imported {", ".join(modules) or "no task modules"}')
+    return modules
+
+
+__all__ = [
+    'task_modules',
+    'default_queue',
+    'task_queue',
+    'queue_modules',
+    'import_queue_tasks'
+]
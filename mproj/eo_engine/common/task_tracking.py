@@ -0,0 +1,246 @@
+"""
+Buffered recording of the task lifecycle in GeopTask/GeopGroupTask.
+
+The publisher (before_task_publish) and the worker hooks (BaseTaskWithRetry) only append events to an in-memory
+buffer. A background thread of the process writes them every settings.TASK_TRACKING_FLUSH_INTERVAL seconds, or as
+soon as settings.TASK_TRACKING_BATCH_SIZE events wait, in a few bulk statements per flush:
+- the group tasks and the tasks, one bulk insert each (ignore_conflicts: a retry republishes the same task_id);
+- their EOSource/EOProduct links, one bulk insert per relation;
+- the state changes, one locking read and one bulk update.
+
+The rows are the same as when they were written one by one, a moment later. The worker records the task with its
+state changes: the row is written by whichever process flushes first, a pool process may exit before the publisher
+flushes. A state change without its task, whose row is not written yet, waits for the next flushes. The pool
+processes flush on exit.
+settings.TASK_TRACKING_BUFFERED = False writes every event when it is recorded.
+"""
+import atexit
+import datetime
+import os
+import threading
+from logging import Logger
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from eo_engine.models import GeopGroupTask, GeopTask
+
+logger: Logger = get_task_logger(__name__)
+
+# flushes that a state change waits for the row of its task
+MAX_ATTEMPTS = 10
+
+Published = NamedTuple('Published', [
+    ('task_id', str),
+    ('task_name', str),
+    ('task_args', str),
+    ('task_kwargs', dict),
+    ('parent_id', Optional[str]),
+    ('root_id', Optional[str]),
+    ('group_task_id', Optional[str]),
+    ('group_root_id', Optional[str]),
+    ('eo_source_pks', Tuple[int, ...]),
+    ('eo_product_pks', Tuple[int, ...])
+])
+
+Transition = NamedTuple('Transition', [
+    ('task_id', str),
+    ('status', str),
+    ('at', datetime.datetime),
+    ('attempts', int),
+    ('published', Optional[Published])
+])
+
+
+def is_tracked(task_name: Optional[str]) -> bool:
+    """ Only the tasks of the project are tracked """
+    return bool(task_name) and task_name.startswith(('eo_engine', 'mproj', 'app'))
+
+
+def linked_pks(task_kwargs: dict) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """ The EOSources and the EOProducts a task is linked to, from its kwargs """
+
+    def pks(value) -> tuple:
+        if not value:
+            return ()
+        return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+
+    # eo_product_pks: batch tasks (task_batch_generate_eoproducts)
+    return (pks(task_kwargs.get('eo_source_pk')),
+            pks(task_kwargs.get('eo_product_pk')) + pks(task_kwargs.get('eo_product_pks')))
+
+
+class TaskTracker:
+    """ The buffer of the events of a process. background=False: events are written by flush() only """
+
+    def __init__(self, background: bool = True):
+        self.background = background
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # a forked process starts empty: the parent writes its own events
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._published: List[Published] = []
+        self._transitions: List[Transition] = []
+
+    def task_published(self, published: Published):
+        self._append(self._published, published)
+
+    def task_transition(self, task_id: str, status: str, published: Optional[Published] = None):
+        """ published: the task, written with the transition if its row is not written yet """
+        self._append(self._transitions, Transition(task_id=str(task_id), status=status, at=timezone.now(),
+                                                   attempts=0, published=published))
+
+    def _append(self, buffer: list, event):
+        with self._lock:
+            buffer.append(event)
+            waiting = len(self._published) + len(self._transitions)
+        if not getattr(settings, 'TASK_TRACKING_BUFFERED', True):
+            self.flush()
+            return
+        if not self.background:
+            return
+        self._start()
+        if waiting >= getattr(settings, 'TASK_TRACKING_BATCH_SIZE', 500):
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='task-tracker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        interval = getattr(settings, 'TASK_TRACKING_FLUSH_INTERVAL', 1.0)
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'Task tracking: flush failed, retrying: {e}')
+
+    def flush(self) -> Tuple[int, int]:
+        """ Writes the buffered events. Returns (published, transitions) written """
+        with self._flush_lock:
+            with self._lock:
+                published, self._published = self._published, []
+                transitions, self._transitions = self._transitions, []
+            if not (published or transitions):
+                return 0, 0
+            close_old_connections()
+            try:
+                with transaction.atomic():
+                    self._write_published(published)
+                    waiting = self._write_transitions(transitions)
+            except Exception:
+                with self._lock:
+                    self._published[:0] = published
+                    self._transitions[:0] = transitions
+                raise
+            with self._lock:
+                self._transitions[:0] = waiting
+            return len(published), len(transitions) - len(waiting)
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f'Task tracking: events lost on exit: {e}')
+
+    @staticmethod
+    def _write_published(published: List[Published]):
+        if not published:
+            return
+        groups = {(p.group_task_id, p.group_root_id) for p in published if p.group_task_id}
+        GeopGroupTask.objects.bulk_create(
+            [GeopGroupTask(group_task_id=group_task_id, root_id=root_id) for group_task_id, root_id in groups],
+            ignore_conflicts=True)
+
+        # the first publication of a task_id wins, like get_or_create
+        tasks: Dict[str, Published] = {}
+        for p in published:
+            tasks.setdefault(p.task_id, p)
+        GeopTask.objects.bulk_create([
+            GeopTask(task_id=p.task_id, task_name=p.task_name, task_args=p.task_args, task_kwargs=p.task_kwargs,
+                     parent_id=p.parent_id, root_id=p.root_id, group_task_id=p.group_task_id)
+            for p in tasks.values()], ignore_conflicts=True)
+
+        pks = {str(task_id): pk for task_id, pk in
+               GeopTask.objects.filter(task_id__in=list(tasks)).values_list('task_id', 'pk')}
+        eo_sources, eo_products = GeopTask.eo_source.through, GeopTask.eo_product.through
+        eo_sources.objects.bulk_create([
+            eo_sources(geoptask_id=pks[p.task_id], eosource_id=pk) for p in tasks.values() for pk in p.eo_source_pks
+        ], ignore_conflicts=True)
+        eo_products.objects.bulk_create([
+            eo_products(geoptask_id=pks[p.task_id], eoproduct_id=pk) for p in tasks.values() for pk in p.eo_product_pks
+        ], ignore_conflicts=True)
+        logger.info(f'Task tracking: recorded {len(tasks)} tasks')
+
+    @classmethod
+    def _write_transitions(cls, transitions: List[Transition]) -> List[Transition]:
+        """ Applies the transitions in order. Returns the ones whose task is not written yet """
+        if not transitions:
+            return []
+        task_ids = list({t.task_id for t in transitions})
+        tasks = {str(task_id): task for task_id, task in GeopTask.objects.select_for_update().in_bulk(
+            task_ids, field_name='task_id').items()}
+        # the tasks the worker recorded before their publisher did
+        missing = [t.published for t in transitions if t.published is not None and t.task_id not in tasks]
+        if missing:
+            cls._write_published(missing)
+            tasks = {str(task_id): task for task_id, task in GeopTask.objects.select_for_update().in_bulk(
+                task_ids, field_name='task_id').items()}
+
+        waiting: List[Transition] = []
+        changed: Dict[str, GeopTask] = {}
+        groups_started: Dict[str, datetime.datetime] = {}
+        for transition in transitions:
+            task = tasks.get(transition.task_id)
+            if task is None:
+                if transition.attempts + 1 < MAX_ATTEMPTS:
+                    waiting.append(transition._replace(attempts=transition.attempts + 1))
+                else:
+                    logger.info(f'Task tracking: {transition.task_id} is not tracked by app')
+                continue
+
+            task.status = transition.status
+            if transition.status == GeopTask.TaskTypeChoices.STARTED:
+                task.datetime_started = transition.at
+                if task.group_task_id:
+                    groups_started.setdefault(str(task.group_task_id), transition.at)
+            elif transition.status == GeopTask.TaskTypeChoices.RETRY:
+                task.retries += 1
+            elif transition.status in (GeopTask.TaskTypeChoices.SUCCESS, GeopTask.TaskTypeChoices.FAILURE):
+                task.datetime_finished = transition.at
+                if transition.status == GeopTask.TaskTypeChoices.SUCCESS and task.datetime_started:
+                    task.time_to_complete = str(task.datetime_finished - task.datetime_started)
+            changed[transition.task_id] = task
+
+        GeopTask.objects.bulk_update(
+            changed.values(), ['status', 'datetime_started', 'datetime_finished', 'time_to_complete', 'retries'])
+        if groups_started:
+            GeopGroupTask.objects.filter(group_task_id__in=list(groups_started), datetime_started__isnull=True) \
+                .update(datetime_started=min(groups_started.values()))
+        return waiting
+
+
+tracker = TaskTracker()
+atexit.register(tracker.close)
+
+__all__ = [
+    'Published',
+    'TaskTracker',
+    'Transition',
+    'is_tracked',
+    'linked_pks',
+    'tracker'
+]
@@ -2,7 +2,7 @@ from typing import List, Union
 import re
 from more_itertools import collapse
 
-RE_PROCESS_TASK = re.compile(r'eo_engine\.tasks.*task_s[0-9]{1,2}p[0-9]{1,2}.+$')
+RE_PROCESS_TASK = re.compile(r'eo_engine\.tasks.*(task_s[0-9]{1,2}p[0-9]{1,2}.+|task_temporal_aggregation)$')
 
 
 def is_process_task(task_name: str) -> bool:
@@ -24,17 +24,19 @@ def get_task_ref_from_name(token: Union[str, List[str]]):
 def revoke_task(task_id, terminate: bool = False):
     from mproj import celery_app as app
     from eo_engine.models import GeopTask
-    from eo_engine.models import EOSourceStateChoices, EOProductStateChoices
+    from eo_engine.models import EOSourceStateChoices, EOProductStateChoices, transition_eo_product, transition_eo_source
 
     task = GeopTask.objects.get(task_id=task_id)
 
+    # products already made and sources already downloaded are kept
     if task.eo_product.exists():
-        db_entries = task.eo_product.all()
-        db_entries.update(status=EOProductStateChoices.IGNORE)
+        for pk in task.eo_product.values_list('pk', flat=True):
+            transition_eo_product(pk, EOProductStateChoices.IGNORE, from_states=[
+                state for state in EOProductStateChoices.values if state != EOProductStateChoices.READY])
 
     elif task.eo_source.exists():
-        db_entries = task.eo_source.all()
-        db_entries.update(status=EOSourceStateChoices.IGNORE)
-    task.state = GeopTask.TaskTypeChoices.REVOKED
-    task.save()
+        for pk in task.eo_source.values_list('pk', flat=True):
+            transition_eo_source(pk, EOSourceStateChoices.IGNORE, from_states=[
+                state for state in EOSourceStateChoices.values if state != EOSourceStateChoices.AVAILABLE_LOCALLY])
+    GeopTask.objects.filter(pk=task.pk).update(status=GeopTask.TaskTypeChoices.REVOKED)
     app.control.revoke(task_id=task_id, terminate=terminate)
@@ -1,7 +1,7 @@
 import calendar
 from datetime import datetime, date as dt_date
 from math import ceil
-from typing import Literal, Tuple
+from typing import Iterator, Literal, Tuple
 
 from dateutil.relativedelta import relativedelta
 
@@ -140,3 +140,12 @@ def day2dekad(day: int):
         dekad = 3
 
     return dekad
+
+
+def running_dekads(from_date: dt_date, to_date: dt_date) -> Iterator[Tuple[int, int]]:
+    """ (year, running dekad) of every dekad from the dekad of from_date to the dekad of to_date, once each """
+    year, rdekad = from_date.year, int(month_dekad_to_running_decad(from_date.month, day2dekad(from_date.day)))
+    last = (to_date.year, int(month_dekad_to_running_decad(to_date.month, day2dekad(to_date.day))))
+    while (year, rdekad) <= last:
+        yield year, rdekad
+        year, rdekad = (year, rdekad + 1) if rdekad < 36 else (year + 1, 1)
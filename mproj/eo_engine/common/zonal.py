@@ -0,0 +1,311 @@
+"""
+Zonal statistics of the products per administrative unit.
+
+Zone sets (e.g. countries, districts) are configured in settings.ZONE_SETS; which zone sets apply to which
+product groups (glob patterns, like the layout profiles) in settings.ZONAL_STATISTICS_GROUPS. A zone set is
+rasterized once per grid to a label raster (cached next to the cutline masks); the statistics of all the
+zones are then a few bincounts over the product, one row band at a time.
+
+A ZonalAccumulator can also tap the blocks a task writes (see tap_blocks), so the statistics come from
+the arrays already in memory instead of a second read of the product.
+"""
+import datetime
+import os
+from fnmatch import fnmatchcase
+from logging import Logger
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from rasterio.windows import Window
+
+from eo_engine.common.masks import get_mask_cache_dir, shapefile_fingerprint
+from eo_engine.common.raster import GridSignature, grid_digest, grid_signature, iter_row_windows
+from eo_engine.common.verify import check_file_exists
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, ZonalStatistic
+
+logger: Logger = get_task_logger(__name__)
+
+ZoneSet = NamedTuple('ZoneSet', [
+    ('name', str),
+    ('shapefile', Path),
+    # attribute with the code of the zone, e.g. ISO3 or a GAUL code
+    ('id_field', str),
+    ('name_field', Optional[str])
+])
+
+Zone = NamedTuple('Zone', [
+    # value of the zone in the label raster. 0 is outside of every zone
+    ('label', int),
+    ('zone_id', str),
+    ('name', str)
+])
+
+# how to read the values of a product
+ValueSpec = NamedTuple('ValueSpec', [
+    ('nodata', Optional[float]),
+    ('scale_factor', float),
+    ('add_offset', float),
+    # (min, max) of the valid values, in physical units
+    ('valid_range', Optional[Tuple[float, float]])
+])
+
+
+def get_zone_set(name: str) -> ZoneSet:
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'ZONE_SETS', {})
+    if name not in configured:
+        raise AfriCultuReSError(f'Unknown zone set: {name}')
+    values = configured[name]
+    return ZoneSet(name=name, shapefile=Path(values['shapefile']),
+                   id_field=values['id_field'], name_field=values.get('name_field'))
+
+
+def zonal_config(group_name: str) -> Optional[Dict[str, Any]]:
+    """ The zonal statistics configuration of a product group (first matching pattern), or None """
+    configured: Dict[str, Dict[str, Any]] = getattr(settings, 'ZONAL_STATISTICS_GROUPS', {})
+    for pattern, values in configured.items():
+        if fnmatchcase(group_name, pattern):
+            return values
+    return None
+
+
+def read_zones(zone_set: ZoneSet) -> List[Zone]:
+    """ The zones of the zone set, labelled 1..n in the order of the features """
+    from osgeo import ogr
+
+    check_file_exists(zone_set.shapefile)
+    ds = ogr.Open(zone_set.shapefile.as_posix())
+    layer = ds.GetLayer()
+    zones = []
+    for label, feature in enumerate(layer, start=1):
+        zone_id = str(feature.GetField(zone_set.id_field))
+        name = str(feature.GetField(zone_set.name_field)) if zone_set.name_field else zone_id
+        zones.append(Zone(label=label, zone_id=zone_id, name=name))
+    ds = None
+    return zones
+
+
+def label_path(zone_set: ZoneSet, grid: GridSignature) -> Path:
+    fingerprint = shapefile_fingerprint(zone_set.shapefile)
+    return get_mask_cache_dir() / \
+        f'zones_{zone_set.shapefile.stem}_{zone_set.id_field}_{fingerprint}_{grid_digest(grid)}.tif'
+
+
+def get_zone_labels(zone_set: ZoneSet, grid: GridSignature) -> Path:
+    """ Returns the path of the (cached) label raster of zone_set on grid. Rasterizes it if it does not exist.
+    Every pixel whose centre is in a zone has the label of that zone (see read_zones), the rest 0. """
+    from osgeo import gdal, ogr
+
+    check_file_exists(zone_set.shapefile)
+    target = label_path(zone_set, grid)
+    if target.exists():
+        return target
+
+    logger.info(f'Rasterizing the zones of {zone_set.name} to {target.name}')
+    # the labels are burnt from an in-memory copy of the zones with an integer attribute
+    source = ogr.Open(zone_set.shapefile.as_posix())
+    source_layer = source.GetLayer()
+    zones_ds = gdal.GetDriverByName('Memory').Create('', 0, 0, 0, gdal.GDT_Unknown)
+    zones_layer = zones_ds.CreateLayer('zones', srs=source_layer.GetSpatialRef(), geom_type=ogr.wkbUnknown)
+    zones_layer.CreateField(ogr.FieldDefn('label', ogr.OFTInteger))
+    for label, feature in enumerate(source_layer, start=1):
+        zone = ogr.Feature(zones_layer.GetLayerDefn())
+        zone.SetField('label', label)
+        zone.SetGeometry(feature.GetGeometryRef().Clone())
+        zones_layer.CreateFeature(zone)
+
+    # write next to the target and rename, so concurrent workers never see a half-written raster
+    with NamedTemporaryFile(dir=target.parent, suffix='.tif', delete=False) as fh:
+        temp_path = Path(fh.name)
+    try:
+        ds = gdal.GetDriverByName('GTiff').Create(
+            temp_path.as_posix(), grid.width, grid.height, 1, gdal.GDT_Int32,
+            ['COMPRESS=DEFLATE', 'TILED=YES'])
+        ds.SetProjection(grid.crs)
+        ds.SetGeoTransform((grid.transform[2], grid.transform[0], grid.transform[1],
+                            grid.transform[5], grid.transform[3], grid.transform[4]))
+        result = gdal.Rasterize(ds, zones_ds, attribute='label')
+        ds = None
+        if result != 1:
+            raise AfriCultuReSError(f'Could not rasterize {zone_set.shapefile.as_posix()}')
+        os.replace(temp_path, target)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+        zones_ds = source = None
+    return target
+
+
+class ZonalAccumulator(object):
+    """ Running count, sum, sum of squares, min and max of the valid values of every zone of a zone set """
+
+    def __init__(self, zone_set: ZoneSet, grid: GridSignature, values: ValueSpec,
+                 window: Optional[Window] = None):
+        """
+        @param grid: the grid of the label raster. The blocks must be on it or on a window of it.
+        @param window: where the blocks are in grid, when they are a crop of it.
+        """
+        self.zone_set = zone_set
+        self.values = values
+        self.zones = read_zones(zone_set)
+        self.window = window or Window(0, 0, grid.width, grid.height)
+        self._labels = rasterio.open(get_zone_labels(zone_set, grid))
+        size = len(self.zones) + 1
+        self.pixels = np.zeros(size, dtype='i8')
+        self.count = np.zeros(size, dtype='i8')
+        self.sum = np.zeros(size, dtype='f8')
+        self.sum_sq = np.zeros(size, dtype='f8')
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+
+    def update(self, window: Window, block: np.ndarray):
+        """ Adds a block, window relative to self.window """
+        block = block.reshape(block.shape[-2:])
+        labels_window = Window(int(self.window.col_off) + int(window.col_off),
+                               int(self.window.row_off) + int(window.row_off),
+                               block.shape[1], block.shape[0])
+        labels = self._labels.read(1, window=labels_window).ravel()
+        raw = block.ravel()
+
+        valid = labels > 0
+        self.pixels += np.bincount(labels[valid], minlength=self.pixels.size)
+        if self.values.nodata is not None:
+            valid &= raw != self.values.nodata
+        data = raw.astype('f8') * self.values.scale_factor + self.values.add_offset
+        valid &= np.isfinite(data)
+        if self.values.valid_range is not None:
+            valid &= (data >= self.values.valid_range[0]) & (data <= self.values.valid_range[1])
+
+        labels, data = labels[valid], data[valid]
+        size = self.count.size
+        self.count += np.bincount(labels, minlength=size)
+        self.sum += np.bincount(labels, weights=data, minlength=size)
+        self.sum_sq += np.bincount(labels, weights=data * data, minlength=size)
+        np.minimum.at(self.min, labels, data)
+        np.maximum.at(self.max, labels, data)
+
+    def close(self):
+        self._labels.close()
+
+    def statistics(self, eo_product: EOProduct) -> List[ZonalStatistic]:
+        """ Unsaved ZonalStatistic rows, one per zone """
+        rows = []
+        for zone in self.zones:
+            count = int(self.count[zone.label])
+            mean = std = minimum = maximum = None
+            if count:
+                mean = float(self.sum[zone.label] / count)
+                std = float(np.sqrt(max(self.sum_sq[zone.label] / count - mean * mean, 0)))
+                minimum, maximum = float(self.min[zone.label]), float(self.max[zone.label])
+            rows.append(ZonalStatistic(
+                eo_product=eo_product, group_id=eo_product.group_id, reference_date=eo_product.reference_date,
+                zone_set=self.zone_set.name, zone_id=zone.zone_id, zone_name=zone.name,
+                pixel_count=int(self.pixels[zone.label]), valid_count=count,
+                mean=mean, std=std, min=minimum, max=maximum))
+        return rows
+
+
+def tap_blocks(blocks: Iterable[Tuple[Window, np.ndarray]],
+               accumulators: Sequence[ZonalAccumulator]) -> Iterator[Tuple[Window, np.ndarray]]:
+    """ Passes the blocks through, adding every block to the accumulators on the way """
+    for window, block in blocks:
+        for accumulator in accumulators:
+            accumulator.update(window, block)
+        yield window, block
+
+
+def value_spec(src, config: Dict[str, Any]) -> ValueSpec:
+    """ How to read the first band of an open rasterio dataset """
+    valid_range = config.get('valid_range')
+    return ValueSpec(
+        nodata=config.get('nodata', src.nodata),
+        scale_factor=src.scales[0], add_offset=src.offsets[0],
+        valid_range=tuple(valid_range) if valid_range is not None else None)
+
+
+def group_accumulators(group_name: str, grid: GridSignature, values: ValueSpec,
+                       window: Optional[Window] = None) -> List[ZonalAccumulator]:
+    """ The accumulators of the zone sets configured for the group. Empty if there are none. """
+    config = zonal_config(group_name)
+    if config is None:
+        return []
+    return [ZonalAccumulator(get_zone_set(name), grid, values, window) for name in config['zone_sets']]
+
+
+def store_zonal_statistics(eo_product: EOProduct, accumulators: Sequence[ZonalAccumulator]) -> int:
+    """ Replaces the statistics of eo_product with the ones of the accumulators """
+    rows: List[ZonalStatistic] = []
+    for accumulator in accumulators:
+        rows.extend(accumulator.statistics(eo_product))
+        accumulator.close()
+    with transaction.atomic():
+        ZonalStatistic.objects.filter(
+            eo_product=eo_product, zone_set__in=[a.zone_set.name for a in accumulators]).delete()
+        ZonalStatistic.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def compute_zonal_statistics(eo_product: EOProduct, rows: int = 1024) -> int:
+    """ Reads the product once and stores the statistics of all the zone sets of its group """
+    config = zonal_config(eo_product.group.name)
+    if config is None:
+        return 0
+    path = Path(eo_product.file.path)
+    if config.get('variable'):
+        path_token = f'NETCDF:"{path.as_posix()}":{config["variable"]}'
+    else:
+        path_token = path.as_posix()
+
+    with rasterio.open(path_token) as src:
+        accumulators = group_accumulators(eo_product.group.name, grid_signature(src), value_spec(src, config))
+        for window in iter_row_windows(src.width, src.height, rows=rows):
+            block = src.read(1, window=window)
+            for accumulator in accumulators:
+                accumulator.update(window, block)
+    return store_zonal_statistics(eo_product, accumulators)
+
+
+def zonal_statistics_are_current(eo_product: EOProduct) -> bool:
+    """ True if the statistics of eo_product were computed after its file was written """
+    latest = ZonalStatistic.objects.filter(eo_product=eo_product).order_by('-timestamp').first()
+    if latest is None or not eo_product.file:
+        return False
+    return latest.timestamp.timestamp() >= os.path.getmtime(eo_product.file.path)
+
+
+def zone_time_series(group_name: str, zone_set: str, zone_id: str,
+                     date_from: Optional[datetime.date] = None,
+                     date_to: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+    """ The statistics of a zone, oldest first. Served by the (group, zone_set, zone_id, reference_date) index """
+    qs = ZonalStatistic.objects.filter(group__name=group_name, zone_set=zone_set, zone_id=zone_id)
+    if date_from is not None:
+        qs = qs.filter(reference_date__gte=date_from)
+    if date_to is not None:
+        qs = qs.filter(reference_date__lte=date_to)
+    return list(qs.order_by('reference_date').values(
+        'reference_date', 'mean', 'std', 'min', 'max', 'valid_count', 'pixel_count'))
+
+
+__all__ = [
+    'ZoneSet',
+    'Zone',
+    'ValueSpec',
+    'get_zone_set',
+    'zonal_config',
+    'read_zones',
+    'get_zone_labels',
+    'ZonalAccumulator',
+    'tap_blocks',
+    'value_spec',
+    'group_accumulators',
+    'store_zonal_statistics',
+    'compute_zonal_statistics',
+    'zonal_statistics_are_current',
+    'zone_time_series'
+]
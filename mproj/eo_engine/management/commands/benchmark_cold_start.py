@@ -0,0 +1,84 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from eo_engine.common.task_registry import default_queue, queue_modules
+
+# what a worker start-up should not pay for unless its tasks need it
+HEAVY_PACKAGES = ['snappy', 'jpy', 'osgeo', 'rasterio', 'netCDF4', 'numpy', 'pandas', 'pymodis', 'scrapy',
+                  'sentinelsat', 'h5py', 'paramiko']
+
+# the start-up of a worker of the queues in argv: django, then the task modules of the queues
+WORKER_START = """
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from eo_engine.common.task_registry import import_queue_tasks
+import_queue_tasks(sys.argv[1:])
+print(time.perf_counter() - start)
+"""
+
+RE_IMPORT_TIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def _cold_start(queue: str) -> Tuple[float, float, str]:
+    """ (start-up seconds, interpreter wall seconds, -X importtime report) of a new interpreter """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', WORKER_START, queue],
+                            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise CommandError(f'The start-up of a {queue} worker failed:\n{result.stderr[-2000:]}')
+    return float(result.stdout.strip().splitlines()[-1]), wall, result.stderr
+
+
+def _self_time_by_package(report: str) -> Dict[str, int]:
+    """ Self import time (us) of the modules of the report, summed per top level package """
+    totals: Dict[str, int] = defaultdict(int)
+    for line in report.splitlines():
+        match = RE_IMPORT_TIME.match(line)
+        if match:
+            totals[match.group(4).split('.')[0]] += int(match.group(1))
+    return totals
+
+
+class Command(BaseCommand):
+    """ Measures the cold start of a worker per queue: a new interpreter sets up django and imports the task
+    modules of the queue, like a worker does before its pool starts (eo_engine.common.task_registry).
+    Audits the imports of every start-up: the slowest packages and the heavy packages it loaded. """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', nargs='*',
+                            help='Queues to benchmark. All the queues of settings.CELERY_ROUTES if not set')
+        parser.add_argument('--repeats', type=int, default=3)
+        parser.add_argument('--top', type=int, default=10, help='Number of packages in the import audit')
+
+    def handle(self, *args, **options):
+        queues: List[str] = options['queues'] or sorted(
+            {route['queue'] if isinstance(route, dict) else route for route in settings.CELERY_ROUTES.values()} |
+            {default_queue()})
+
+        self.stdout.write(f'{"queue":<12} {"start-up s":>11} {"process s":>10}  task modules')
+        reports: Dict[str, str] = {}
+        for queue in queues:
+            runs = [_cold_start(queue) for _ in range(options['repeats'])]
+            reports[queue] = runs[-1][2]
+            modules = ', '.join(m.rsplit('.', 1)[-1] for m in queue_modules([queue])) or '-'
+            self.stdout.write(f'{queue:<12} {statistics.median(r[0] for r in runs):>11.2f} '
+                              f'{statistics.median(r[1] for r in runs):>10.2f}  {modules}')
+
+        for queue, report in reports.items():
+            totals = _self_time_by_package(report)
+            heavy = [p for p in HEAVY_PACKAGES if p in totals]
+            self.stdout.write(f'\n{queue}: heavy packages imported: {", ".join(heavy) or "none"}')
+            for package, micros in sorted(totals.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'  {package:<32} {micros / 1000:>9.1f} ms')
@@ -0,0 +1,92 @@
+import statistics
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+
+import netCDF4
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from rasterio.transform import from_origin
+
+from eo_engine.common.layout import LayoutProfile, apply_layout, layout_profiles
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+
+
+def _slices(source: str, steps: int, rows: int, cols: int, seed: int) -> List[np.ndarray]:
+    """ The 2D slices of the benchmark: random noise around the data of source if given, noise otherwise """
+    rng = np.random.default_rng(seed)
+    if source:
+        import rasterio
+        with rasterio.open(source) as src:
+            base = src.read(1, window=((0, min(rows, src.height)), (0, min(cols, src.width)))).astype('int16')
+    else:
+        base = rng.integers(0, 250, size=(rows, cols), dtype='int16')
+    return [np.clip(base + rng.integers(-5, 6, size=base.shape), 0, 250).astype('uint8') for _ in range(steps)]
+
+
+def _timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+class Command(BaseCommand):
+    """ Measures the read latency of the product layout profiles (settings.PRODUCT_LAYOUT_PROFILES).
+    For every profile a time series of 2D products is written, then spatial windows (one file) and
+    pixel time series (all the files) are read from it. """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='*', help='Profile keys to benchmark. All if not set')
+        parser.add_argument('--steps', type=int, default=36, help='Number of products in the time series')
+        parser.add_argument('--rows', type=int, default=2048)
+        parser.add_argument('--cols', type=int, default=2048)
+        parser.add_argument('--window', type=int, default=256, help='Size of the spatial windows')
+        parser.add_argument('--repeats', type=int, default=20)
+        parser.add_argument('--source', help='A raster whose first band is used as the data of the products')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        profiles: Dict[str, LayoutProfile] = layout_profiles()
+        if options['profiles']:
+            unknown = set(options['profiles']) - set(profiles)
+            if unknown:
+                raise CommandError(f'Unknown profiles: {", ".join(sorted(unknown))}')
+            profiles = {k: v for k, v in profiles.items() if k in options['profiles']}
+
+        rows, cols, window = options['rows'], options['cols'], options['window']
+        slices = _slices(options['source'], options['steps'], rows, cols, options['seed'])
+        rows, cols = slices[0].shape
+        window = min(window, rows, cols)
+        rng = np.random.default_rng(options['seed'])
+        spec = VariableSpec(name='NDVI', dtype='uint8', fill_value=255)
+
+        self.stdout.write(f'{"profile":<32} {"chunks":>11} {"codec":>8} {"size MB":>9} '
+                          f'{"window ms":>10} {"series ms":>10}')
+        for key, profile in profiles.items():
+            with TemporaryDirectory(prefix='benchmark_layouts_') as temp_dir:
+                files: List[Path] = []
+                for idx, data in enumerate(slices):
+                    files.append(write_netcdf_product(
+                        Path(temp_dir) / f'{idx:03d}.nc', data, apply_layout(spec, profile),
+                        transform=from_origin(0, rows, 1, 1), bottom_up=False))
+                size_mb = sum(f.stat().st_size for f in files) / 1024 ** 2
+
+                def read_window():
+                    row, col = rng.integers(0, rows - window + 1), rng.integers(0, cols - window + 1)
+                    with netCDF4.Dataset(files[rng.integers(0, len(files))]) as ds:
+                        ds.variables['NDVI'][row:row + window, col:col + window]
+
+                def read_series():
+                    row, col = rng.integers(0, rows), rng.integers(0, cols)
+                    for f in files:
+                        with netCDF4.Dataset(f) as ds:
+                            ds.variables['NDVI'][row, col]
+
+                window_ms = statistics.median(_timed(read_window) for _ in range(options['repeats']))
+                series_ms = statistics.median(_timed(read_series) for _ in range(options['repeats']))
+
+            chunks = 'x'.join(str(c) for c in profile.chunksizes)
+            codec = f'{profile.compression}:{profile.complevel}'
+            self.stdout.write(f'{key:<32} {chunks:>11} {codec:>8} {size_mb:>9.1f} '
+                              f'{window_ms:>10.2f} {series_ms:>10.2f}')
@@ -0,0 +1,110 @@
+import datetime
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from eo_engine.common.task_history import PURGEABLE_STATUSES, latest_tasks
+from eo_engine.models import EOProduct, GeopTask
+
+# the indexes of eo_engine.migrations.0007_geoptask_indexes
+INDEXES = ['geoptask_status_submitted_idx', 'geoptask_eo_product_latest_idx']
+
+_INSERT_TASKS_SQL = """
+INSERT INTO eo_engine_geoptask (task_id, task_name, task_args, status, datetime_submitted, time_to_complete,
+                                retries, task_kwargs)
+SELECT md5(random()::text || i::text)::uuid, 'eo_engine.tasks.benchmark', '[]',
+       CASE WHEN i %% 97 = 0 THEN 'SUBMITTED' WHEN i %% 101 = 0 THEN 'STARTED' WHEN i %% 50 = 0 THEN 'FAILURE'
+            ELSE 'SUCCESS' END,
+       now() - make_interval(secs => (%(rows)s - i) * %(span)s), '', 0, '{}'
+FROM generate_series(1, %(rows)s) AS i
+"""
+
+_INSERT_LINKS_SQL = """
+INSERT INTO eo_engine_geoptask_eo_product (geoptask_id, eoproduct_id)
+SELECT id, (%(products)s::int[])[1 + id %% %(n_products)s] FROM eo_engine_geoptask WHERE id > %(after)s
+"""
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """ Measures the latency of the task history queries (eo_engine.common.task_history) on a large GeopTask table,
+    with and without the indexes of the dashboards. The rows are generated in a transaction that is rolled back:
+    the database is left as it was. The generated tasks are linked to the existing EOProducts.
+    The indexes are dropped in that transaction, which locks the GeopTask table until the end: the task tracking and
+    the task views wait. Run it on a scratch copy of the database only (--scratch-db). """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000, help='Number of tasks to generate')
+        parser.add_argument('--days', type=int, default=730, help='The tasks are submitted over that many days')
+        parser.add_argument('--products', type=int, default=100, help='EOProducts per latest task query')
+        parser.add_argument('--repeats', type=int, default=20)
+        parser.add_argument('--scratch-db', action='store_true',
+                            help='Confirms that the database is a scratch copy: the GeopTask table is locked')
+
+    def handle(self, *args, **options):
+        if not options['scratch_db']:
+            raise CommandError('The benchmark locks the GeopTask table until it ends. '
+                               'Run it on a scratch copy of the database, with --scratch-db')
+        products: List[int] = list(EOProduct.objects.order_by('pk').values_list('pk', flat=True))
+        if not products:
+            raise CommandError('The generated tasks are linked to EOProducts, there are none')
+        rows = options['rows']
+
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    # checked row by row: deferred checks of millions of rows wait in memory until the end
+                    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+                    after = GeopTask.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+                    start = time.perf_counter()
+                    cursor.execute(_INSERT_TASKS_SQL, {'rows': rows, 'span': options['days'] * 86400 / rows})
+                    cursor.execute(_INSERT_LINKS_SQL, {'products': products, 'n_products': len(products),
+                                                       'after': after})
+                    cursor.execute('ANALYZE eo_engine_geoptask, eo_engine_geoptask_eo_product')
+                    self.stdout.write(f'Generated {rows} tasks in {time.perf_counter() - start:.1f} s')
+
+                    self.report('indexed', self.measure(products, options))
+                    cursor.execute(f'DROP INDEX {", ".join(INDEXES)}')
+                    self.report('not indexed', self.measure(products, options))
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def measure(self, products: List[int], options) -> Dict[str, List[float]]:
+        sample = products[:options['products']]
+        # half of the tasks are past the retention
+        before = timezone.now() - datetime.timedelta(days=options['days'] / 2)
+
+        queries: Dict[str, Callable[[], object]] = {
+            'latest 50 tasks': lambda: list(GeopTask.objects.order_by('-datetime_submitted')[:50]),
+            'latest 50 FAILURE': lambda: list(GeopTask.objects.filter(
+                status=GeopTask.TaskTypeChoices.FAILURE).order_by('-datetime_submitted')[:50]),
+            'latest 50 STARTED': lambda: list(GeopTask.objects.filter(
+                status=GeopTask.TaskTypeChoices.STARTED).order_by('-datetime_submitted')[:50]),
+            f'latest task of {len(sample)} products': lambda: latest_tasks(sample),
+            'purge batch (5000)': lambda: list(GeopTask.objects.filter(
+                status__in=PURGEABLE_STATUSES, datetime_submitted__lt=before)
+                .order_by('pk').values_list('pk', flat=True)[:5000]),
+        }
+        timings: Dict[str, List[float]] = {}
+        for name, query in queries.items():
+            query()  # warm up the cache
+            timings[name] = []
+            for _ in range(options['repeats']):
+                start = time.perf_counter()
+                query()
+                timings[name].append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def report(self, title: str, timings: Dict[str, List[float]]):
+        self.stdout.write(f'\n{title}')
+        self.stdout.write(f'  {"query":<36} {"median ms":>10} {"max ms":>10}')
+        for name, values in timings.items():
+            self.stdout.write(f'  {name:<36} {statistics.median(values):>10.2f} {max(values):>10.2f}')
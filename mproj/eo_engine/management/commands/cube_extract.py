@@ -0,0 +1,84 @@
+import datetime
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from eo_engine.common.cube import append_product, cube_config, cube_lock_key, cube_path, extract_point, \
+    extract_window
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, EOProductStateChoices
+
+
+class Command(BaseCommand):
+    """ Time series of a point or a bbox from the cube store of a product group (see eo_engine.common.cube).
+    Point series are printed as csv; bbox series are printed as the per-date mean, or written to --output. """
+
+    def add_arguments(self, parser):
+        parser.add_argument('group', help='Product group name')
+        where = parser.add_mutually_exclusive_group()
+        where.add_argument('--point', nargs=2, type=float, metavar=('X', 'Y'))
+        where.add_argument('--bbox', nargs=4, type=float, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'))
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat)
+        parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat)
+        parser.add_argument('--output', type=Path, help='netCDF file for the values of a bbox')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Make the cube again from all the READY products of the group')
+
+    def handle(self, *args, **options):
+        group = options['group']
+        if cube_config(group) is None:
+            raise CommandError(f'The group {group} has no cube store (settings.CUBE_STORE_GROUPS)')
+
+        try:
+            if options['rebuild']:
+                self._rebuild(group)
+            if options['point']:
+                x, y = options['point']
+                self.stdout.write('date,value')
+                for date, value in extract_point(group, x, y, options['date_from'], options['date_to']):
+                    self.stdout.write(f'{date.isoformat()},{"" if value is None else value}')
+            elif options['bbox']:
+                series = extract_window(group, tuple(options['bbox']), options['date_from'], options['date_to'])
+                if options['output']:
+                    self._write(options['output'], series)
+                    self.stdout.write(f'Wrote {len(series.dates)} dates to {options["output"]}')
+                else:
+                    self.stdout.write('date,mean,valid_pixels')
+                    for date, values in zip(series.dates, series.values):
+                        valid = int(np.count_nonzero(~np.isnan(values)))
+                        mean = float(np.nanmean(values)) if valid else ''
+                        self.stdout.write(f'{date.isoformat()},{mean},{valid}')
+            elif not options['rebuild']:
+                raise CommandError('One of --point, --bbox or --rebuild is required')
+        except AfriCultuReSError as e:
+            raise CommandError(str(e))
+
+    def _rebuild(self, group: str):
+        path = cube_path(group)
+        qs = EOProduct.objects.filter(group__name=group, state=EOProductStateChoices.READY).order_by('reference_date')
+        # task_cube_append waits until the cube is made again
+        with advisory_lock(cube_lock_key(group)):
+            if path.exists():
+                path.unlink()
+            for eo_product in qs:
+                append_product(eo_product)
+        self.stdout.write(f'Appended {qs.count()} products to {path}')
+
+    @staticmethod
+    def _write(file_out: Path, series):
+        import netCDF4
+
+        with netCDF4.Dataset(file_out, 'w', format='NETCDF4') as dst:
+            dst.createDimension('time', len(series.dates))
+            dst.createDimension('y', series.values.shape[1])
+            dst.createDimension('x', series.values.shape[2])
+            time_var = dst.createVariable('time', 'f8', ('time',))
+            time_var.units = 'days since 1970-01-01'
+            time_var[:] = [(d - datetime.date(1970, 1, 1)).days for d in series.dates]
+            dst.createVariable('y', 'f8', ('y',))[:] = \
+                series.transform.f + series.transform.e * (np.arange(series.values.shape[1]) + 0.5)
+            dst.createVariable('x', 'f8', ('x',))[:] = \
+                series.transform.c + series.transform.a * (np.arange(series.values.shape[2]) + 0.5)
+            dst.createVariable('values', 'f4', ('time', 'y', 'x'), fill_value=np.nan, zlib=True)[:] = series.values
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.9 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreFloodEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aoi', models.CharField(max_length=16)),
+                ('year', models.IntegerField()),
+                ('date', models.DateField(help_text='reference date of the pre-event raster')),
+                ('path', models.TextField(unique=True)),
+                ('grid_signature', models.CharField(help_text='digest of the crs/transform/shape of the raster', max_length=32)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('eo_product', models.ForeignKey(blank=True, help_text='product the pre-event raster was made from', null=True, on_delete=django.db.models.deletion.SET_NULL, to='eo_engine.eoproduct')),
+            ],
+            options={
+                'ordering': ['aoi', 'date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prefloodevent',
+            index=models.Index(fields=['aoi', 'year', 'date'], name='pre_flood_event_lookup'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.9 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0002_prefloodevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrbitThreshold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aoi', models.CharField(max_length=16)),
+                ('relative_orbit', models.IntegerField()),
+                ('date', models.DateField()),
+                ('threshold', models.FloatField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['aoi', 'relative_orbit', 'date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orbitthreshold',
+            constraint=models.UniqueConstraint(fields=('aoi', 'relative_orbit', 'date'), name='unique aoi/orbit/date'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.9 on 2026-10-19 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0003_orbitthreshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZonalStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_date', models.DateField()),
+                ('zone_set', models.CharField(max_length=64)),
+                ('zone_id', models.CharField(max_length=64)),
+                ('zone_name', models.TextField(default='')),
+                ('pixel_count', models.IntegerField(help_text='pixels of the zone')),
+                ('valid_count', models.IntegerField(help_text='pixels of the zone with a valid value')),
+                ('mean', models.FloatField(null=True)),
+                ('std', models.FloatField(null=True)),
+                ('min', models.FloatField(null=True)),
+                ('max', models.FloatField(null=True)),
+                ('timestamp', models.DateTimeField(auto_now=True)),
+                ('eo_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zonal_statistics', to='eo_engine.eoproduct')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='eo_engine.eogroup')),
+            ],
+            options={
+                'ordering': ['group', 'zone_set', 'zone_id', 'reference_date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='zonalstatistic',
+            index=models.Index(fields=['group', 'zone_set', 'zone_id', 'reference_date'], name='zonal_statistic_series'),
+        ),
+        migrations.AddConstraint(
+            model_name='zonalstatistic',
+            constraint=models.UniqueConstraint(fields=('eo_product', 'zone_set', 'zone_id'), name='unique product/zone'),
+        ),
+    ]
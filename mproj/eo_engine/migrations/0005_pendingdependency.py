@@ -0,0 +1,31 @@
+# Generated by Django 3.2.9 on 2026-10-19 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0004_zonalstatistic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingDependency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_date', models.DateField()),
+                ('enqueued_at', models.DateTimeField()),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='eo_engine.eogroup')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pendingdependency',
+            index=models.Index(fields=['enqueued_at'], name='pending_dependency_enqueued'),
+        ),
+        migrations.AddConstraint(
+            model_name='pendingdependency',
+            constraint=models.UniqueConstraint(fields=('group', 'reference_date'), name='unique pending group/date'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.9 on 2026-10-19 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# input files per reference date of the groups that are not one file per date (tiles)
+GROUP_EXPECTED_INPUTS = {
+    'S02P02_NDVIA_250M_ZAF_GMOD': 5,
+    'S02P02_NDVIA_250M_MOZ_GMOD': 4,
+    'S02P02_NDVIA_250M_TUN_GMOD': 4,
+    'S02P02_NDVIA_250M_KEN_GMOD': 4,
+    'S02P02_NDVIA_250M_GHA_GMOD': 4,
+    'S02P02_NDVIA_250M_RWA_GMOD': 1,
+    'S02P02_NDVIA_250M_ETH_GMOD': 5,
+    'S02P02_NDVIA_250M_NER_GMOD': 7,
+    'S04P03_FLD_375M_1D_VIIRS': 25
+}
+
+
+def set_expected_inputs(apps, schema_editor):
+    Pipeline = apps.get_model('eo_engine', 'Pipeline')
+    EOSourceGroup = apps.get_model('eo_engine', 'EOSourceGroup')
+    for pipeline in Pipeline.objects.all():
+        names = list(EOSourceGroup.objects.filter(eogroup_ptr__in=pipeline.input_groups.all())
+                     .values_list('name', flat=True))
+        if any(name in GROUP_EXPECTED_INPUTS for name in names):
+            pipeline.expected_inputs = sum(GROUP_EXPECTED_INPUTS.get(name, 1) for name in names)
+            pipeline.save(update_fields=['expected_inputs'])
+
+
+# the counters of the existing sources (same as eo_engine.common.readiness.recount_readiness): pipelines without
+# expected_inputs expect all the discovered sources of a date
+COUNT_READINESS = """
+INSERT INTO eo_engine_pipelinereadiness (pipeline_id, reference_date, expected, available, updated_at)
+SELECT p.id, s.reference_date, COALESCE(p.expected_inputs, COUNT(DISTINCT s.id)),
+       COUNT(DISTINCT s.id) FILTER (WHERE s.state = 'AVAILABLE_LOCALLY'), NOW()
+FROM eo_engine_pipeline p
+JOIN eo_engine_pipeline_input_groups pi ON pi.pipeline_id = p.id
+JOIN eo_engine_eosource_group sg ON sg.eosourcegroup_id = pi.eogroup_id
+JOIN eo_engine_eosource s ON s.id = sg.eosource_id
+GROUP BY p.id, p.expected_inputs, s.reference_date
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0005_pendingdependency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipeline',
+            name='expected_inputs',
+            field=models.PositiveIntegerField(blank=True, help_text='Input files per reference date. Empty: all the discovered files of the date', null=True),
+        ),
+        migrations.CreateModel(
+            name='PipelineReadiness',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_date', models.DateField()),
+                ('expected', models.PositiveIntegerField()),
+                ('available', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField()),
+                ('pipeline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readiness', to='eo_engine.pipeline')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pipelinereadiness',
+            constraint=models.UniqueConstraint(fields=('pipeline', 'reference_date'), name='unique pipeline/date readiness'),
+        ),
+        migrations.RunPython(set_expected_inputs, migrations.RunPython.noop),
+        migrations.RunSQL(COUNT_READINESS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.9 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+# the latest task of an EOProduct/EOSource: the auto-created M2M tables only have an index on each column
+THROUGH_INDEXES = [
+    ('eo_engine_geoptask_eo_product', 'geoptask_eo_product_latest_idx', 'eoproduct_id'),
+    ('eo_engine_geoptask_eo_source', 'geoptask_eo_source_latest_idx', 'eosource_id'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eo_engine', '0006_pipelinereadiness'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='geoptask',
+            name='status',
+            field=models.TextField(choices=[('SUBMITTED', 'Submitted'), ('STARTED', 'Started'),
+                                            ('SUCCESS', 'Success'), ('FAILURE', 'Failure'),
+                                            ('REVOKED', 'Revoked'), ('RETRY', 'Retry'), ('UNKNOWN', 'Unknown')],
+                                   default='SUBMITTED'),
+        ),
+        migrations.AddIndex(
+            model_name='geoptask',
+            index=models.Index(fields=['status', '-datetime_submitted'], name='geoptask_status_submitted_idx'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column}, geoptask_id DESC);',
+            reverse_sql=f'DROP INDEX IF EXISTS {name};'
+        )
+        for table, name, column in THROUGH_INDEXES
+    ]
@@ -3,9 +3,25 @@ from .eo_group import EOProductGroupChoices, EOProductGroup, EOSourceGroup, EOSo
 from .eo_product import EOProductStateChoices, EOProduct
 from .eo_source import EOSourceStateChoices, EOSource
 from .other import Credentials, CrawlerConfiguration, Pipeline, Upload
+from .aux_files import PreFloodEvent, OrbitThreshold
+from .statistics import ZonalStatistic
+from .dependencies import PendingDependency, PipelineReadiness
+from .transitions import (
+    StateTransition,
+    eo_source_transition,
+    eo_product_transition,
+    transition_eo_source,
+    transition_eo_product
+)
 from .signals import (
     eosource_post_save_handler,
-    eoproduct_post_save_handler
+    eosource_pre_delete_handler,
+    eosource_transition_handler,
+    eoproduct_post_save_handler,
+    eoproduct_ndvi_lts_handler,
+    eoproduct_zonal_statistics_handler,
+    eoproduct_cube_store_handler,
+    eoproduct_transition_handler
 )
 
 __all__ = [
@@ -22,6 +38,14 @@ __all__ = [
     'EOGroup',
     'EOProductGroup',
     'EOSourceGroup',
+    'OrbitThreshold',
+    'PendingDependency',
     'Pipeline',
-    'Upload'
+    'PipelineReadiness',
+    'PreFloodEvent',
+    'StateTransition',
+    'Upload',
+    'ZonalStatistic',
+    'transition_eo_product',
+    'transition_eo_source'
 ]
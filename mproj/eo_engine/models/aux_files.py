@@ -0,0 +1,47 @@
+from django.db import models
+
+
+class PreFloodEvent(models.Model):
+    """ Index of the coregistered pre-flood-event rasters (AUX_FILES_ROOT/WB_bag/Archive) """
+    aoi = models.CharField(max_length=16)
+    year = models.IntegerField()
+    date = models.DateField(help_text='reference date of the pre-event raster')
+    path = models.TextField(unique=True)
+    grid_signature = models.CharField(max_length=32, help_text='digest of the crs/transform/shape of the raster')
+    eo_product = models.ForeignKey('EOProduct', null=True, blank=True, on_delete=models.SET_NULL,
+                                   help_text='product the pre-event raster was made from')
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['aoi', 'date']
+        indexes = [
+            models.Index(fields=['aoi', 'year', 'date'], name='pre_flood_event_lookup')
+        ]
+
+    def __str__(self):
+        return f'{self.aoi}/{self.date}'
+
+
+class OrbitThreshold(models.Model):
+    """ Water thresholds of the Sentinel-1 scenes, per AOI and relative orbit.
+    Used when no threshold can be found in a scene (see tasks.s06p01). """
+    aoi = models.CharField(max_length=16)
+    relative_orbit = models.IntegerField()
+    date = models.DateField()
+    threshold = models.FloatField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['aoi', 'relative_orbit', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['aoi', 'relative_orbit', 'date'], name='unique aoi/orbit/date')
+        ]
+
+    def __str__(self):
+        return f'{self.aoi}/{self.relative_orbit}/{self.date}: {self.threshold}'
+
+
+__all__ = [
+    'PreFloodEvent',
+    'OrbitThreshold'
+]
@@ -38,7 +38,8 @@ class GeopTask(models.Model):
     task_args = models.TextField(default='[]')
     parent_id = models.UUIDField(editable=False, db_index=True, null=True)
 
-    status = models.TextField(choices=TaskTypeChoices.choices, default=TaskTypeChoices.SUBMITTED, db_index=True)
+    # indexed by geoptask_status_submitted_idx
+    status = models.TextField(choices=TaskTypeChoices.choices, default=TaskTypeChoices.SUBMITTED)
 
     datetime_submitted = models.DateTimeField(auto_now_add=True, db_index=True)
     datetime_started = models.DateTimeField(null=True, blank=True)
@@ -60,7 +61,9 @@ class GeopTask(models.Model):
         get_latest_by = ["datetime_submitted", ]
         ordering = ["datetime_submitted", ]
         indexes = [
-            GinIndex(fields=['task_kwargs'])
+            GinIndex(fields=['task_kwargs']),
+            # the latest tasks of a status, the tasks to purge (eo_engine.common.task_history)
+            models.Index(fields=['status', '-datetime_submitted'], name='geoptask_status_submitted_idx')
         ]
 
 
@@ -0,0 +1,49 @@
+from django.db import models
+
+
+class PendingDependency(models.Model):
+    """ An input (group, reference_date) whose dependent products must be resolved again. Written by the
+    EOSource post-save signal, consumed by the dependency resolver (eo_engine.common.dependencies). """
+    group = models.ForeignKey('EOGroup', on_delete=models.CASCADE)
+    reference_date = models.DateField()
+    # last change of the key, the resolver waits for the key to be quiet (debounce)
+    enqueued_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'reference_date'], name='unique pending group/date')
+        ]
+        indexes = [
+            models.Index(fields=['enqueued_at'], name='pending_dependency_enqueued')
+        ]
+
+    def __str__(self):
+        return f'{self.group_id}/{self.reference_date}'
+
+
+class PipelineReadiness(models.Model):
+    """ Inputs of a pipeline for a reference date: expected (Pipeline.expected_inputs) and AVAILABLE_LOCALLY.
+    Incremented/decremented on the state transitions of the EOSources, see eo_engine.common.readiness. """
+    pipeline = models.ForeignKey('Pipeline', on_delete=models.CASCADE, related_name='readiness')
+    reference_date = models.DateField()
+    expected = models.PositiveIntegerField()
+    available = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pipeline', 'reference_date'], name='unique pipeline/date readiness')
+        ]
+
+    @property
+    def ready(self) -> bool:
+        return self.available >= self.expected
+
+    def __str__(self):
+        return f'{self.pipeline_id}/{self.reference_date}: {self.available}/{self.expected}'
+
+
+__all__ = [
+    'PendingDependency',
+    'PipelineReadiness'
+]
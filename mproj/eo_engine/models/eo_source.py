@@ -105,6 +105,13 @@ class EOSource(models.Model):
     def __str__(self):
         return f"{self.__class__.__name__}/{self.filename}/{self.state}/{self.id}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the state in the database, so the post-save signal can tell a state transition from a re-save
+        instance._db_state = dict(zip(field_names, values)).get('state')
+        return instance
+
     @property
     def local_path(self) -> Path:
         return Path(self.file.path)
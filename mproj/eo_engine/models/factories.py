@@ -1,16 +1,23 @@
+import datetime
 import re
-from typing import Optional
+from typing import Dict, Iterable, Optional
 
+from django.db import transaction
 from django.utils.timezone import now
 
 from eo_engine.common.contrib.waporv2 import (variables, well_known_bboxes,
                                               default_bbox, WAPORRemoteJob,
                                               WAPORRemoteVariable)
-from eo_engine.common.time import runningdekad2date
+from eo_engine.common.db_ops import IngestionReport, bulk_add_eo_sources
+from eo_engine.common.time import running_dekads, runningdekad2date
 from eo_engine.errors import AfriCultuReSMisconfiguration
 from eo_engine.models import Credentials, EOSourceGroup
 from eo_engine.models.eo_source import EOSource, EOSourceGroupChoices, EOSourceStateChoices
 
+WAPOR_GROUP_PATTERN = re.compile(
+    r'S06P04_WAPOR_(?P<LEVEL>(L1|L2))_(?P<PROD>(AETI|QUAL_LST|QUAL_NDVI))_D_(?P<LOCATION>(AFRICA|\w{3}|))',
+    re.IGNORECASE)
+
 
 def wapor_from_filename(string, uuid: Optional[str] = None) -> WAPORRemoteVariable:
     m = re.compile(r'(?P<var_name>L[123]_[A-Z]+(_([A-Z]+))?_[DAME])_(?P<time_element>[0-9]+)(_(?P<area>[A-Z]+))?')
@@ -69,3 +76,45 @@ def create_or_get_wapor_object_from_filename(filename: str) -> (EOSource, bool):
         obj.group.add(group)
 
     return obj, created
+
+
+def wapor_filename_template(group_name: str) -> str:
+    """ The filename of the entries of a (dekadal) WAPOR group, with a {YYKK} placeholder """
+    match = WAPOR_GROUP_PATTERN.match(group_name)
+    if match is None:
+        raise AfriCultuReSMisconfiguration(f'{group_name} is not a WAPOR group')
+    level, product, location = match['LEVEL'], match['PROD'], match['LOCATION']
+    if location:
+        return f'{level}_{product}_D_{{YYKK}}_{location}.tif'
+    # if location is missing, it's AFRICA
+    return f'{level}_{product}_D_{{YYKK}}.tif'
+
+
+def bulk_create_wapor_entries(group_names: Iterable[str], from_date: datetime.date,
+                              to_date: datetime.date) -> Dict[str, IngestionReport]:
+    """ Creates the missing EOSources of every dekad from from_date to to_date of the WAPOR groups, in one
+    transaction. Each dekad is enumerated once, the groups and the credentials are read once. """
+    group_names = list(group_names)
+    groups = {group.name: group for group in EOSourceGroup.objects.filter(name__in=group_names)}
+    unknown = set(group_names) - set(groups)
+    if unknown:
+        raise AfriCultuReSMisconfiguration(f'Unknown groups: {", ".join(sorted(unknown))}')
+    templates = {name: wapor_filename_template(name) for name in group_names}
+    # last two digits of the year + running dekad, start of the dekad
+    dekads = [(f'{str(year)[2:]}{rdekad:02}', runningdekad2date(year, rdekad)[0])
+              for year, rdekad in running_dekads(from_date, to_date)]
+    credentials = Credentials.objects.filter(domain='WAPOR').first()
+    seen = now()
+
+    with transaction.atomic():
+        return {name: bulk_add_eo_sources([
+            EOSource(
+                filename=templates[name].format(YYKK=YYKK),
+                state=EOSourceStateChoices.AVAILABLE_REMOTELY,
+                domain='wapor',
+                datetime_seen=seen,
+                filesize_reported=0,
+                reference_date=reference_date,
+                url='wapor://',
+                credentials=credentials
+            ) for YYKK, reference_date in dekads], groups[name]) for name in group_names}
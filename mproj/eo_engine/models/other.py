@@ -57,6 +57,9 @@ class Pipeline(RuleMixin):
     output_folder = models.TextField()
     task_name = models.TextField()
     task_kwargs = models.JSONField(default=dict)
+    # readiness (eo_engine.common.readiness): input files a reference date needs, e.g. the tiles of a mosaic
+    expected_inputs = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Input files per reference date. Empty: all the discovered files of the date')
 
     @property
     def service(self) -> str:
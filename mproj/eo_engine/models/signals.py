@@ -1,4 +1,6 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
 from eo_engine.models import (
@@ -9,63 +11,90 @@ from eo_engine.models import (
     Pipeline
 )
 from eo_engine.models.eo_product import should_create
+from eo_engine.models.transitions import StateTransition, eo_product_transition, eo_source_transition
 
 
 @receiver(post_save, sender=EOSource, weak=False, dispatch_uid='eosource_post_save_handler')
 def eosource_post_save_handler(instance: EOSource, **kwargs):
-    """ Post save logic goes here. ie an asset is now available locally, are there products that can be made?"""
+    """ An asset is now available locally, are there products that can be made?
+    Counts the transition in the readiness counters (eo_engine.common.readiness) and queues the keys of the
+    source: the dependency resolver (eo_engine.common.dependencies) answers. """
+    from eo_engine.common.dependencies import enqueue_dependencies
+    from eo_engine.common.readiness import update_readiness
 
     eo_source = instance
+    available = eo_source.state == EOSourceStateChoices.AVAILABLE_LOCALLY
+    was_available = getattr(eo_source, '_db_state', None) == EOSourceStateChoices.AVAILABLE_LOCALLY
+    eo_source._db_state = eo_source.state
+    if available != was_available:
+        update_readiness(eo_source, delta=1 if available else -1)
+
     # if asset is not local, ignore
-    if eo_source.state != EOSourceStateChoices.AVAILABLE_LOCALLY:
+    if not available:
         return
+    enqueue_dependencies(eo_source)
 
-    # it's used for the output filenames
-    yyyymmdd = eo_source.reference_date.strftime('%Y%m%d')
-    yyyy = eo_source.reference_date.strftime('%Y')
 
-    # pipelines that are using this source as input:
-    pipelines = Pipeline.objects.filter(input_groups__in=eo_source.group.all())
+@receiver(pre_delete, sender=EOSource, weak=False, dispatch_uid='eosource_pre_delete_handler')
+def eosource_pre_delete_handler(instance: EOSource, **kwargs):
+    """ A deleted source is not an input anymore. Before the delete: the groups of the source are still known """
+    instance._readiness_groups = list(instance.group.values_list('pk', flat=True))
 
-    for pipeline in pipelines:
-        # a pipeline should have one output group
-        output_group = pipeline.output_group
-        # but pipelines could have multiple input groups
-        for input_group in pipeline.input_groups.all():
-            input_group_eosource = input_group.as_eosource_group()
 
-            if input_group_eosource is None:
-                from eo_engine.errors import AfriCultuReSError
-                raise AfriCultuReSError('All eo_source group should be castable as eo_source_group')
+@receiver(post_delete, sender=EOSource, weak=False, dispatch_uid='eosource_post_delete_handler')
+def eosource_post_delete_handler(instance: EOSource, **kwargs):
+    from eo_engine.common.readiness import recount_readiness
 
-            # so cast to Product grp
-            if hasattr(output_group, 'as_eo_product_group'):
-                output_group = output_group.as_eo_product_group()
+    groups = getattr(instance, '_readiness_groups', [])
+    if groups:
+        recount_readiness(Pipeline.objects.filter(input_groups__in=groups).distinct(), [instance.reference_date])
 
-            output_filename = pipeline.output_filename(**{'YYYYMMDD': yyyymmdd, 'YYYY': yyyy})
 
-            prod, created = EOProduct.objects.get_or_create(
-                filename=output_filename,
-                group=output_group,
-                reference_date=eo_source.reference_date
-            )
+@receiver(m2m_changed, sender=EOSource.group.through, weak=False, dispatch_uid='eosource_groups_changed_handler')
+def eosource_groups_changed_handler(instance, action: str, reverse: bool, pk_set, **kwargs):
+    """ A source that joins or leaves a group is counted in (or out of) the readiness counters of the pipelines of
+    the group, whatever its state. An AVAILABLE_LOCALLY source that joins a group queues its keys. """
+    from eo_engine.common.dependencies import enqueue_dependencies
+    from eo_engine.common.readiness import recount_memberships
 
-            # generalised solution
-            # are all the files that are supposed to be available ?
-            all_of_this_kind = EOSource.objects.filter(group__in=pipeline.input_groups.all(),
-                                                       reference_date=eo_source.reference_date)
-            all_of_this_kind_that_are_available = all_of_this_kind.filter(state=EOSourceStateChoices.AVAILABLE_LOCALLY)
-            if all_of_this_kind.count() == all_of_this_kind_that_are_available.count():
-                prod.state = EOProductStateChoices.AVAILABLE
-            else:
-                prod.state = EOProductStateChoices.MISSING_SOURCE
+    if action == 'pre_clear':
+        # the members are not known after the clear
+        members = instance.eosource_set if reverse else instance.group
+        instance._readiness_cleared = list(members.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_readiness_cleared', [])
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
 
-            prod.save()
+    eo_source_pks, group_pks = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    recount_memberships(eo_source_pks, group_pks)
+    if action == 'post_add':
+        for eo_source in EOSource.objects.filter(pk__in=list(eo_source_pks),
+                                                 state=EOSourceStateChoices.AVAILABLE_LOCALLY):
+            enqueue_dependencies(eo_source)
+
+
+@receiver(eo_source_transition, sender=EOSource, weak=False, dispatch_uid='eosource_transition_handler')
+def eosource_transition_handler(transition: StateTransition, **kwargs):
+    """ The post-save handler of the state transitions (eo_engine.models.transitions): the previous state is
+    known, the source is not loaded """
+    from eo_engine.common.dependencies import enqueue_dependencies
+    from eo_engine.common.readiness import update_readiness
+
+    available = transition.state == EOSourceStateChoices.AVAILABLE_LOCALLY
+    was_available = transition.previous == EOSourceStateChoices.AVAILABLE_LOCALLY
+    if available != was_available:
+        update_readiness(transition, delta=1 if available else -1)
+    if available:
+        enqueue_dependencies(transition)
 
 
 @receiver(post_save, sender=EOProduct, weak=False, dispatch_uid='eoproduct_post_save_handler')
 def eoproduct_post_save_handler(instance: EOProduct, **kwargs):
-    from eo_engine.models import Pipeline
+    from eo_engine.common.aggregation import aggregation_output, is_aggregation_pipeline
     eo_product = instance
     # don't do anything is the product state is not READY
     if eo_product.state != EOProductStateChoices.READY:
@@ -81,6 +110,15 @@ def eoproduct_post_save_handler(instance: EOProduct, **kwargs):
         if not should_create(pipeline, eo_product):
             continue
 
+        # temporal aggregations: one output per period, inputs are folded in as they become READY
+        if is_aggregation_pipeline(pipeline):
+            from eo_engine.tasks import task_fold_temporal_aggregation
+            aggregation_output(pipeline, eo_product)
+            transaction.on_commit(
+                lambda pipeline_pk=pipeline.pk, eo_product_pk=eo_product.pk: task_fold_temporal_aggregation.delay(
+                    pipeline_pk=pipeline_pk, input_eo_product_pk=eo_product_pk))
+            continue
+
         # output templates could be YYYYMMDD or YYYY
         # they're defined when an pipeline is created
         output_filename = pipeline.output_filename(**{'YYYYMMDD': yyyymmdd, 'YYYY': yyyy})
@@ -97,7 +135,70 @@ def eoproduct_post_save_handler(instance: EOProduct, **kwargs):
         prod.save()
 
 
+@receiver(post_save, sender=EOProduct, weak=False, dispatch_uid='eoproduct_ndvi_lts_handler')
+def eoproduct_ndvi_lts_handler(instance: EOProduct, **kwargs):
+    """ Keep the NDVI long-term statistics current. Folding is idempotent, re-saves are harmless. """
+    eo_product = instance
+    if eo_product.state != EOProductStateChoices.READY:
+        return
+    if eo_product.group.name not in getattr(settings, 'NDVI_LTS_GROUPS', ()):
+        return
+
+    from eo_engine.tasks import task_update_ndvi_lts
+    eo_product_pk = eo_product.pk
+    transaction.on_commit(lambda: task_update_ndvi_lts.delay(eo_product_pk=eo_product_pk))
+
+
+@receiver(post_save, sender=EOProduct, weak=False, dispatch_uid='eoproduct_zonal_statistics_handler')
+def eoproduct_zonal_statistics_handler(instance: EOProduct, **kwargs):
+    """ Zonal statistics of the groups in settings.ZONAL_STATISTICS_GROUPS """
+    from eo_engine.common.zonal import zonal_config
+    eo_product = instance
+    if eo_product.state != EOProductStateChoices.READY:
+        return
+    if zonal_config(eo_product.group.name) is None:
+        return
+
+    from eo_engine.tasks import task_zonal_statistics
+    eo_product_pk = eo_product.pk
+    transaction.on_commit(lambda: task_zonal_statistics.delay(eo_product_pk=eo_product_pk))
+
+
+@receiver(post_save, sender=EOProduct, weak=False, dispatch_uid='eoproduct_cube_store_handler')
+def eoproduct_cube_store_handler(instance: EOProduct, **kwargs):
+    """ Append the products of the groups in settings.CUBE_STORE_GROUPS to their cube """
+    from eo_engine.common.cube import cube_config
+    eo_product = instance
+    if eo_product.state != EOProductStateChoices.READY:
+        return
+    if cube_config(eo_product.group.name) is None:
+        return
+
+    from eo_engine.tasks import task_cube_append
+    eo_product_pk = eo_product.pk
+    transaction.on_commit(lambda: task_cube_append.delay(eo_product_pk=eo_product_pk))
+
+
+@receiver(eo_product_transition, sender=EOProduct, weak=False, dispatch_uid='eoproduct_transition_handler')
+def eoproduct_transition_handler(transition: StateTransition, **kwargs):
+    """ The post-save handlers of EOProduct only act on READY products: the product is loaded for them only """
+    if transition.state != EOProductStateChoices.READY:
+        return
+    eo_product = EOProduct.objects.select_related('group').get(pk=transition.pk)
+    for handler in (eoproduct_post_save_handler, eoproduct_ndvi_lts_handler, eoproduct_zonal_statistics_handler,
+                    eoproduct_cube_store_handler):
+        handler(instance=eo_product)
+
+
 __all__ = [
     'eosource_post_save_handler',
-    'eoproduct_post_save_handler'
+    'eosource_pre_delete_handler',
+    'eosource_post_delete_handler',
+    'eosource_groups_changed_handler',
+    'eosource_transition_handler',
+    'eoproduct_post_save_handler',
+    'eoproduct_ndvi_lts_handler',
+    'eoproduct_zonal_statistics_handler',
+    'eoproduct_cube_store_handler',
+    'eoproduct_transition_handler'
 ]
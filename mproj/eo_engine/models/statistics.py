@@ -0,0 +1,37 @@
+from django.db import models
+
+
+class ZonalStatistic(models.Model):
+    """ Statistics of a product per zone (administrative unit) of a zone set. See eo_engine.common.zonal """
+    eo_product = models.ForeignKey('EOProduct', on_delete=models.CASCADE, related_name='zonal_statistics')
+    # denormalised from eo_product, so the time series of a zone is a single index range scan
+    group = models.ForeignKey('EOGroup', on_delete=models.DO_NOTHING)
+    reference_date = models.DateField()
+    zone_set = models.CharField(max_length=64)
+    zone_id = models.CharField(max_length=64)
+    zone_name = models.TextField(default='')
+
+    pixel_count = models.IntegerField(help_text='pixels of the zone')
+    valid_count = models.IntegerField(help_text='pixels of the zone with a valid value')
+    mean = models.FloatField(null=True)
+    std = models.FloatField(null=True)
+    min = models.FloatField(null=True)
+    max = models.FloatField(null=True)
+    timestamp = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['group', 'zone_set', 'zone_id', 'reference_date']
+        constraints = [
+            models.UniqueConstraint(fields=['eo_product', 'zone_set', 'zone_id'], name='unique product/zone')
+        ]
+        indexes = [
+            models.Index(fields=['group', 'zone_set', 'zone_id', 'reference_date'], name='zonal_statistic_series')
+        ]
+
+    def __str__(self):
+        return f'{self.zone_set}/{self.zone_id}/{self.reference_date}: {self.mean}'
+
+
+__all__ = [
+    'ZonalStatistic'
+]
@@ -0,0 +1,88 @@
+"""
+Atomic, conditional state transitions of EOSources and EOProducts.
+
+transition_eo_source/transition_eo_product set the state of one row in a single UPDATE, only if its current state
+is one of from_states, and return whether they won: concurrent workers cannot overwrite each other's states.
+The row is not saved, so post_save is not sent. When the state did change, eo_source_transition or
+eo_product_transition is sent instead, with a StateTransition: the receivers know the previous state without
+loading the row.
+"""
+import datetime
+from typing import Iterable, NamedTuple, Optional
+
+from django.db import connection, transaction
+from django.dispatch import Signal
+
+from .eo_product import EOProduct
+from .eo_source import EOSource
+
+StateTransition = NamedTuple('StateTransition', [
+    ('pk', int),
+    ('reference_date', datetime.date),
+    ('previous', str),
+    ('state', str)
+])
+
+# receivers: (sender: model class, transition: StateTransition)
+eo_source_transition = Signal()
+eo_product_transition = Signal()
+
+# the subquery locks the row and reads its current state, the previous state of the update
+_TRANSITION_SQL = """
+UPDATE {table} AS t SET {assignments}
+FROM (SELECT {pk}, {state} FROM {table} WHERE {pk} = %s FOR UPDATE) AS previous
+WHERE t.{pk} = previous.{pk}{condition}
+RETURNING previous.{state}, t.{reference_date}
+"""
+
+
+def _transition(model, signal: Signal, pk: int, state: str, from_states: Optional[Iterable[str]], fields) -> bool:
+    meta = model._meta
+    quote = connection.ops.quote_name
+    columns = {'pk': quote(meta.pk.column), 'state': quote(meta.get_field('state').column),
+               'reference_date': quote(meta.get_field('reference_date').column)}
+    assignments, values = [f'{columns["state"]} = %s'], [state]
+    for name, value in fields.items():
+        field = meta.get_field(name)
+        assignments.append(f'{quote(field.column)} = %s')
+        values.append(field.get_db_prep_save(value, connection))
+    params = values + [pk]
+    condition = ''
+    if from_states is not None:
+        condition = f' AND previous.{columns["state"]} = ANY(%s)'
+        params.append(list(from_states))
+
+    # the receivers (readiness counters, ...) commit with the transition
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(_TRANSITION_SQL.format(table=quote(meta.db_table), assignments=', '.join(assignments),
+                                                  condition=condition, **columns), params)
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        previous, reference_date = row
+        if previous != state:
+            signal.send(sender=model, transition=StateTransition(pk=pk, reference_date=reference_date,
+                                                                 previous=previous, state=state))
+    return True
+
+
+def transition_eo_source(pk: int, state: str, from_states: Optional[Iterable[str]] = None, **fields) -> bool:
+    """ Sets the state (and fields) of the EOSource pk if its state is one of from_states (None: any).
+    Returns False if the source is not in from_states (or does not exist) """
+    return _transition(EOSource, eo_source_transition, pk, state, from_states, fields)
+
+
+def transition_eo_product(pk: int, state: str, from_states: Optional[Iterable[str]] = None, **fields) -> bool:
+    """ Sets the state (and fields) of the EOProduct pk if its state is one of from_states (None: any).
+    Returns False if the product is not in from_states (or does not exist) """
+    return _transition(EOProduct, eo_product_transition, pk, state, from_states, fields)
+
+
+__all__ = [
+    'StateTransition',
+    'eo_source_transition',
+    'eo_product_transition',
+    'transition_eo_source',
+    'transition_eo_product'
+]
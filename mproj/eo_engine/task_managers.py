@@ -1,15 +1,44 @@
 from celery import Task
-from celery.exceptions import MaxRetriesExceededError
+from celery.exceptions import Ignore, MaxRetriesExceededError
 from celery.states import SUCCESS, FAILURE, REVOKED
 from celery.utils.log import get_task_logger
-from django.utils import timezone
 
+from eo_engine.common.task_tracking import Published, is_tracked, linked_pks, tracker
 from eo_engine.common.tasks import is_process_task
 from eo_engine.errors import AfriCultuReSError
-from eo_engine.models import GeopTask, EOProduct, EOProductStateChoices, EOSource, EOSourceStateChoices
+from eo_engine.models import GeopTask, EOProductStateChoices, transition_eo_product
 
 logger = get_task_logger(__name__)
 
+# the states of a product a process task may start from
+GENERATABLE_STATES = tuple(state for state in EOProductStateChoices.values
+                           if state not in (EOProductStateChoices.IGNORE, EOProductStateChoices.GENERATING))
+
+
+def mark_product_generating(eo_product_pk: int, resumed: bool = False):
+    """ Mark a product as 'GENERATING', before a process task makes it. An IGNOREd (revoked) product is not made,
+    nor one another task is making. A resumed task (retried, or redelivered after its worker died) made it
+    GENERATING itself and takes it over """
+    logger.info(f"Marking product {eo_product_pk} as 'GENERATING'")
+    from_states = GENERATABLE_STATES
+    if resumed:
+        from_states += (EOProductStateChoices.GENERATING,)
+    if not transition_eo_product(eo_product_pk, EOProductStateChoices.GENERATING, from_states=from_states):
+        raise AfriCultuReSError(f'EOProduct {eo_product_pk} is IGNOREd, being generated or does not exist, '
+                                f'not generating it')
+
+
+def mark_product_finished(eo_product_pk: int, status: str):
+    """ Mark a product after a process task returned with status (a celery state). Only a GENERATING product is
+    marked: a task that saved its product READY itself, or a second hook, does not repeat the transition """
+    state = {SUCCESS: EOProductStateChoices.READY,
+             FAILURE: EOProductStateChoices.FAILED,
+             REVOKED: EOProductStateChoices.IGNORE}.get(status)
+    if state is None:
+        return
+    if transition_eo_product(eo_product_pk, state, from_states=(EOProductStateChoices.GENERATING,)):
+        logger.info(f'INFO:TASK:AFTER_RETURN: Marked as {state}')
+
 
 class BaseTaskWithRetry(Task):
 
@@ -26,32 +55,38 @@ class BaseTaskWithRetry(Task):
             return self.run(*args, **kwargs)
 
         # The task namespace is eo_engine or mproj
-        if self.name.startswith('eo_engine') or self.name.startswith('mproj'):
-            task: GeopTask = GeopTask.objects.get(task_id=task_id)
-            now = timezone.now()
-            task.datetime_started = now
-            task.status = task.TaskTypeChoices.STARTED
-
-            group_task = task.group_task
-            if group_task and group_task.datetime_started is None:
-                group_task.datetime_started = now
-                group_task.save()
-            task.save()
+        if is_tracked(self.name):
+            tracker.task_transition(task_id, GeopTask.TaskTypeChoices.STARTED, published=self._published())
 
         return self.run(*args, **kwargs)
 
+    def _published(self) -> Published:
+        """ The task as its publisher records it, for a worker that flushes first """
+        request = self.request
+        task_kwargs = request.kwargs or {}
+        eo_source_pks, eo_product_pks = linked_pks(task_kwargs)
+        return Published(task_id=request.id, task_name=self.name,
+                         task_args=getattr(request, 'argsrepr', None) or repr(tuple(request.args or ())),
+                         task_kwargs=task_kwargs, parent_id=request.parent_id, root_id=request.root_id,
+                         group_task_id=request.group,
+                         group_root_id=None if request.id == request.root_id else request.root_id,
+                         eo_source_pks=eo_source_pks, eo_product_pks=eo_product_pks)
+
     # requires celery 5.2
     def before_start(self, task_id: str, args: tuple, kwargs: dict):
         if is_process_task(self.name) and 'eo_product_pk' not in kwargs.keys():
             raise AfriCultuReSError('eo_product_pk param is missing from the task. Did you forget it? ')
 
         if is_process_task(self.name):  # ie eo_engine.tasks.s02p02.task_s02p02_c_gls_ndvi_300_clip
-            # mark generating product as 'GENERATING'
-            eo_product_pk = kwargs['eo_product_pk']
-            eo_product = EOProduct.objects.get(pk=eo_product_pk)
-            logger.info(f"Marking product {eo_product} as 'GENERATING'")
-            eo_product.state = EOProductStateChoices.GENERATING
-            eo_product.save()
+            resumed = self.request.retries > 0 or bool((self.request.delivery_info or {}).get('redelivered'))
+            try:
+                mark_product_generating(kwargs['eo_product_pk'], resumed=resumed)
+            except AfriCultuReSError as e:
+                # not a failure: on_failure would mark FAILED the product another task is making
+                logger.warning(str(e))
+                if is_tracked(self.name):
+                    tracker.task_transition(task_id, GeopTask.TaskTypeChoices.REVOKED, published=self._published())
+                raise Ignore()
 
         return
 
@@ -59,65 +94,28 @@ class BaseTaskWithRetry(Task):
         logger.info('INFO:TASK:AFTER_RETURN HOOK')
         if is_process_task(self.name):
             # we have already checked that eo_product_pk exists
-            eo_product_pk = kwargs['eo_product_pk']
-            eo_product = EOProduct.objects.get(pk=eo_product_pk)
-            if status == SUCCESS:
-                logger.info('INFO:TASK:AFTER_RETURN: Making as READY')
-                eo_product.state = EOProductStateChoices.READY
-            if status == FAILURE:
-                logger.info('INFO:TASK:AFTER_RETURN: Making as Failed')
-                eo_product.state = EOProductStateChoices.FAILED
-            if status == REVOKED:
-                logger.info('INFO:TASK:AFTER_RETURN: Making as Ignored')
-                eo_product.state = EOProductStateChoices.IGNORE
-            eo_product.save()
+            mark_product_finished(kwargs['eo_product_pk'], status)
         return
 
     def on_success(self, retval, task_id, args, kwargs):
         logger.info('INFO:TASK:ON_SUCCESS HOOK')
-        try:
-            task = GeopTask.objects.get(task_id=task_id)
-        except GeopTask.DoesNotExist:
-            logger.info('INFO: not task entry found.')
-            return
-        task.datetime_finished = timezone.now()
-        try:
-            task.time_to_complete = \
-                (task.datetime_finished - task.datetime_started).__str__()
-        except Exception:
-            task.time_to_complete = None
-        task.status = task.TaskTypeChoices.SUCCESS
-        task.save()
+        if is_tracked(self.name):
+            tracker.task_transition(task_id, GeopTask.TaskTypeChoices.SUCCESS, published=self._published())
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         """This is run by the worker when the task is to be retried."""
         logger.info('INFO:TASK:ON_RETRY HOOK')
-        try:
-            task = GeopTask.objects.get(task_id=task_id)
-        except GeopTask.DoesNotExist:
-            logger.info('on_retry: task_id is not tracked by app')
-            return
-        task.status = task.TaskTypeChoices.RETRY
-        task.retries += 1
-        task.save()
+        if is_tracked(self.name):
+            tracker.task_transition(task_id, GeopTask.TaskTypeChoices.RETRY, published=self._published())
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """ This is run by the worker when the task fails."""
         logger.info('INFO:TASK:ON_FAILURE HOOK')
         logger.info('++Task Failed++')
 
-        try:
-            task = GeopTask.objects.get(task_id=task_id)
-        except GeopTask.DoesNotExist:
-            logger.info('on_failure: task_id is not tracked by app')
-            return
-        task.datetime_finished = timezone.now()
-        task.status = task.TaskTypeChoices.FAILURE
-        task.save()
+        if is_tracked(self.name):
+            tracker.task_transition(task_id, GeopTask.TaskTypeChoices.FAILURE, published=self._published())
 
         # if the failed task is a process task, mark the failed product as failed to be made
         if is_process_task(self.name):
-            eo_product_pk = kwargs['eo_product_pk']
-            eo_product = EOProduct.objects.get(pk=eo_product_pk)
-            eo_product.state = EOProductStateChoices.FAILED
-            eo_product.save()
+            mark_product_finished(kwargs['eo_product_pk'], FAILURE)
@@ -2,14 +2,62 @@
 # TASKS
 
 # RULES:
-# TASKS THAT THAT MAKE PRODUCTS must pass this filter: task_s??p??*
+# TASKS THAT THAT MAKE PRODUCTS must pass this filter: task_s??p??* (or be task_temporal_aggregation)
 # TASKS THAT THAT MAKE PRODUCTS must have the argument eo_product_pk: int in their signature
 
+# The task modules are imported lazily: `from eo_engine.tasks import task_x` imports only the module of task_x.
+# A worker imports the modules of the tasks routed to its queues (see eo_engine.common.task_registry), so
+# the download and crawl workers never import snappy/GDAL/rasterio.
+# NEW TASKS must be added to TASK_MODULES.
+from importlib import import_module
+from typing import Dict, List
 
-from .example import *
-from .other import *
-from .s02p02 import *
-from .s04p01 import *
-from .s04p03 import *
-from .s06p01 import *
-from .s06p04 import *
+TASK_MODULES: Dict[str, List[str]] = {
+    'aggregation': ['task_fold_temporal_aggregation', 'task_temporal_aggregation'],
+    'batch': ['task_batch_generate_eoproducts'],
+    'cube': ['task_cube_append'],
+    'dependencies': ['task_resolve_dependencies', 'task_reconcile_products'],
+    'example': ['task_debug_add', 'task_debug_append_char', 'task_debug_failing'],
+    'maintenance': ['task_purge_task_history'],
+    'other': [
+        'task_upload_eo_product',
+        'task_init_spider',
+        'task_utils_create_wapor_entry',
+        'task_scan_sentinel_hub',
+        'task_sftp_parse_remote_dir',
+        'task_utils_download_eo_sources_for_eo_source_group',
+        'task_utils_discover_eo_sources_for_pipeline',
+        'task_utils_download_eo_sources_for_pipeline',
+        'task_utils_discover_inputs_for_eo_source_group',
+        'task_utils_generate_eoproducts_for_eo_product_group',
+        'task_download_file'
+    ],
+    's02p02': [
+        'task_s02p02_ndvi300m_v2',
+        'task_s02p02_nvdi1km_v3',
+        'task_s02p02_vci1km_v2',
+        'task_s02p02_lai300m_v1',
+        'task_s02p02_ndvianom250m',
+        'task_update_ndvi_lts'
+    ],
+    's04p01': ['task_s04p01_lulc500m'],
+    's04p03': ['task_s04p03_convert_to_tiff', 'task_s04p03_floods375m', 'task_s04p03_floods10m'],
+    's06p01': ['task_s06p01_wb10m_bag', 'task_s06p01_wb10m_kzn', 'task_s06p01_wb100m', 'task_s06p01_wb300m_v2'],
+    's06p04': ['task_s06p04_et3km', 'task_s06p04_etanom5km', 'task_s06p04_et250m', 'task_s06p04_et100m'],
+    'zonal': ['task_zonal_statistics']
+}
+
+_module_of_task: Dict[str, str] = {task: module for module, tasks in TASK_MODULES.items() for task in tasks}
+
+__all__ = list(_module_of_task)
+
+
+def __getattr__(name: str):
+    module = _module_of_task.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(import_module(f'{__name__}.{module}'), name)
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,98 @@
+import datetime
+from logging import Logger
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.core.files import File
+from django.utils import timezone
+
+from eo_engine.common.aggregation import (
+    AggregationSpec,
+    accumulator_path,
+    aggregation_output,
+    aggregation_spec,
+    fold_product,
+    folded_dates,
+    period_dekads,
+    period_of,
+    write_aggregation
+)
+from eo_engine.common.layout import get_layout_profile
+from eo_engine.common.time import dekad_startdate
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, EOProductStateChoices, Pipeline
+
+logger: Logger = get_task_logger(__name__)
+
+
+def _missing_dekads(output: EOProduct, spec: AggregationSpec):
+    period = period_of(output.reference_date, spec.period)
+    folded = {dekad_startdate(datetime.date.fromisoformat(d)) for d in folded_dates(accumulator_path(output))}
+    return sorted(set(period_dekads(period)) - folded)
+
+
+@shared_task
+def task_fold_temporal_aggregation(pipeline_pk: int, input_eo_product_pk: int):
+    """ Folds a READY input into the accumulator of its period. Schedules the output of the period when its
+    last dekad is in. """
+    pipeline = Pipeline.objects.get(pk=pipeline_pk)
+    eo_product = EOProduct.objects.get(pk=input_eo_product_pk)
+    spec = aggregation_spec(**pipeline.task_kwargs)
+    output = aggregation_output(pipeline, eo_product)
+
+    fold_product(accumulator_path(output), eo_product.file.path, eo_product.reference_date, spec,
+                 chunksizes=get_layout_profile(output.group.name).chunksizes)
+
+    if _missing_dekads(output, spec):
+        return
+    # only one of the concurrent folds of the period gets to schedule it
+    scheduled = EOProduct.objects.filter(
+        pk=output.pk,
+        state__in=(EOProductStateChoices.MISSING_SOURCE, EOProductStateChoices.AVAILABLE)
+    ).update(state=EOProductStateChoices.SCHEDULED)
+    if scheduled:
+        logger.info(f'All the dekads of {output} are in, scheduling it')
+        task_temporal_aggregation.apply_async(kwargs={'eo_product_pk': output.pk, **pipeline.task_kwargs})
+
+
+@shared_task
+def task_temporal_aggregation(eo_product_pk: int, **kwargs):
+    """ Makes the monthly/seasonal product of an aggregation pipeline from the accumulator of its period.
+    READY inputs that are not in the accumulator yet (e.g. made before the pipeline existed) are folded first. """
+    output = EOProduct.objects.get(id=eo_product_pk)
+    pipeline = output.group.eoproductgroup.pipelines_from_output.get()
+    spec = aggregation_spec(**kwargs)
+    period = period_of(output.reference_date, spec.period)
+    acc_path = accumulator_path(output)
+
+    folded = set(folded_dates(acc_path))
+    inputs_qs = EOProduct.objects.filter(
+        group__in=pipeline.input_groups.all(),
+        reference_date__range=(period.start, period.end),
+        state=EOProductStateChoices.READY)
+    for eo_product in inputs_qs:
+        if eo_product.reference_date.isoformat() not in folded:
+            fold_product(acc_path, eo_product.file.path, eo_product.reference_date, spec,
+                         chunksizes=get_layout_profile(output.group.name).chunksizes)
+
+    missing = _missing_dekads(output, spec)
+    if missing:
+        raise AfriCultuReSError(
+            f'{output.filename}: the dekads {", ".join(d.isoformat() for d in missing)} are not available yet')
+
+    with TemporaryDirectory(prefix='task_temporal_aggregation_') as temp_dir:
+        file_out = write_aggregation(acc_path, Path(temp_dir) / output.filename, spec, output.group.name)
+        with file_out.open('rb') as fh:
+            output.file.save(name=output.filename, content=File(fh), save=False)
+        output.state = EOProductStateChoices.READY
+        output.datetime_creation = timezone.now()
+        output.save()
+    return
+
+
+__all__ = [
+    'task_fold_temporal_aggregation',
+    'task_temporal_aggregation'
+]
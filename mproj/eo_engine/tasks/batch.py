@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Dict, List, Tuple
+
+from celery import shared_task
+from celery.states import FAILURE, IGNORED, SUCCESS
+from celery.utils.log import get_task_logger
+from django.db import connection
+
+from eo_engine.common.gdal_profile import activate_gdal_profile
+from eo_engine.common.tasks import get_task_ref_from_name
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import Pipeline
+from eo_engine.task_managers import mark_product_finished, mark_product_generating
+
+logger: Logger = get_task_logger(__name__)
+
+
+@shared_task
+def task_batch_generate_eoproducts(pipeline_pk: int, eo_product_pks: List[int], workers: int = 1) -> Dict[int, str]:
+    """ Makes a list of products of a pipeline in one task, so the worker start-up (imports, JVM, SNAP
+    operators, GDAL caches, aux data) is paid once per batch instead of once per product.
+
+    Every product goes through the states of a single process task (GENERATING, then READY or FAILED, see
+    BaseTaskWithRetry). A failed product does not stop the batch; the task fails at the end if any did.
+
+    @param workers: products made at the same time, in threads (prefork workers can not fork).
+    """
+    pipeline = Pipeline.objects.get(pk=pipeline_pk)
+    task = get_task_ref_from_name(pipeline.task_name)
+    # the GDAL profile of the pipeline task, not the one of the batch task
+    activate_gdal_profile(task.name)
+
+    def make(eo_product_pk: int) -> Tuple[int, str]:
+        try:
+            try:
+                mark_product_generating(eo_product_pk)
+            except AfriCultuReSError as e:
+                # revoked, or made by another task, meanwhile
+                logger.warning(str(e))
+                return eo_product_pk, IGNORED
+            try:
+                task.run(eo_product_pk=eo_product_pk, **pipeline.task_kwargs)
+            except Exception:
+                logger.exception(f'{task.name} failed for EOProduct {eo_product_pk}')
+                mark_product_finished(eo_product_pk, FAILURE)
+                return eo_product_pk, FAILURE
+            mark_product_finished(eo_product_pk, SUCCESS)
+            return eo_product_pk, SUCCESS
+        finally:
+            if workers > 1:
+                # every thread has its own db connection
+                connection.close()
+
+    logger.info(f'Making {len(eo_product_pks)} products of {pipeline.name} with {task.name}; workers: {workers}')
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(executor.map(make, eo_product_pks))
+    else:
+        results = dict(make(pk) for pk in eo_product_pks)
+
+    failed = [pk for pk, status in results.items() if status == FAILURE]
+    if failed:
+        raise AfriCultuReSError(f'{len(failed)} of {len(results)} products failed: {failed}')
+    return results
+
+
+__all__ = [
+    'task_batch_generate_eoproducts'
+]
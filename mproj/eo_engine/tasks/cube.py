@@ -0,0 +1,24 @@
+from logging import Logger
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from eo_engine.common.cube import append_product
+from eo_engine.models import EOProduct, EOProductStateChoices
+
+logger: Logger = get_task_logger(__name__)
+
+
+@shared_task
+def task_cube_append(eo_product_pk: int):
+    """ Appends a READY product to the cube store of its group """
+    eo_product = EOProduct.objects.get(pk=eo_product_pk)
+    if eo_product.state != EOProductStateChoices.READY or not eo_product.file:
+        logger.warning(f'{eo_product} is not READY, not appending it to the cube')
+        return False
+    return append_product(eo_product)
+
+
+__all__ = [
+    'task_cube_append'
+]
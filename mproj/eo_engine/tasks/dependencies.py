@@ -0,0 +1,35 @@
+from logging import Logger
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from eo_engine.common.dependencies import drain_pending_dependencies
+from eo_engine.common.reconciliation import reconcile_products
+
+logger: Logger = get_task_logger(__name__)
+
+
+@shared_task
+def task_resolve_dependencies():
+    """ Resolves the products of the queued (group, reference_date) keys, see eo_engine.common.dependencies """
+    report = drain_pending_dependencies()
+    return report._asdict()
+
+
+@shared_task(bind=True)
+def task_reconcile_products(self):
+    """ Creates the missing and updates the stale products of all the pipelines, see
+    eo_engine.common.reconciliation. The progress is the PROGRESS state of the task. """
+
+    def progress(done: int, total: int, report):
+        self.update_state(state='PROGRESS', meta={'done': done, 'total': total, **report._asdict()})
+
+    report = reconcile_products(progress=progress)
+    logger.info(f'Reconciliation: {report}')
+    return report._asdict()
+
+
+__all__ = [
+    'task_resolve_dependencies',
+    'task_reconcile_products'
+]
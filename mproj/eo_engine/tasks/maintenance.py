@@ -0,0 +1,20 @@
+from logging import Logger
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from eo_engine.common.task_history import purge_task_history
+
+logger: Logger = get_task_logger(__name__)
+
+
+@shared_task
+def task_purge_task_history():
+    """ Deletes the task history older than the retention settings, see eo_engine.common.task_history """
+    report = purge_task_history()
+    return report._asdict()
+
+
+__all__ = [
+    'task_purge_task_history'
+]
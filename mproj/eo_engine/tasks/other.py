@@ -1,36 +1,38 @@
 import datetime
-import re
 from datetime import date as dt_date
 from logging import Logger
 from pathlib import Path
-from typing import Literal, List
+from typing import Literal, List, Optional, Union
 
 from celery import shared_task, group
 from celery.exceptions import MaxRetriesExceededError
 from celery.result import GroupResult
 from celery.utils.log import get_task_logger
-from dateutil.rrule import rrule, DAILY
 from datetime import timedelta
 from datetime import datetime
+from django.conf import settings
 from django.utils import timezone
 from more_itertools import collapse
-from scrapy import Spider
-from sentinelsat import SentinelAPI, geojson_to_wkt, read_geojson
 
 from eo_engine.common import RemoteFile
-from eo_engine.common.db_ops import add_to_db
+from eo_engine.common.db_ops import ingest_remote_files
 from eo_engine.common.tasks import get_task_ref_from_name
 from eo_engine.common.verify import check_file_exists
 from eo_engine.errors import AfriCultuReSError, AfriCultuReSRetriableError
 from eo_engine.models import EOProduct, Upload, EOSourceGroupChoices, Credentials, EOSourceGroup, EOSource, \
-    EOSourceStateChoices, Pipeline, CrawlerConfiguration, EOProductGroup, EOProductStateChoices
+    EOSourceStateChoices, Pipeline, CrawlerConfiguration, EOProductGroup, EOProductStateChoices, transition_eo_source
 from eo_engine.task_managers import BaseTaskWithRetry
+from eo_engine.tasks.batch import task_batch_generate_eoproducts
 
 logger: Logger = get_task_logger(__name__)
 
 now = timezone.now()
 DT_DELTA_1D = timedelta(days=+1)
 PARSE_DT_ISO_FORMAT = datetime.fromisoformat
+# the states of a source task_download_file may start from: not being downloaded by another worker, not IGNOREd
+DOWNLOADABLE_STATES = (EOSourceStateChoices.AVAILABLE_REMOTELY, EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD,
+                       EOSourceStateChoices.DEFERRED, EOSourceStateChoices.DOWNLOAD_FAILED,
+                       EOSourceStateChoices.AVAILABLE_LOCALLY)
 
 
 @shared_task
@@ -66,7 +68,7 @@ def task_init_spider(spider_name):
     # # scrapy_settings = get_project_settings()
     # # spider_loader = SpiderLoader.from_settings(scrapy_settings)
     spider_loader = get_spider_loader()
-    spider: Spider = spider_loader.load(spider_name)
+    spider = spider_loader.load(spider_name)
     # print(scrapy_settings)
 
     # check if this spider is enabled:
@@ -93,46 +95,18 @@ def task_init_spider(spider_name):
 
 @shared_task()
 def task_utils_create_wapor_entry(
-        wapor_group_name: str,
-        from_date: str
+        wapor_group_name: Union[str, List[str]],
+        from_date: str,
+        to_date: Optional[str] = None
 ) -> str:
-    from eo_engine.models.factories import create_or_get_wapor_object_from_filename
+    """ The entries of every dekad from from_date to to_date (today) of one or more WAPOR groups """
+    from eo_engine.models.factories import bulk_create_wapor_entries
+    group_names = [wapor_group_name] if isinstance(wapor_group_name, str) else wapor_group_name
     from_date = PARSE_DT_ISO_FORMAT(from_date).date()
+    to_date = PARSE_DT_ISO_FORMAT(to_date).date() if to_date else dt_date.today()
 
-    to_date = dt_date.today()
-    pat = re.compile(
-        r'S06P04_WAPOR_(?P<LEVEL>(L1|L2))_(?P<PROD>(AETI|QUAL_LST|QUAL_NDVI))_D_(?P<LOCATION>(AFRICA|\w{3}|))',
-        re.IGNORECASE)
-    match = pat.match(wapor_group_name)
-    if match is None:
-        raise
-    group_dict = match.groupdict()
-    product_level = group_dict['LEVEL']
-    product_name = group_dict['PROD']
-    location = group_dict['LOCATION']
-    product_dimension = 'D'
-    obj_created = 0
-    obj_exist = 0
-    dt: datetime
-    for idx, dt in enumerate(rrule(DAILY, dtstart=from_date, until=to_date), 1):
-        year = dt.year
-        month = dt.month
-        day = dt.day
-        from eo_engine.common.time import month_dekad_to_running_decad
-        from eo_engine.common.time import day2dekad
-        yearly_dekad = month_dekad_to_running_decad(month, day2dekad(day))
-        YYKK = f'{str(year)[2:]}{yearly_dekad}'  # last two digits of the year + running dekad
-        if location:
-            filename = f'{product_level}_{product_name}_{product_dimension}_{YYKK}_{location}.tif'
-        else:
-            # if location is missing, it's AFRICA
-            filename = f'{product_level}_{product_name}_{product_dimension}_{YYKK}.tif'
-        obj, created = create_or_get_wapor_object_from_filename(filename)
-
-        if created:
-            obj_created += 1
-
-    return f'created {obj_created} entries for {wapor_group_name}'
+    reports = bulk_create_wapor_entries(group_names, from_date=from_date, to_date=to_date)
+    return ', '.join(f'created {report.created} entries for {name}' for name, report in reports.items())
 
 
 @shared_task
@@ -143,7 +117,10 @@ def task_scan_sentinel_hub(
             EOSourceGroupChoices.S06P01_S1_10M_BAG,
             EOSourceGroupChoices.S06P01_S1_10M_KZN
         ] = None,
+        use_high_water_mark: bool = True,
         **kwargs):
+    """ Adds the Sentinel-1 products of the area of the group. use_high_water_mark=False to backfill dates older
+    than the latest known product (see eo_engine.common.db_ops.ingest_remote_files) """
     from_date = PARSE_DT_ISO_FORMAT(from_date)
     to_date = PARSE_DT_ISO_FORMAT(to_date)
     credentials = Credentials.objects.get(domain='sentinel')
@@ -157,6 +134,7 @@ def task_scan_sentinel_hub(
         raise AfriCultuReSError(f'Unknown Group: {group_name}')
     check_file_exists(geojson_path)
 
+    from sentinelsat import SentinelAPI, geojson_to_wkt, read_geojson
     area = geojson_to_wkt(read_geojson(geojson_path))
     api_kwargs = {
         'platformname': 'Sentinel-1',
@@ -173,21 +151,20 @@ def task_scan_sentinel_hub(
         user=credentials.username,
         password=credentials.password
     )
-    for uuid, payload in api.query(
-            area=area, **api_kwargs
-    ).items():
-        remote_file = RemoteFile(
+    remote_files = (
+        RemoteFile(
             domain='sentinel',
             url=f'sentinel://{uuid}',
             # XXX: number exists, but need to parse it
             filesize_reported=-1,
             filename=payload['identifier'] + '.zip'
-        )
-        add_to_db(remote_file=remote_file, eo_source_group=eo_source_group)
+        ) for uuid, payload in api.query(area=area, **api_kwargs).items())
+    return ingest_remote_files(remote_files, eo_source_group=eo_source_group,
+                               use_high_water_mark=use_high_water_mark)._asdict()
 
 
 @shared_task
-def task_sftp_parse_remote_dir(group_name: str):
+def task_sftp_parse_remote_dir(group_name: str, use_high_water_mark: bool = True):
     # assign remote_urls based on the group
     # urls are in this form: sftp://adf.adf.com/asdf/aa'
     group = EOSourceGroup.objects.get(name=group_name)
@@ -199,7 +176,6 @@ def task_sftp_parse_remote_dir(group_name: str):
 
     from urllib.parse import urlparse
     from eo_engine.common.sftp import list_dir_entries, sftp_connection
-    from eo_engine.common.db_ops import add_to_db
     o = urlparse(remote_dir)
     domain = o.netloc
     path = o.path
@@ -207,8 +183,9 @@ def task_sftp_parse_remote_dir(group_name: str):
     sftp_connection = sftp_connection(host=domain,
                                       username=credentials.username,
                                       password=credentials.password)
-    for entry in list_dir_entries(remotepath=path, connection=sftp_connection):
-        add_to_db(entry, eo_source_group=group_name)
+    # the full listing is filtered in memory, only the new entries reach the database
+    return ingest_remote_files(list_dir_entries(remotepath=path, connection=sftp_connection),
+                               eo_source_group=group, use_high_water_mark=use_high_water_mark)._asdict()
 
 
 @shared_task
@@ -328,7 +305,13 @@ def task_utils_discover_inputs_for_eo_source_group(
 
 
 @shared_task
-def task_utils_generate_eoproducts_for_eo_product_group(eo_product_id: int) -> str:
+def task_utils_generate_eoproducts_for_eo_product_group(eo_product_id: int, batch_size: Optional[int] = None,
+                                                        batch_workers: int = 1) -> str:
+    """ Schedules the AVAILABLE products of a group. With a batch_size (default:
+    settings.EOPRODUCT_BATCH_SIZE), a task makes batch_size products instead of one (see
+    task_batch_generate_eoproducts). """
+    if batch_size is None:
+        batch_size = getattr(settings, 'EOPRODUCT_BATCH_SIZE', 0)
     eo_product_group = EOProductGroup.objects.get(pk=eo_product_id)
     qs_eo_product = EOProduct.objects.filter(group=eo_product_group,
                                              state=EOProductStateChoices.AVAILABLE)
@@ -338,7 +321,14 @@ def task_utils_generate_eoproducts_for_eo_product_group(eo_product_id: int) -> s
         task_name = pipeline.task_name
         task_kwargs = pipeline.task_kwargs
         task = get_task_ref_from_name(task_name)
-        tasks = [task.s(eo_product_pk=eo_product.pk, **task_kwargs) for eo_product in qs_eo_product]
+        if batch_size > 1:
+            eo_product_pks = list(qs_eo_product.order_by('reference_date').values_list('pk', flat=True))
+            tasks = [task_batch_generate_eoproducts.s(pipeline_pk=pipeline.pk,
+                                                      eo_product_pks=eo_product_pks[i:i + batch_size],
+                                                      workers=batch_workers)
+                     for i in range(0, len(eo_product_pks), batch_size)]
+        else:
+            tasks = [task.s(eo_product_pk=eo_product.pk, **task_kwargs) for eo_product in qs_eo_product]
         qs_eo_product.update(state=EOProductStateChoices.SCHEDULED)
         job = group(tasks)
         result: GroupResult = job.apply_async()
@@ -358,9 +348,15 @@ def task_download_file(self, eo_source_pk: int):
                                            download_wapor_eosource,
                                            download_sentinel_resource)
 
+    from_states = DOWNLOADABLE_STATES
+    if (self.request.delivery_info or {}).get('redelivered'):
+        # acks late: this task was interrupted while downloading
+        from_states += (EOSourceStateChoices.DOWNLOADING,)
+    if not transition_eo_source(eo_source_pk, EOSourceStateChoices.DOWNLOADING, from_states=from_states):
+        # another worker downloads it, or it was IGNOREd
+        logger.info(f'LOG:INFO:EOSource {eo_source_pk} is not downloadable, skipped')
+        return None
     eo_source = EOSource.objects.get(pk=eo_source_pk)
-    eo_source.state = EOSourceStateChoices.DOWNLOADING
-    eo_source.save()
     url_parse = urlparse(eo_source.url)
     scheme = url_parse.scheme
 
@@ -380,20 +376,17 @@ def task_download_file(self, eo_source_pk: int):
         else:
             raise Exception(f'There was no defined method for scheme: {scheme}')
     except AfriCultuReSRetriableError as exc:
-        eo_source.refresh_from_db()
-        eo_source.state = EOSourceStateChoices.DEFERRED
-        eo_source.save()
+        transition_eo_source(eo_source_pk, EOSourceStateChoices.DEFERRED,
+                             from_states=(EOSourceStateChoices.DOWNLOADING,))
         try:
             raise self.retry(countdown=10)
         except MaxRetriesExceededError as e:
             logger.info(f'LOG:INFO:DOWNLOADING_FILE. Maximum attempts exceeded. Failing.')
-            eo_source.refresh_from_db()
-            eo_source.state = EOSourceStateChoices.DOWNLOAD_FAILED
-            eo_source.save()
+            transition_eo_source(eo_source_pk, EOSourceStateChoices.DOWNLOAD_FAILED,
+                                 from_states=(EOSourceStateChoices.DEFERRED,))
     except BaseException as e:
-        eo_source.refresh_from_db()
-        eo_source.state = EOSourceStateChoices.DOWNLOAD_FAILED
-        eo_source.save()
+        transition_eo_source(eo_source_pk, EOSourceStateChoices.DOWNLOAD_FAILED,
+                             from_states=(EOSourceStateChoices.DOWNLOADING, EOSourceStateChoices.DEFERRED))
         raise Exception('Could not download.') from e
 
 
@@ -3,16 +3,32 @@ import subprocess
 from logging import Logger
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import List
+from typing import List, Tuple
 
-import snappy
+import numpy as np
+import rasterio
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.core.files import File
 from django.utils import timezone
-from osgeo import gdal
-from snappy import ProductIO, GPF
 
+from eo_engine.common.gdal_profile import rasterio_creation_options
+from eo_engine.common.layout import get_layout_profile, product_spec
+from eo_engine.common.lts import export_lts, fold_product, lts_key
+from eo_engine.common.masks import cutline_window, iter_masked_windows
+from eo_engine.common.netcdf import clip_netcdf, VariableSpec, write_netcdf_product
+from eo_engine.common.raster import grid_signature
+from eo_engine.common.snap import java_type, load_operator_spis, read_aux_product
+from eo_engine.common.resample import aggregated_grid, iter_aggregated_windows
+from eo_engine.common.zonal import (
+    ValueSpec,
+    ZonalAccumulator,
+    group_accumulators,
+    store_zonal_statistics,
+    tap_blocks,
+    zonal_config
+)
 from eo_engine.errors import AfriCultuReSError
 from eo_engine.models import EOProduct, EOSource, EOProductStateChoices
 
@@ -20,6 +36,24 @@ logger: Logger = get_task_logger(__name__)
 
 now = timezone.now()
 
+# missing, cloud, snow, sea and background of the CGLS NDVI
+NDVI_FLAGS = (251, 252, 253, 254, 255)
+NDVI_NODATA = 255
+
+NDVIA_SPEC = VariableSpec(
+    name='NDVIA',
+    dtype='f4',
+    fill_value=0,
+    scale_factor=0.008,
+    add_offset=-1,
+    attrs={
+        'short_name': 'NDVI anomaly',
+        'long_name': 'Normalized Difference Vegetation Index (NDVI) anomaly',
+        'flag_masks': [253, 254, 255],
+        'flag_meanings': 'invalid water no_data',
+        'valid_range': [0, 250]  # meaning -1 to 1
+    })
+
 
 @shared_task
 def task_s02p02_ndvi300m_v2(eo_product_pk: int):
@@ -29,43 +63,22 @@ def task_s02p02_ndvi300m_v2(eo_product_pk: int):
     # only has one input
     eo_source_input: EOSource = input_files_qs.get()
 
-    filename_in = eo_source_input.filename
-
-    def clip(in_file, out_file, geom):
-        lat_str = "lat," + str(geom[0]) + "," + str(geom[1])
-        lon_str = "lon," + str(geom[2]) + "," + str(geom[3])
-        cp = subprocess.run(['ncks',
-                             '-v', 'NDVI',
-                             '-d', lat_str,
-                             '-d', lon_str,
-                             #                              '-d', "lat,13439,40320",
-                             #                             '-d', "lon,50390,80640",
-                             in_file,
-                             out_file], check=True)
-        return_path = Path(out_file)  # Path(str(clipped.getFileLocation()))
-        print(return_path)
-        return return_path
-
     with TemporaryDirectory(prefix='task_s0p02_clip_ndvi300m_v2_afr_') as temp_dir:
-        geom = [13439, 40320, 50390, 80640]
+        # lat/lon index ranges (inclusive) of Africa in the global 300m grid
+        lat_range, lon_range = (13439, 40320), (50390, 80640)
 
         out_file = Path(temp_dir) / produced_file.filename
-        clipped: Path = clip(in_file=eo_source_input.file.path, out_file=out_file.as_posix(), geom=geom)
-        try:
-            cp: subprocess.CompletedProcess = subprocess.run(
-                ['ncatted',
-                 '-a', f'short_name,NDVI,o,c,NDVI',
-                 '-a', f'long_name,NDVI,o,c,Normalized Difference Vegetation Index Resampled 300m',
-                 '-a', f'grid_mapping,NDVI,o,c,crs',
-                 '-a', f'flag_meanings,NDVI,o,c,Missing cloud snow sea background',
-                 '-a', f'flag_values,NDVI,o,c,[251 252 253 254 255]',
-                 clipped.as_posix()], check=True)
-        except subprocess.CalledProcessError as e:
-
-            logger.info(f'EXIT CODE: {e.returncode}')
-            logger.info(f'EXIT CODE: {e.stderr}')
-            logger.info(f'EXIT CODE: {e.stdout}')
-            raise e
+        clipped: Path = clip_netcdf(
+            file_in=eo_source_input.file.path, file_out=out_file,
+            lat=lat_range, lon=lon_range,
+            variables=['NDVI'],
+            layout=get_layout_profile(produced_file.group.name),
+            attrs={'NDVI': {
+                'short_name': 'NDVI',
+                'long_name': 'Normalized Difference Vegetation Index Resampled 300m',
+                'grid_mapping': 'crs',
+                'flag_meanings': 'Missing cloud snow sea background',
+                'flag_values': '[251 252 253 254 255]'}})
 
         content = File(clipped.open('rb'))
         produced_file.file.save(name=produced_file.filename, content=content, save=False)
@@ -77,7 +90,7 @@ def task_s02p02_ndvi300m_v2(eo_product_pk: int):
 
 @shared_task
 def task_s02p02_nvdi1km_v3(eo_product_pk):
-    """" Resamples to 1km and cuts to AOI bbox """
+    """" Resamples to 1km (3x3 block mean, the flag values are not averaged) and cuts to AOI bbox """
 
     eo_product = EOProduct.objects.get(id=eo_product_pk)
     # this pipeline needs eo_products, 'S02P02_NDVI_300M_V3_AFR' which was made in another pipeline
@@ -85,7 +98,8 @@ def task_s02p02_nvdi1km_v3(eo_product_pk):
     input_files_qs = EOProduct.objects.filter(group=input_eo_product_group, reference_date=eo_product.reference_date)
     input_file = input_files_qs.get()
 
-    target_resolution = 0.0089285714286
+    # the 1km grid is aligned with the 300m grid, every 1km pixel is the mean of 3x3 300m pixels
+    factor = 3
     xmin, ymin, xmax, ymax = -30.0044643, -40.0044643, 60.0066643, 40.0044643
 
     # Mark it as 'in process'
@@ -94,34 +108,26 @@ def task_s02p02_nvdi1km_v3(eo_product_pk):
     # input file//eo_product
     input_obj: EOProduct = input_file
 
-    with TemporaryDirectory() as tmp_dir:
+    with TemporaryDirectory() as tmp_dir, \
+            rasterio.open(input_obj.file.path) as src:
         output_temp_file = f"{tmp_dir}/tmp_file.nc"
-        cp = subprocess.run([
-            'gdalwarp',
-            '-r', 'average',
-            '-tr', f'{target_resolution}', f'{target_resolution}',
-            '-te', f'{xmin}', f'{ymin}', f'{xmax}', f'{ymax}',
-            f'{input_obj.file.path}', output_temp_file
-        ], check=True)
-
-        # metadata fine tuning using NCO tools
-        # for usuage details see:
-        # http://nco.sourceforge.net/nco.html#ncatted-netCDF-Attribute-Editor
-
-        # Rename default Band1 to NDVI
-        print('Rename Variable')
-        cp = subprocess.run(['ncrename',
-                             '-v', 'Band1,NDVI',
-                             output_temp_file], check=True)
-
-        # ncatted is for nc attribute editor
-        print('Editing metadata')
-        cp = subprocess.run(['ncatted',
-                             '-a', 'short_name,NDVI,o,c,NDVI',
-                             '-a', "long_name,NDVI,o,c,Normalized Difference Vegetation Index Resampled 1 Km",
-                             '-a', "add_offset,NDVI,o,d,-0.08",
-                             '-a', "scale_factor,NDVI,o,d,0.004",
-                             output_temp_file], check=True)
+        grid = aggregated_grid(src, factor, bounds=(xmin, ymin, xmax, ymax))
+        blocks = iter_aggregated_windows(
+            src, factor, bounds=(xmin, ymin, xmax, ymax),
+            nodata=NDVI_NODATA, flags=NDVI_FLAGS)
+        write_netcdf_product(
+            Path(output_temp_file), blocks,
+            product_spec(VariableSpec(
+                name='NDVI',
+                dtype=src.dtypes[0],
+                fill_value=NDVI_NODATA,
+                add_offset=-0.08,
+                scale_factor=0.004,
+                attrs={
+                    'short_name': 'NDVI',
+                    'long_name': 'Normalized Difference Vegetation Index Resampled 1 Km'
+                }), eo_product.group.name),
+            transform=grid.transform, crs=src.crs, width=grid.width, height=grid.height)
 
         with open(output_temp_file, 'rb') as fh:
             content = File(fh)
@@ -141,10 +147,14 @@ def task_s02p02_vci1km_v2(eo_product_pk):
     # Contact: icherif@yahoo.com
     # -----------------------------
 
+    # snappy starts the JVM on import, only the SNAP tasks import it
+    import snappy
+    from snappy import ProductIO, GPF
+
     # Required aux data.
 
-    HashMap = snappy.jpy.get_type('java.util.HashMap')
-    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+    HashMap = java_type('java.util.HashMap')
+    load_operator_spis()
 
     def write_product(data, file_path, format=None):
         ProductIO.writeProduct(data, file_path, format if format else 'NetCDF4-CF')
@@ -158,8 +168,7 @@ def task_s02p02_vci1km_v2(eo_product_pk):
 
     # noinspection PyUnresolvedReferences
     def get_VCI(data, file, dir):
-        GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
-        BandDescriptor = snappy.jpy.get_type('org.esa.snap.core.gpf.common.BandMathsOp$BandDescriptor')
+        BandDescriptor = java_type('org.esa.snap.core.gpf.common.BandMathsOp$BandDescriptor')
         targetBand = BandDescriptor()
         targetBand.name = 'VCI'
         targetBand.type = 'float32'
@@ -179,8 +188,7 @@ def task_s02p02_vci1km_v2(eo_product_pk):
         # band_names = data.getBandNames()
         # print("Bands:   %s" % (list(band_names)))
 
-        GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
-        BandDescriptor = snappy.jpy.get_type('org.esa.snap.core.gpf.common.BandMathsOp$BandDescriptor')
+        BandDescriptor = java_type('org.esa.snap.core.gpf.common.BandMathsOp$BandDescriptor')
         targetBand = BandDescriptor()
         targetBand.name = 'VCI'
         targetBand.type = 'int32'
@@ -212,8 +220,9 @@ def task_s02p02_vci1km_v2(eo_product_pk):
         print(Path(f_lts_max).is_file())
 
         data = ProductIO.readProduct(f_ndvi)
-        data1 = ProductIO.readProduct(f_lts_min)
-        data2 = ProductIO.readProduct(f_lts_max)
+        # the LTS are shared by all the products of a dekad, read them once per process
+        data1 = read_aux_product(f_lts_min)
+        data2 = read_aux_product(f_lts_max)
         try:
             merged = merge(data, data1, data2)
         except Exception as e:
@@ -239,7 +248,7 @@ def task_s02p02_vci1km_v2(eo_product_pk):
     input_files_qs = EOProduct.objects.filter(group=input_eo_product_group, reference_date=output_obj.reference_date)
     ndvi_1k_obj = input_files_qs.get()
 
-    lts_dir = Path('/aux_files/NDVI_LTS')
+    lts_dir = Path(getattr(settings, 'NDVI_LTS_DIR', settings.AUX_FILES_ROOT / 'NDVI_LTS'))
     ndvi_path = ndvi_1k_obj.file.path
 
     with TemporaryDirectory() as tempdir:
@@ -265,6 +274,18 @@ def task_s02p02_vci1km_v2(eo_product_pk):
     return
 
 
+@shared_task
+def task_update_ndvi_lts(eo_product_pk: int):
+    """ Folds a READY NDVI 1km product into the long-term statistics of its dekad and exports them """
+    eo_product = EOProduct.objects.get(id=eo_product_pk)
+    if eo_product.state != EOProductStateChoices.READY or not eo_product.file:
+        logger.warning(f'{eo_product} is not READY, not updating the NDVI LTS')
+        return
+    if fold_product(eo_product.file.path, eo_product.reference_date):
+        export_lts(lts_key(eo_product.reference_date))
+    return
+
+
 @shared_task
 def task_s02p02_lai300m_v1(eo_product_pk: int):
     produced_file = EOProduct.objects.get(id=eo_product_pk)
@@ -277,36 +298,19 @@ def task_s02p02_lai300m_v1(eo_product_pk: int):
     rt = filename_in.split('-')[1][:3]
     ver = filename_in.split('_V')[1][:5]
 
-    def clip(in_file, out_file, geom):
-        lat_str = "lat," + str(geom[0]) + "," + str(geom[1])
-        lon_str = "lon," + str(geom[2]) + "," + str(geom[3])
-        subprocess.run(['ncks',
-                        '-v', 'LAI',
-                        '-d', lat_str,
-                        '-d', lon_str,
-                        in_file,
-                        out_file], check=True)
-        return_path = Path(out_file)  # Path(str(clipped.getFileLocation()))
-        logger.info(return_path)
-        return return_path
-
     # noinspection DuplicatedCode
     with TemporaryDirectory(prefix='task_s0p02_clip_lai300m_v1_afr_') as temp_dir:
-        geom = [14200, 38800, 53900, 78700]
+        # lat/lon index ranges (inclusive) of Africa in the global 300m grid
+        lat_range, lon_range = (14200, 38800), (53900, 78700)
         out_file = Path(temp_dir) / produced_file.filename
-        clipped: Path = clip(in_file=eo_source_input.file.path, out_file=out_file.as_posix(), geom=geom)
-        try:
-            subprocess.CompletedProcess = subprocess.run(
-                ['ncatted',
-                 '-a', f'Consolidation_period,LAI,o,c,{rt}',
-                 '-a', f'LAI_version,LAI,o,c,{ver}',
-                 clipped.as_posix()], check=True)
-        except subprocess.CalledProcessError as e:
-
-            logger.info(f'EXIT CODE: {e.returncode}')
-            logger.info(f'EXIT CODE: {e.stderr}')
-            logger.info(f'EXIT CODE: {e.stdout}')
-            raise e
+        clipped: Path = clip_netcdf(
+            file_in=eo_source_input.file.path, file_out=out_file,
+            lat=lat_range, lon=lon_range,
+            variables=['LAI'],
+            layout=get_layout_profile(produced_file.group.name),
+            attrs={'LAI': {
+                'Consolidation_period': rt,
+                'LAI_version': ver}})
 
         content = File(clipped.open('rb'))
         produced_file.file.save(name=produced_file.filename, content=content, save=False)
@@ -322,7 +326,6 @@ def task_s02p02_ndvianom250m(eo_product_pk: int, iso: str):
     input_eo_source_group = produced_file.group.eoproductgroup.pipelines_from_output.get().input_groups.get().eosourcegroup
     input_files_qs = EOSource.objects.filter(group=input_eo_source_group, reference_date=produced_file.reference_date)
 
-    import rasterio
     from rasterio.merge import merge as rio_merge
 
     # noinspection SpellCheckingInspection
@@ -345,58 +348,33 @@ def task_s02p02_ndvianom250m(eo_product_pk: int, iso: str):
             "height": mosaic.shape[1],
             "width": mosaic.shape[2], "transform": out_trans,
             "crs": "+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs",
-            "tiled": True,
-            'compress': 'LZW',
             "dtype": 'uint8',
+            **rasterio_creation_options('GTiff')
         })
         with rasterio.open(outfile, "w", **out_meta) as dest:
             dest.write(mosaic)
 
         return Path(outfile)
 
-    def clip(file_in: Path, file_out_path: Path, shp_file_path: Path) -> Path:
-        # clip using the shapefile ot a netcdf format
+    def clip(file_in: Path, file_out_path: Path, shp_file_path: Path) -> Tuple[Path, List[ZonalAccumulator]]:
+        # clip using the (cached) shapefile mask straight to the final netcdf
+        # the mosaic is already in EPSG:4326, so no warping is needed
         print("\nClipping file: %s" % file_in)
 
-        warp_options = gdal.WarpOptions(
-            cutlineDSName=shp_file_path.as_posix(), cropToCutline=True,
-            dstSRS="EPSG:4326",
-            format='netCDF',
-            dstNodata=255,
-            outputType=gdal.GDT_UInt16, options=['COMPRESS=LZW'])
-        gdal.Warp(
-            srcDSOrSrcDSTab=file_in.as_posix(),
-            destNameOrDestDS=file_out_path.as_posix(),
-            options=warp_options)
-        return Path(file_out_path)
-
-    def add_metadata(file_in: Path, file_out: Path) -> Path:
-        import xarray as xr
-        # Load the dataset
-        ds = xr.open_dataset(file_in)
-
-        # select parameters according to the product.
-        da = ds.Band1
-
-        # Output write
-        try:
-            da.name = 'NDVIA'
-            da.attrs['short_name'] = 'NDVI anomaly'
-            da.attrs['long_name'] = 'Normalized Difference Vegetation Index (NDVI) anomaly'
-            da.attrs['_FillValue'] = 0
-            da.attrs['scale_factor'] = 0.008
-            da.attrs['add_offset'] = -1
-            da.attrs['flag_masks'] = 253, 254, 255
-            da.attrs['flag_meanings'] = "invalid water no_data"
-            da.attrs['valid_range'] = 0, 250  # meaning -1 to 1
-            parameters = dict({'NDVIA': {'dtype': 'f4', 'zlib': 'True', 'complevel': 4}})
-            da.to_netcdf(file_out, encoding=parameters)
-        except Exception as ex:
-            template = "An exception of type {0} occurred while resampling. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logger.error(message)
-            raise AfriCultuReSError(message)
-        return Path(file_out)
+        with rasterio.open(file_in) as src:
+            window = cutline_window(src, shp_file_path, crop=True)
+            # no data (255), in the mosaic or outside of the border, is written as the fill value (0)
+            blocks = ((w, np.where(data == 255, 0, data))
+                      for w, data in iter_masked_windows(src, shp_file_path, nodata=255, crop=True))
+            # the zonal statistics are computed from the blocks on their way to the file
+            zonal = zonal_config(produced_file.group.name) or {}
+            accumulators = group_accumulators(produced_file.group.name, grid_signature(src), ValueSpec(
+                nodata=NDVIA_SPEC.fill_value, scale_factor=NDVIA_SPEC.scale_factor,
+                add_offset=NDVIA_SPEC.add_offset, valid_range=zonal.get('valid_range')), window=window)
+            return write_netcdf_product(
+                file_out_path, tap_blocks(blocks, accumulators), product_spec(NDVIA_SPEC, produced_file.group.name),
+                transform=src.window_transform(window), crs=src.crs,
+                width=int(window.width), height=int(window.height)), accumulators
 
     eo_product = EOProduct.objects.get(pk=eo_product_pk)
     if iso == 'ZAF':
@@ -428,11 +406,13 @@ def task_s02p02_ndvianom250m(eo_product_pk: int, iso: str):
         temp_dir_path = Path(temp_dir)
 
         mosaic_f_path = mosaic_f(input_files_path, temp_dir_path / 'mosaic.tif')
-        clipped_f_path = clip(mosaic_f_path, file_out_path=temp_dir_path / 'clipped.nc', shp_file_path=f_shp_path)
-        final_raster_path = add_metadata(file_in=clipped_f_path, file_out=temp_dir_path / 'final_file.nc')
+        final_raster_path, accumulators = clip(
+            mosaic_f_path, file_out_path=temp_dir_path / 'final_file.nc', shp_file_path=f_shp_path)
 
         content = File(final_raster_path.open('rb'))
         eo_product.file.save(name=eo_product.filename, content=content, save=False)
+        if accumulators:
+            store_zonal_statistics(eo_product, accumulators)
         eo_product.state = EOProductStateChoices.READY
         eo_product.datetime_creation = now
         eo_product.save()
@@ -445,4 +425,5 @@ __all__ = [
     'task_s02p02_vci1km_v2',
     'task_s02p02_lai300m_v1',
     'task_s02p02_ndvianom250m',
+    'task_update_ndvi_lts',
 ]
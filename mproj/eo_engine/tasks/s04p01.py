@@ -8,8 +8,9 @@ from celery.utils.log import get_task_logger
 from django.core.files import File
 from django.utils import timezone
 from osgeo import gdal
-from pymodis.convertmodis_gdal import createMosaicGDAL
 
+from eo_engine.common.gdal_profile import warp_kwargs
+from eo_engine.errors import AfriCultuReSError
 from eo_engine.models import EOProduct, EOSource, EOProductStateChoices
 
 logger: Logger = get_task_logger(__name__)
@@ -17,6 +18,29 @@ logger: Logger = get_task_logger(__name__)
 now = timezone.now()
 
 
+def find_subdataset(hdf_file: Path, name: str) -> str:
+    """ The GDAL name of the subdataset `name` of an HDF4-EOS file,
+     i.e. HDF4_EOS:EOS_GRID:"<path>":MCD12Q1:LC_Type2 """
+    ds = gdal.Open(hdf_file.as_posix())
+    if ds is None:
+        raise AfriCultuReSError(f'Could not open {hdf_file.name}')
+    for subdataset, _description in ds.GetSubDatasets():
+        if subdataset.split(':')[-1] == name:
+            return subdataset
+    raise AfriCultuReSError(f'Subdataset {name} was not found in {hdf_file.name}')
+
+
+def build_subdataset_mosaic(hdf_files: List[Path], subdataset: str, vrt_file: Path) -> Path:
+    """ A VRT mosaic of the subdataset of every file. The nodata of the subdataset is kept. """
+    sources = [find_subdataset(f, subdataset) for f in hdf_files]
+    vrt = gdal.BuildVRT(vrt_file.as_posix(), sources)
+    if vrt is None:
+        raise AfriCultuReSError(f'Could not build the mosaic of {subdataset}')
+    # closing the dataset writes the VRT to disk
+    vrt = None
+    return vrt_file
+
+
 @shared_task
 def task_s04p01_lulc500m(eo_product_pk):
 
@@ -26,34 +50,24 @@ def task_s04p01_lulc500m(eo_product_pk):
 
     files: List[Path] = [Path(f.file.path) for f in input_files_qs]
     logger.info(f'INFO: input files count:  {files.__len__()}')
-    # Create a subset to mosaic only LC_Type2
-    subset = [0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
 
     with TemporaryDirectory('task_s04p01_lulc500m') as temp_dir:
         temp_dir_path = Path(temp_dir)
-        output_file_1 = temp_dir_path / 'output_mosaic.hdf'
+        mosaic_vrt = temp_dir_path / 'output_mosaic.vrt'
         output_file_2 = temp_dir_path / 'output_mosaic.nc'
 
-        logger.info('Creating Mosaic Object')
-        mosaic = createMosaicGDAL(
-            hdfnames=[f.as_posix() for f in files],
-            subset=subset,
-            outformat='HDF4Image')
-
-        logger.info('Create mosaicing image')
-        mosaic.run(output_file_1.as_posix())
-
-        # Define GDAL warp options to transform mosaiced image to netCDF format and reprojected to EPSG:4326
-        # gdal_options = gdal.WarpOptions(
-        #     format='netCDF', dstSRS='EPSG:4326'
-        # )
-        kwargs = {'format': 'netCDF', 'dstSRS': 'EPSG:4326'}
+        # mosaic only LC_Type2. The VRT only references the tiles, nothing is copied
+        logger.info('Creating Mosaic VRT')
+        build_subdataset_mosaic(files, 'LC_Type2', mosaic_vrt)
 
-        # Define input raster for warp
-        input_raster = gdal.Open(output_file_1.as_posix())
+        # warp the mosaic straight to the netCDF product, reprojected to EPSG:4326
+        kwargs = {'format': 'netCDF', 'dstSRS': 'EPSG:4326', **warp_kwargs('netCDF')}
 
         logger.info(f'Running gdal.warp to generate nc output. kwargs are {[f"{k}:{v}" for k, v in kwargs.items()]}')
-        gdal.Warp(output_file_2.as_posix(), input_raster, **kwargs)
+        result = gdal.Warp(output_file_2.as_posix(), mosaic_vrt.as_posix(), **kwargs)
+        if result is None:
+            raise AfriCultuReSError(f'Could not warp {mosaic_vrt.name}')
+        result = None
 
         with output_file_2.open('rb') as file_handler:
             content = File(file_handler)
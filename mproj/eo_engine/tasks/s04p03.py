@@ -1,11 +1,11 @@
-import subprocess
 import tempfile
 from logging import Logger
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import List, Literal, Union, Set, Iterable, Any, NamedTuple, TypeVar
+from typing import List, Literal, Union, Optional, Tuple
 
 import numpy as np
+import rasterio
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
@@ -13,11 +13,16 @@ from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.utils import timezone
 from django.utils.datetime_safe import datetime
-from osgeo import gdal, gdalconst
+from osgeo import gdal
 from rasterio.merge import merge
 
+from eo_engine.common.db_ops import advisory_lock
+from eo_engine.common.gdal_profile import creation_options, warp_kwargs
+from eo_engine.common.layout import product_spec
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+from eo_engine.common.raster import grid_signature, grid_digest
 from eo_engine.errors import AfriCultuReSError
-from eo_engine.models import EOProduct, EOSource, EOProductStateChoices
+from eo_engine.models import EOProduct, EOSource, EOProductStateChoices, PreFloodEvent
 
 logger: Logger = get_task_logger(__name__)
 
@@ -26,7 +31,14 @@ now = timezone.now()
 AUGUST = 8
 FLOOD_PRE_EVENT_MIN_DATE_INCLUSIVE = 14
 FLOOD_PRE_EVENT_MAX_DATE_INCLUSIVE = 16
-DateFilename = NamedTuple('DateFilename', [('date', datetime.date), ('filepath', Path)])
+
+FLOOD_SPEC = VariableSpec(
+    name='Flood',
+    fill_value=1,
+    attrs={
+        'short_name': 'Flood_MR',
+        'long_name': 'Flood_map_at_medium_resolution'
+    })
 
 
 def get_prevent_dir() -> Path:
@@ -53,27 +65,16 @@ def task_s04p03_convert_to_tiff(eo_product_pk: int, tile: int):
     eo_product.state = EOProductStateChoices.GENERATING
     eo_product.save()
 
-    with NamedTemporaryFile('wb') as file_handle:
-        ds = gdal.Open(eo_source.file.path)
-
-        optionsNC2 = gdal.TranslateOptions(
-            format='netCDF',
-            # using gdalconst.GDT_Unknown was the only way to avoid
-            # conversion to float and keep file size reasonable
-            outputType=gdalconst.GDT_Unknown,
-            noData=int(1), options=['COMPRESS=LZW'],
-            outputSRS="EPSG:4326")  # 1 is the nodata value
-        gdal.Translate(srcDS=ds, destName=file_handle.name, options=optionsNC2)
-
-        subprocess.run(['ncrename',
-                        '-v', 'Band1,Flood',
-                        file_handle.name], check=True)
-        subprocess.run(['ncatted',
-                        '-a', 'short_name,Flood,o,c,Flood_MR',
-                        '-a', "long_name,Flood,o,c,Flood map at medium resolution",
-                        '-a', "tile_number,Flood,o,c," + str(tile),
-                        '-a', "_FillValue,Flood,o,i,1",
-                        file_handle.name], check=True)
+    with NamedTemporaryFile('wb') as file_handle, \
+            rasterio.open(eo_source.file.path) as src:
+        # keep the data type of the input, a float conversion would make the files much larger
+        write_netcdf_product(
+            Path(file_handle.name), src.read(1), product_spec(FLOOD_SPEC._replace(attrs={
+                'short_name': 'Flood_MR',
+                'long_name': 'Flood map at medium resolution',
+                'tile_number': str(tile)
+            }), eo_product.group.name),
+            transform=src.transform, crs='EPSG:4326')
 
         content = File(file_handle)
         eo_product.file.save(name=eo_product.filename, content=content, save=False)
@@ -89,29 +90,15 @@ def task_s04p03_floods375m(eo_product_pk: int):
     input_files_qs = EOSource.objects.filter(group=input_eo_source_group, reference_date=eo_product.reference_date)
 
     with TemporaryDirectory() as temp_dir:
-        temp_dir_path = Path(temp_dir)
-        dst_path = temp_dir_path / 'mosaic.tif'
         out_nc = Path(temp_dir) / 'out.nc'
 
         datasets: List[Path] = list(map(Path, [x.file.path for x in input_files_qs]))
 
-        merge(datasets=datasets, dst_path=dst_path, nodata=0)
-
-        print('translating')
-        subprocess.run([
-            'gdal_translate',
-            '-of', 'netCDF',
-            dst_path.as_posix(),
-            out_nc.as_posix()
-        ], check=True)
-        subprocess.run(['ncrename',
-                        '-v', 'Band1,Flood',
-                        out_nc.as_posix()], check=True)
-        subprocess.run(['ncatted',
-                        '-a', 'short_name,Flood,o,c,Flood_MR',
-                        '-a', "long_name,Flood,o,c,Flood_map_at_medium_resolution",
-                        '-a', "_FillValue,Flood,o,i,1",
-                        out_nc.as_posix()], check=True)
+        mosaic, transform = merge(datasets=datasets, nodata=0)
+
+        logger.info('Writing netCDF')
+        write_netcdf_product(out_nc, mosaic, product_spec(FLOOD_SPEC, eo_product.group.name),
+                             transform=transform, crs='EPSG:4326')
 
         content = File(out_nc.open('rb'))
         eo_product.file.save(name=eo_product.filename, content=content, save=False)
@@ -152,7 +139,7 @@ def coreg_file(
         format="Gtiff",
         dstSRS="EPSG:4326",
         outputBounds=(aoi_bbox[0], aoi_bbox[3], aoi_bbox[2], aoi_bbox[1]),
-        options=['COMPRESS=LZW'],
+        **warp_kwargs('GTiff')
     )
     if template_raster:
         template_raster_ds: gdal.Dataset = gdal.Open(template_raster)
@@ -170,55 +157,73 @@ def coreg_file(
     return
 
 
-def filter_pre_event_files(x: Set[DateFilename],
-                           from_date_inclusive: datetime.date,
-                           to_date_inclusive: datetime.date) -> List[DateFilename]:
-    filtered = [e for e in x if from_date_inclusive <= e.date <= to_date_inclusive]
-    filtered = sorted(filtered, key=lambda e: e.date)
-    return filtered
+def pre_event_date_range(year: int) -> Tuple[datetime.date, datetime.date]:
+    from_date_inclusive = datetime(year, AUGUST, FLOOD_PRE_EVENT_MIN_DATE_INCLUSIVE).date()
+    to_date_inclusive = datetime(year, AUGUST, FLOOD_PRE_EVENT_MAX_DATE_INCLUSIVE).date()
+    return from_date_inclusive, to_date_inclusive
+
+
+def register_pre_flood_event_file(file_path: Path, aoi: str, date: datetime.date,
+                                  eo_product: Optional[EOProduct] = None) -> PreFloodEvent:
+    """ Adds a pre-event raster to the index """
+    with rasterio.open(file_path) as src:
+        signature = grid_digest(grid_signature(src))
+    record, _ = PreFloodEvent.objects.update_or_create(
+        path=file_path.as_posix(),
+        defaults={'aoi': aoi, 'year': date.year, 'date': date,
+                  'grid_signature': signature, 'eo_product': eo_product})
+    return record
+
+
+def index_pre_flood_event_archive(year: int, aoi: str) -> int:
+    """ Adds the pre-event rasters of year that are in the archive dir but not in the index
+    (i.e. made before the index existed). Returns how many were added. """
+    known = set(PreFloodEvent.objects.filter(aoi=aoi, year=year).values_list('path', flat=True))
+    added = 0
+    for file_path in get_prevent_dir().glob(f'{year}*.tif'):
+        if file_path.as_posix() in known:
+            continue
+        register_pre_flood_event_file(file_path, aoi=aoi, date=BAG_FILENAME_TO_DATE(file_path.name))
+        added += 1
+    return added
+
+
+def find_pre_flood_event_file(year: int, aoi: str) -> Optional[Path]:
+    """ The earliest indexed pre-event raster of year, if any. Index rows of deleted files are dropped. """
+    from_date_inclusive, to_date_inclusive = pre_event_date_range(year)
+    qs = PreFloodEvent.objects.filter(
+        aoi=aoi, year=year,
+        date__gte=from_date_inclusive,
+        date__lte=to_date_inclusive).order_by('date')
+    for record in qs:
+        file_path = Path(record.path)
+        if file_path.exists():
+            logger.info(f'found pre-event file: {file_path.name} ({record.date})')
+            return file_path
+        logger.warning(f'pre-event file {file_path.name} is missing, removing it from the index')
+        record.delete()
+    return None
 
 
 def get_pre_flood_event_file(year: int, aoi: str) -> Path:
-    files: Set[DateFilename] = set()
-    from_date_inclusive = datetime(
-        year,
-        AUGUST,
-        FLOOD_PRE_EVENT_MIN_DATE_INCLUSIVE
-    ).date()
-
-    to_date_inclusive = datetime(
-        year,
-        AUGUST,
-        FLOOD_PRE_EVENT_MAX_DATE_INCLUSIVE
-    ).date()
-
-    prevent_dir = get_prevent_dir()
-    for file_path in prevent_dir.glob(f'{year}*.tif'):
-        files.add(
-            DateFilename(
-                date=BAG_FILENAME_TO_DATE(file_path.name),
-                filepath=file_path)
-        )
+    file_path = find_pre_flood_event_file(year, aoi)
+    if file_path is not None:
+        return file_path
 
-    files_filtered = filter_pre_event_files(
-        files,
-        from_date_inclusive=from_date_inclusive,
-        to_date_inclusive=to_date_inclusive
-    )
+    # only one worker makes the pre-event file of a year, the others wait and then use it
+    with advisory_lock(f'pre_flood_event:{aoi}:{year}'):
+        file_path = find_pre_flood_event_file(year, aoi)
+        if file_path is not None:
+            return file_path
 
-    if files_filtered:
-        record = files_filtered[0]
-        date = record.date
-        file_path = record.filepath
-        msg = f'found pre-event file: {file_path.name} ({date})'
-        logger.info(msg)
-        return file_path
+        if index_pre_flood_event_archive(year, aoi):
+            file_path = find_pre_flood_event_file(year, aoi)
+            if file_path is not None:
+                return file_path
 
-    # we don't have a pre-event file ready
-    else:
+        # we don't have a pre-event file ready
         logger.info('no prevent file found, attempting to make one')
         from eo_engine.models.eo_group import EOProductGroupChoices, EOProductGroup
-        from eo_engine.models.eo_product import EOProduct, EOProductStateChoices
 
         if aoi == 'BAG':
             group = EOProductGroup.objects.get(name=EOProductGroupChoices.S06P01_WB_10M_BAG)
@@ -226,31 +231,31 @@ def get_pre_flood_event_file(year: int, aoi: str) -> Path:
         else:
             raise AfriCultuReSError(f'no configuration  for this AOI: {aoi}')
 
-        bag_year_event_qs = EOProduct.objects.filter(
+        from_date_inclusive, to_date_inclusive = pre_event_date_range(year)
+        bag_year_event = EOProduct.objects.filter(
             reference_date__gte=from_date_inclusive,
             reference_date__lte=to_date_inclusive,
             group=group,
             state=EOProductStateChoices.READY
-        ).order_by('reference_date')
-
-        if bag_year_event_qs.exists():
-
-            bag_year_event = bag_year_event_qs.first()
-            msg = f' BAG Product chosen as pre-event: {bag_year_event}'
-            logger.info(msg)
-            prevent_dir = get_prevent_dir()
-            preevent_file_in: Path = Path(bag_year_event.file.path)
-            preevent_file_out: Path = prevent_dir / (preevent_file_in.stem + '_pre.tif')
-            coreg_file(
-                file_in=preevent_file_in.as_posix(),
-                file_out=preevent_file_out.as_posix(),
-                aoi_bbox=aoi_bbox
-            )
-
-            return get_pre_flood_event_file(year=year, aoi=aoi)
-        else:
-            'No valid BAG products exist in the system.'
-            raise Exception('Non suitable file found')
+        ).order_by('reference_date').first()
+
+        if bag_year_event is None:
+            logger.error(f'No valid BAG products exist in the system between {from_date_inclusive} '
+                         f'and {to_date_inclusive}.')
+            raise AfriCultuReSError('Non suitable file found')
+
+        msg = f' BAG Product chosen as pre-event: {bag_year_event}'
+        logger.info(msg)
+        preevent_file_in: Path = Path(bag_year_event.file.path)
+        preevent_file_out: Path = get_prevent_dir() / (preevent_file_in.stem + '_pre.tif')
+        coreg_file(
+            file_in=preevent_file_in.as_posix(),
+            file_out=preevent_file_out.as_posix(),
+            aoi_bbox=aoi_bbox
+        )
+        register_pre_flood_event_file(preevent_file_out, aoi=aoi, date=bag_year_event.reference_date,
+                                      eo_product=bag_year_event)
+        return preevent_file_out
 
 
 @shared_task
@@ -290,7 +295,7 @@ def task_s04p03_floods10m(eo_product_pk: int, aoi: Literal['BAG', 'KZN']):
                 pre.shape[1],
                 pre.shape[0], 1,
                 gdal.GDT_UInt16,
-                ['COMPRESS=LZW'])
+                creation_options('GTiff'))
             ds_out.SetProjection(pre_band.GetProjection())
             ds_out.SetGeoTransform(pre_band.GetGeoTransform())
             ds_out.GetRasterBand(1).SetNoDataValue(11)
@@ -1,15 +1,12 @@
 import datetime
 import os
 import subprocess
-from datetime import date as dt_date
 from logging import Logger
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import NamedTuple, Optional, List, Literal
 
 import numpy as np
-import pandas
-import snappy
 from celery import shared_task
 from celery.utils.log import get_task_logger
 from django.conf import settings
@@ -17,9 +14,14 @@ from django.core.files import File
 from django.db import connections
 from django.utils import timezone
 from osgeo import gdal
-from snappy import ProductIO, GPF, WKTReader
 
+from eo_engine.common.gdal_profile import creation_options, rasterio_creation_options, warp_kwargs
+from eo_engine.common.layout import get_layout_profile
+from eo_engine.common.masks import clip_to_cutline
 from eo_engine.common.misc import write_line_to_file
+from eo_engine.common.netcdf import clip_netcdf
+from eo_engine.common.orbit_thresholds import OrbitThresholdStore
+from eo_engine.common.snap import java_type, load_operator_spis
 from eo_engine.common.verify import check_file_exists
 from eo_engine.errors import AfriCultuReSError
 from eo_engine.models import EOProduct, EOSource, EOProductStateChoices
@@ -44,10 +46,6 @@ WB10mParams = NamedTuple('Params', [
     ('reference_date', datetime.date)
 ])
 
-OrbitLine = NamedTuple('OrbitLine', [
-    ('date', str), ('threshold', float), ('relative_orbit', int)
-])
-
 
 def WB10mParamsFactory(reference_date: datetime.date, version: Literal['kzn', 'bag']) -> WB10mParams:
     if version.lower() not in ['kzn', 'bag']:
@@ -104,7 +102,9 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
 
     check_file_exists(file_path=params.boundary_shapefile)
     check_file_exists(file_path=params.hand_file_tif_path)
-    check_file_exists(file_path=params.orbits_threshold_csv_file_path)
+    # the csv is only read once per AOI, to seed the database
+    threshold_store = OrbitThresholdStore(aoi=version.upper(),
+                                          legacy_csv_file_path=params.orbits_threshold_csv_file_path)
     # add the sentinel zip files
     obj: EOProduct
     for obj in input_files_qs:
@@ -113,8 +113,6 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
         del _obj_path
 
     def _process(output_folder: Path) -> Path:
-        import csv
-
         date_str = params.reference_date.strftime('%Y%m%d')
 
         def get_relative_orbit_from_scihub(
@@ -130,7 +128,7 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
             products = api.query(
                 platformname='Sentinel-1',
                 identifier=identifier)
-            products_df: pandas.DataFrame = api.to_dataframe(products)
+            products_df = api.to_dataframe(products)
             return products_df.relativeorbitnumber.values[0]
 
         def filename_to_date(
@@ -142,45 +140,15 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
             date: datetime.datetime = datetime.datetime.strptime(part[0:8], '%Y%m%d')
             return date.date()
 
-        def write_to_orbit_thesholds_file(
-                orbit_csv_file_path: Path,
-                orbit_line_data: OrbitLine):
-
-            with orbit_csv_file_path.open('a') as csv_file:
-                headers = ['date', 'threshold', 'relative_orbit']
-                writer = csv.DictWriter(csv_file, delimiter=',', fieldnames=headers)
-                if not orbit_csv_file_path.exists():
-                    # file does not exist, write headers
-                    writer.writeheader()
-                writer.writerow(orbit_line_data._asdict())
-            return
-
-        def read_orbit_threholds_csv(
-                params_txt_path: Path,
+        def read_orbit_threshold(
                 relative_orbit: int,
-                reference_date: dt_date,
-                max_threshold: float) -> (int, str):
-
-            """ Function to read the last threshold found for the same relative orbit"""
-
-            dtype = {
-                'date': str,
-                'threshold': float,
-                'relative_orbit': int
-            }
-            dataframe = pandas.read_csv(params_txt_path, dtype=dtype, parse_dates=['date'])
-
-            records: pandas.DataFrame = dataframe.query('relative_orbit == @relative_orbit')
-            # Go through all lines with specific orbit, last record will be the newest one
-            if records.empty:
+                max_threshold: float) -> (float, str):
+            """ The last threshold found for the same relative orbit """
+            record = threshold_store.latest(int(relative_orbit))
+            if record is None:
                 return max_threshold, ""
-            else:
-                sorted_records = records.sort_values('date', ascending=False)
-                # return latest
-                threshold = sorted_records['threshold'].values[0]
-                latest_day = sorted_records['date'].values[0]
-                txt = f'Threshold found for relative orbit={relative_orbit}, date={str(latest_day)}, threshold={threshold}'
-                return threshold, txt
+            txt = f'Threshold found for relative orbit={relative_orbit}, date={record.date}, threshold={record.threshold}'
+            return record.threshold, txt
 
         def thresh_process(
                 sigma_db: Path,
@@ -248,10 +216,8 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
                 write_line_to_file(file_path=log_file, token='water threshold NOT found!', echo=True)
                 # txtout.write('\nWater threshold NOT found!')
                 # Get threshold from saved text file
-                threshold, report = read_orbit_threholds_csv(
-                    params.orbits_threshold_csv_file_path,
+                threshold, report = read_orbit_threshold(
                     relative_orbit=relative_orbit,
-                    reference_date=date,
                     max_threshold=_constant_max_thresh)
                 if threshold >= float(_constant_max_thresh):  # default threshold used
                     write_line_to_file(file_path=log_file, token='Default water threshold used!', echo=True)
@@ -263,10 +229,9 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
             else:
 
                 write_line_to_file(file_path=log_file,
-                                   token='Water threshold found!. Appending it to file',
+                                   token='Water threshold found!. Storing it',
                                    echo=True)
-                orbit_line = OrbitLine(date=str(date), threshold=threshold, relative_orbit=relative_orbit)
-                write_to_orbit_thesholds_file(params.orbits_threshold_csv_file_path, orbit_line)
+                threshold_store.add(int(relative_orbit), date, float(threshold))
             write_line_to_file(file_path=log_file, token=f"Threshold is:{threshold}", echo=True)
 
             # Apply threshold value to raster
@@ -327,7 +292,8 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
                 format="Gtiff",
                 dstSRS="EPSG:4326",
                 outputBounds=(minX, minY, maxX, maxY),
-                width=ds_in.RasterXSize, height=ds_in.RasterYSize)
+                width=ds_in.RasterXSize, height=ds_in.RasterYSize,
+                **warp_kwargs('GTiff'))
             try:
                 gdal.Warp(
                     destNameOrDestDS=temp_hand_file.as_posix(),
@@ -384,7 +350,7 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
                         water.shape[1],
                         water.shape[0], 1,
                         gdal.GDT_Byte,
-                        ['COMPRESS=LZW'])  # GDT_UInt16
+                        creation_options('GTiff'))  # GDT_UInt16
                     ds_out.SetProjection(water_band.GetProjection())
                     ds_out.SetGeoTransform(water_band.GetGeoTransform())
                     ds_out.GetRasterBand(1).SetNoDataValue(11)
@@ -516,15 +482,10 @@ def s06p01_wb10m(eo_product_pk: int, version: Literal['kzn', 'bag']):
                    output_file=temp_file
                    )
 
-            print('cutting/warping')
+            print('cutting')
             final_output = output_folder / f'{date_str}_SE1_KZN_0010m_0006_WBMA.tif'
-            subprocess.run(
-                ['gdalwarp',
-                 '-cutline', params.boundary_shapefile.as_posix(),
-                 '-co', 'COMPRESS=LZW',
-                 temp_file.as_posix(),
-                 final_output.as_posix()
-                 ], check=True)
+            clip_to_cutline(temp_file, final_output, shapefile=params.boundary_shapefile,
+                            **rasterio_creation_options('GTiff', group_name=eo_product.group.name))
 
             return final_output
 
@@ -551,9 +512,12 @@ def task_s06p01_wb100m(eo_product_pk: int, aoi_wkt: str):
     input_file = input_files_qs.get()
     # any of the above eo_product, should point to the same eo_source
 
-    HashMap = snappy.jpy.get_type('java.util.HashMap')
-    # Get snappy Operators
-    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+    # snappy starts the JVM on import, only the SNAP tasks import it
+    from snappy import ProductIO, GPF, WKTReader
+
+    HashMap = java_type('java.util.HashMap')
+    # Get snappy Operators (once per process)
+    load_operator_spis()
 
     def clip(data, file_in: Path, dir_out, geom):
         params = HashMap()
@@ -606,22 +570,14 @@ def task_s06p01_wb300m_v2(eo_product_pk: int):
     input_file = input_files_qs.get()
 
     # fixed parameters
-    geom = [8000, 40000, 60000, 95999] #geom = [16904, 46189, 64166, 93689]
+    # lat/lon index ranges (inclusive) of Africa in the global 300m grid
+    lat_range, lon_range = (8000, 40000), (60000, 95999)  # geom = [16904, 46189, 64166, 93689]
     date = input_file.filename.split('_')[3][:8]
     f_out = date + '_SE2_AFR_0300m_0030_WBMA.nc'
 
-    def clip(file_in, file_out, geom) -> Path:
-        lat_str = "lat," + str(geom[0]) + "," + str(geom[1])
-        lon_str = "lon," + str(geom[2]) + "," + str(geom[3])
-        subprocess.run(['ncks',
-                        '-d', lat_str,
-                        '-d', lon_str,
-                        file_in,
-                        file_out], check=True)
-        return Path(file_out)
-
     with TemporaryDirectory(prefix='task_s06p01_clip_to_africa_') as temp_dir:
-        clipped = clip(input_file.file.path, Path(temp_dir).joinpath(f_out), geom)
+        clipped = clip_netcdf(input_file.file.path, Path(temp_dir).joinpath(f_out), lat=lat_range, lon=lon_range,
+                              layout=get_layout_profile(eo_product.group.name))
 
         content = File(clipped.open('rb'))
         eo_product.file.save(name=eo_product.filename, content=content, save=False)
@@ -1,5 +1,4 @@
 import bz2
-import subprocess
 from logging import Logger
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -14,6 +13,11 @@ from django.core.files.temp import NamedTemporaryFile
 from django.utils import timezone
 
 from eo_engine.common.contrib.h5georef import H5Georef
+from eo_engine.common.gdal_profile import rasterio_creation_options
+from eo_engine.common.layout import product_spec
+from eo_engine.common.masks import clip_to_netcdf
+from eo_engine.common.netcdf import VariableSpec, raster_to_netcdf
+from eo_engine.common.raster import warped_vrt
 from eo_engine.common.verify import check_file_exists
 from eo_engine.errors import AfriCultuReSError
 from eo_engine.models import EOProduct, EOSource, EOProductStateChoices, EOSourceGroup, EOSourceGroupChoices
@@ -54,20 +58,17 @@ def task_s06p04_et3km(eo_product_pk: int):
 
             if warped_file != -1:
                 logger.info("\nConverting to netcdf...")
-                # file_nc = "" + outDirName + "/" + file[5:-8] + ".nc"
-                netcdf_file = h5g.to_netcdf(Path(final_file.name))
-        try:
-            cp = subprocess.run(['ncatted',
-                                 '-a', 'short_name,Band1,o,c,Daily_ET',
-                                 '-a', "long_name,Band1,o,c,Daily_Evapotranspiration_3km",
-                                 '-a', "units,Band1,o,c,[mm/day]",
-                                 #  '-a', "scale_factor,Band1,o,d,1000", # if enabled the scale_factor is applied twice reading the netcdf file
-                                 #  '-a', "add_offset,Band1,o,d,0",
-                                 '-a', "missing_value,Band1,o,d,-0.001",
-                                 '-a', "_FillValue,Band1,o,d,-0.001",
-                                 final_file.name], check=True)
-        except BaseException as e:
-            raise e
+                # scale_factor/add_offset are not set; the values are already in mm/day
+                with rasterio.open(warped_file) as src:
+                    raster_to_netcdf(src, Path(final_file.name), spec=product_spec(VariableSpec(
+                        name='Band1',
+                        fill_value=-0.001,
+                        attrs={
+                            'short_name': 'Daily_ET',
+                            'long_name': 'Daily_Evapotranspiration_3km',
+                            'units': '[mm/day]',
+                            'missing_value': -0.001
+                        }), eo_product.group.name))
 
         content = File(final_file)
         eo_product.file.save(name=eo_product.filename, content=content, save=False)
@@ -81,8 +82,8 @@ def task_s06p04_etanom5km(eo_product_pk: int):
     """
     # Description of task:
     The task consists in clipping the ET anomaly file(SSEBop v5) to Africa and changing the metadata.
-    Clipping is done with GDAL warp as proposed by Nikos.
-    Metadata is edited using NCO as proposed by Nikos.
+    Clipping is done with an (in-process) GDAL warp as proposed by Nikos.
+    The metadata are written together with the data.
 
     # Data download
     The dataset is available here for v5:
@@ -105,16 +106,17 @@ def task_s06p04_etanom5km(eo_product_pk: int):
     eo_source_input: EOSource = input_files_qs.get()
 
     def clip(file_in: Path, file_out: Path):
-        logger.info('Clip the file using GDAL')
+        logger.info('Clip the file and write the netCDF')
         target_resolution = 0.009651999920606611424
-        xmin, ymin, xmax, ymax = -20.0084493160248371, -38.0030921809375428, 55.0068940669297461, 40.0043711774050763
-        subprocess.run([
-            'gdalwarp',
-            '-r', 'average', '-overwrite',
-            '-tr', f'{target_resolution}', f'{target_resolution}',
-            '-te', f'{xmin}', f'{ymin}', f'{xmax}', f'{ymax}',
-            file_in.as_posix(), file_out.as_posix()],
-            check=True)
+        bounds = -20.0084493160248371, -38.0030921809375428, 55.0068940669297461, 40.0043711774050763
+        with rasterio.open(file_in) as src, \
+                warped_vrt(src, bounds, target_resolution, resampling='average') as vrt:
+            raster_to_netcdf(vrt, file_out, spec=product_spec(VariableSpec(
+                name='ETanom',
+                attrs={
+                    'long_name': 'Monthly_Evapotranspiration_Anomaly',
+                    'Unit': '[%]'
+                }), eo_product.group.name))
 
     with TemporaryDirectory() as temp_dir, \
             ZipFile(eo_source_input.file.path) as zip_file:
@@ -127,13 +129,6 @@ def task_s06p04_etanom5km(eo_product_pk: int):
         f_new_nc = temp_dir_path / 'temp_out.nc'
 
         clip(f_new_tif, f_new_nc)
-        subprocess.run(['ncrename',
-                        '-v', 'Band1,ETanom',
-                        f_new_nc], check=True)
-        subprocess.run(['ncatted',
-                        '-a', "long_name,ETanom,o,c,Monthly_Evapotranspiration_Anomaly",
-                        '-a', "Unit,ETanom,o,c,[%]",
-                        f_new_nc], check=True)
 
         with open(f_new_nc, 'rb') as file_handler:
             content = File(file_handler)
@@ -206,8 +201,8 @@ def task_s06p04_et250m(eo_product_pk: int, iso: str):
             logger.info('Writing output file....')
             with rasterio.open(
                     file_out_path, 'w',
-                    compress='lzw',
-                    **et_meta) as file:
+                    **et_meta,
+                    **rasterio_creation_options('GTiff')) as file:
                 file.write(et_ql, 1)
 
     file_in_path_et = Path(et_file.file.path)
@@ -223,46 +218,15 @@ def task_s06p04_et250m(eo_product_pk: int, iso: str):
         temp_dir_path = Path(temp_dir)
 
         file1_tif = temp_dir_path / 'out1.tif'
-        file2_tif = temp_dir_path / 'out2.tif'
-        file3_nc = temp_dir_path / 'out3.nc'
-        file3_final_nc = temp_dir_path / 'final.nc'
+        file_final_nc = temp_dir_path / 'final.nc'
 
         get_aeti_qual(
             file_in_path_et=file_in_path_et, file_in_path_lst=file_in_path_lst,
             file_in_path_ndvi=file_in_path_ndvi, file_out_path=file1_tif)
 
-        logger.info('cutting/warping')
-        subprocess.run(
-            ['gdalwarp',
-             '-cutline', africa_borders_buff10km.as_posix(),
-             '-co', 'COMPRESS=LZW',
-             file1_tif.as_posix(),
-             file2_tif.as_posix()], check=True)
-
-        logger.info('translating')
-        subprocess.run([
-            'gdal_translate',
-            '-of', 'netCDF',
-            file2_tif.as_posix(),
-            file3_nc.as_posix()
-        ], check=True)
-
-        logger.info('Running NCCopy')
-        subprocess.run([
-            'nccopy',
-            '-k', 'nc4',
-            '-d8',
-            file3_nc.as_posix(),
-            file3_final_nc.as_posix()
-        ], check=True)
-
-        logger.info(f'Running ncatted for Metadata editing:{file3_final_nc.name},')
-        logger.info(f'File: {file3_final_nc.name}, exists: {file3_final_nc.exists()}')
-        subprocess.run([
-            'ncatted',
-            '-a', "scale_factor,Band1,o,d,0.1",
-            file3_final_nc.as_posix()
-        ], check=True)
+        logger.info('Cutting and writing netCDF')
+        clip_to_netcdf(file1_tif, file_final_nc, shapefile=africa_borders_buff10km,
+                       spec=product_spec(VariableSpec(name='Band1', scale_factor=0.1), eo_product.group.name))
 
         with open((Path(temp_dir) / 'final.nc').as_posix(), 'rb') as file_handler:
             content = File(file_handler)
@@ -341,7 +305,7 @@ def task_s06p04_et100m(eo_product_pk: int, iso: str):
             )
 
             print('Writing output file....')
-            with rasterio.open(file_out_path, 'w', compress='lzw', **et_meta) as file:
+            with rasterio.open(file_out_path, 'w', **et_meta, **rasterio_creation_options('GTiff')) as file:
                 file.write(et_ql, 1)
 
     file_in_path_et = Path(et_file.file.path)
@@ -351,25 +315,10 @@ def task_s06p04_et100m(eo_product_pk: int, iso: str):
         get_aeti_qual(file_in_path_et=file_in_path_et, file_in_path_lst=file_in_path_lst,
                       file_in_path_ndvi=file_in_path_ndvi, file_out_path=Path(temp_dir) / 'out1.tif')
 
-        logger.info('Cutting/Warping')
-        subprocess.run(['gdalwarp',
-                        '-cutline', border_shp.as_posix(),
-                        '-co', 'COMPRESS=LZW',
-                        (Path(temp_dir) / 'out1.tif').as_posix(),
-                        (Path(temp_dir) / 'out2.tif').as_posix()], check=True)
-
-        logger.info('Translating')
-        subprocess.run([
-            'gdal_translate',
-            '-of', 'netCDF',
-            (Path(temp_dir) / 'out2.tif').as_posix(),
-            (Path(temp_dir) / 'final.nc').as_posix()], check=True)
-
-        # set outfile metadata
-        logger.info('Adding Metadata')
-        cp = subprocess.run(['ncatted',
-                             '-a', "scale_factor,Band1,o,d,0.1",
-                             (Path(temp_dir) / 'final.nc').as_posix()], check=True)
+        logger.info('Cutting and writing netCDF')
+        clip_to_netcdf(Path(temp_dir) / 'out1.tif', Path(temp_dir) / 'final.nc', shapefile=border_shp,
+                       spec=product_spec(VariableSpec(name='Band1', scale_factor=0.1), eo_product.group.name))
+
         with open((Path(temp_dir) / 'final.nc').as_posix(), 'rb') as file_handler:
             content = File(file_handler)
             eo_product.file.save(name=eo_product.filename, content=content, save=False)
@@ -0,0 +1,30 @@
+from logging import Logger
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from eo_engine.common.zonal import compute_zonal_statistics, zonal_statistics_are_current
+from eo_engine.models import EOProduct, EOProductStateChoices
+
+logger: Logger = get_task_logger(__name__)
+
+
+@shared_task
+def task_zonal_statistics(eo_product_pk: int, force: bool = False):
+    """ Computes the zonal statistics of a READY product. Skipped if they are newer than the product file
+    (e.g. when the producing task computed them from its in-memory blocks). """
+    eo_product = EOProduct.objects.get(pk=eo_product_pk)
+    if eo_product.state != EOProductStateChoices.READY or not eo_product.file:
+        logger.warning(f'{eo_product} is not READY, no zonal statistics')
+        return 0
+    if not force and zonal_statistics_are_current(eo_product):
+        logger.info(f'The zonal statistics of {eo_product} are up to date')
+        return 0
+    rows = compute_zonal_statistics(eo_product)
+    logger.info(f'Stored {rows} zonal statistics of {eo_product}')
+    return rows
+
+
+__all__ = [
+    'task_zonal_statistics'
+]
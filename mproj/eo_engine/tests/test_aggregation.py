@@ -0,0 +1,156 @@
+import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import netCDF4
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from rasterio.transform import from_origin
+
+from eo_engine.common.aggregation import (
+    aggregation_spec,
+    fold_product,
+    folded_dates,
+    period_dekads,
+    period_of,
+    write_aggregation
+)
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, EOProductGroup, EOProductStateChoices, Pipeline
+from eo_engine.tasks.aggregation import task_fold_temporal_aggregation
+
+
+class TestPeriods(SimpleTestCase):
+
+    def test_month(self):
+        period = period_of(datetime.date(2021, 2, 21), 'month')
+        self.assertEqual(period.name, '202102')
+        self.assertEqual((period.start, period.end), (datetime.date(2021, 2, 1), datetime.date(2021, 2, 28)))
+        self.assertEqual(period_dekads(period), [datetime.date(2021, 2, d) for d in (1, 11, 21)])
+
+    def test_season_crosses_the_year(self):
+        period = period_of(datetime.date(2021, 1, 11), 'season')
+        self.assertEqual(period.name, '2020DJF')
+        self.assertEqual((period.start, period.end), (datetime.date(2020, 12, 1), datetime.date(2021, 2, 28)))
+        self.assertEqual(len(period_dekads(period)), 9)
+
+    def test_unknown_statistic(self):
+        with self.assertRaises(AfriCultuReSError):
+            aggregation_spec(statistic='median')
+
+
+class TestFoldAndWrite(TestCase):
+    # 251 is out of the valid range, 255 is the nodata of the inputs
+    inputs = {
+        datetime.date(2021, 1, 1): np.array([[10, 200], [251, 255]], dtype='uint8'),
+        datetime.date(2021, 1, 11): np.array([[30, 100], [50, 255]], dtype='uint8')
+    }
+
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.acc_path = self.root / 'accumulators' / '20210101.nc'
+        self.spec = aggregation_spec(variable='NDVI', valid_range=(0, 250))
+
+        input_spec = VariableSpec(name='NDVI', dtype='uint8', fill_value=255)
+        self.products = {
+            reference_date: write_netcdf_product(self.root / f'ndvi_{reference_date:%Y%m%d}.nc', data, input_spec,
+                                                 transform=from_origin(0, 2, 1, 1))
+            for reference_date, data in self.inputs.items()}
+        for reference_date, product in self.products.items():
+            self.assertTrue(fold_product(self.acc_path, product, reference_date, self.spec, rows=1))
+
+    def test_fold(self):
+        # already folded
+        first = datetime.date(2021, 1, 1)
+        self.assertFalse(fold_product(self.acc_path, self.products[first], first, self.spec))
+        self.assertEqual(folded_dates(self.acc_path), ['2021-01-01', '2021-01-11'])
+
+        with netCDF4.Dataset(self.acc_path) as acc:
+            acc.set_auto_maskandscale(False)
+            np.testing.assert_array_equal(acc.variables['count'][:], [[2, 2], [1, 0]])
+            np.testing.assert_array_equal(acc.variables['sum'][:], [[40, 300], [50, 0]])
+            np.testing.assert_array_equal(acc.variables['min'][:], [[10, 100], [50, np.nan]])
+            np.testing.assert_array_equal(acc.variables['max'][:], [[30, 200], [50, np.nan]])
+
+    def test_fold_other_grid(self):
+        other = write_netcdf_product(self.root / 'other.nc', np.zeros((3, 2), dtype='uint8'),
+                                     VariableSpec(name='NDVI', dtype='uint8', fill_value=255),
+                                     transform=from_origin(0, 3, 1, 1))
+        with self.assertRaises(AfriCultuReSError):
+            fold_product(self.acc_path, other, datetime.date(2021, 1, 21), self.spec)
+        # the accumulator is untouched
+        self.assertEqual(folded_dates(self.acc_path), ['2021-01-01', '2021-01-11'])
+
+    def written(self, **kwargs) -> netCDF4.Dataset:
+        spec = aggregation_spec(variable='NDVI', **kwargs)
+        file_out = write_aggregation(self.acc_path, self.root / f'{spec.statistic}_{spec.dtype}.nc', spec, 'OUTPUT')
+        ds = netCDF4.Dataset(file_out)
+        self.addCleanup(ds.close)
+        ds.set_auto_maskandscale(False)
+        return ds
+
+    def test_write(self):
+        # the products are stored south to north; the pixel without values is the fill value
+        expected = {'mean': [[20, 150], [50, -9999]],
+                    'min': [[10, 100], [50, -9999]],
+                    'max': [[30, 200], [50, -9999]],
+                    'count': [[2, 2], [1, -9999]]}
+        for statistic, values in expected.items():
+            with self.subTest(statistic=statistic):
+                ds = self.written(statistic=statistic)
+                np.testing.assert_array_equal(ds.variables['NDVI'][:][::-1], values)
+                self.assertEqual(ds.variables['NDVI']._FillValue, -9999)
+                self.assertEqual(ds.getncattr('reference_dates'), '2021-01-01,2021-01-11')
+
+    def test_write_packed(self):
+        ds = self.written(statistic='mean', dtype='i2', fill_value=-1, scale_factor=0.5, add_offset=0)
+        variable = ds.variables['NDVI']
+        self.assertEqual(variable.dtype, np.dtype('i2'))
+        self.assertEqual((variable.scale_factor, variable.add_offset), (0.5, 0))
+        np.testing.assert_array_equal(variable[:][::-1], [[40, 300], [100, -1]])
+
+
+class TestFoldTask(TestCase):
+
+    def setUp(self):
+        input_group = EOProductGroup.objects.create(name='INPUT')
+        output_group = EOProductGroup.objects.create(name='OUTPUT')
+        self.pipeline = Pipeline.objects.create(package=Pipeline.PackageChoices.S02P02, output_group=output_group,
+                                                output_filename_template='output_{YYYYMM}.nc',
+                                                output_folder='output', task_name='task_temporal_aggregation',
+                                                task_kwargs={'period': 'month', 'statistic': 'mean'})
+        self.pipeline.input_groups.add(input_group)
+        self.inputs = [
+            EOProduct.objects.create(filename=f'input_{day}.nc', file=f'input_{day}.nc', group=input_group,
+                                     reference_date=datetime.date(2021, 1, day), state=EOProductStateChoices.READY)
+            for day in (1, 11, 21)]
+
+    def fold(self, eo_product: EOProduct, missing: list) -> mock.Mock:
+        with mock.patch('eo_engine.tasks.aggregation.fold_product'), \
+                mock.patch('eo_engine.tasks.aggregation._missing_dekads', return_value=missing), \
+                mock.patch('eo_engine.tasks.aggregation.task_temporal_aggregation') as task:
+            task_fold_temporal_aggregation(pipeline_pk=self.pipeline.pk, input_eo_product_pk=eo_product.pk)
+        return task
+
+    def output(self) -> EOProduct:
+        return EOProduct.objects.get(group__name='OUTPUT', reference_date=datetime.date(2021, 1, 1))
+
+    def test_output_is_scheduled_once(self):
+        self.fold(self.inputs[0], missing=[datetime.date(2021, 1, 21)]).apply_async.assert_not_called()
+        self.assertEqual(self.output().state, EOProductStateChoices.MISSING_SOURCE)
+
+        # the two last folds of the period both see it complete, only the first schedules it
+        self.fold(self.inputs[1], missing=[]).apply_async.assert_called_once_with(
+            kwargs={'eo_product_pk': self.output().pk, 'period': 'month', 'statistic': 'mean'})
+        self.assertEqual(self.output().state, EOProductStateChoices.SCHEDULED)
+        self.fold(self.inputs[2], missing=[]).apply_async.assert_not_called()
+
+    def test_output_being_generated_is_not_scheduled(self):
+        self.fold(self.inputs[0], missing=[datetime.date(2021, 1, 21)])
+        EOProduct.objects.filter(pk=self.output().pk).update(state=EOProductStateChoices.GENERATING)
+        self.fold(self.inputs[2], missing=[]).apply_async.assert_not_called()
+        self.assertEqual(self.output().state, EOProductStateChoices.GENERATING)
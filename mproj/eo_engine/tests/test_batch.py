@@ -0,0 +1,63 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+
+from eo_engine.common.gdal_profile import deactivate_gdal_profile
+from eo_engine.errors import AfriCultuReSError
+from eo_engine.models import EOProduct, EOProductGroup, EOProductStateChoices, Pipeline
+from eo_engine.tasks.batch import task_batch_generate_eoproducts
+from eo_engine.tasks.other import task_utils_generate_eoproducts_for_eo_product_group
+
+
+class TestBatchGenerate(TestCase):
+
+    def setUp(self):
+        self.output_group = EOProductGroup.objects.create(name='OUTPUT')
+        self.pipeline = Pipeline.objects.create(package=Pipeline.PackageChoices.S02P02, output_group=self.output_group,
+                                                output_filename_template='output_{YYYYMMDD}.nc',
+                                                output_folder='output', task_name='task_s02p02_ndvi300m_v2')
+        self.eo_products = [
+            EOProduct.objects.create(filename=f'output_{idx}.nc', group=self.output_group,
+                                     reference_date=datetime.date(2021, 1, 1 + idx), state=state)
+            for idx, state in enumerate([EOProductStateChoices.SCHEDULED, EOProductStateChoices.SCHEDULED,
+                                         EOProductStateChoices.IGNORE, EOProductStateChoices.AVAILABLE])]
+        self.task = mock.Mock()
+        self.task.name = 'eo_engine.tasks.s02p02.task_s02p02_ndvi300m_v2'
+
+    def tearDown(self):
+        deactivate_gdal_profile()
+
+    def state(self, eo_product: EOProduct) -> str:
+        eo_product.refresh_from_db()
+        return eo_product.state
+
+    def test_failed_product_does_not_stop_the_batch(self):
+        failing = self.eo_products[0].pk
+
+        def run(eo_product_pk: int):
+            if eo_product_pk == failing:
+                raise ValueError('broken input')
+
+        self.task.run.side_effect = run
+        with mock.patch('eo_engine.tasks.batch.get_task_ref_from_name', return_value=self.task):
+            with self.assertRaises(AfriCultuReSError):
+                task_batch_generate_eoproducts(pipeline_pk=self.pipeline.pk,
+                                               eo_product_pks=[p.pk for p in self.eo_products[:3]])
+
+        # the IGNOREd product is not made
+        self.assertEqual([call.kwargs['eo_product_pk'] for call in self.task.run.call_args_list],
+                         [p.pk for p in self.eo_products[:2]])
+        self.assertEqual([self.state(p) for p in self.eo_products[:3]],
+                         [EOProductStateChoices.FAILED, EOProductStateChoices.READY, EOProductStateChoices.IGNORE])
+
+    def test_products_are_split_in_batches(self):
+        EOProduct.objects.filter(group=self.output_group).update(state=EOProductStateChoices.AVAILABLE)
+        with mock.patch('eo_engine.tasks.other.get_task_ref_from_name', return_value=self.task), \
+                mock.patch('eo_engine.tasks.other.group') as celery_group:
+            task_utils_generate_eoproducts_for_eo_product_group(self.output_group.pk, batch_size=3)
+
+        signatures = celery_group.call_args.args[0]
+        self.assertEqual([s.kwargs['eo_product_pks'] for s in signatures],
+                         [[p.pk for p in self.eo_products[:3]], [self.eo_products[3].pk]])
+        self.assertEqual({self.state(p) for p in self.eo_products}, {EOProductStateChoices.SCHEDULED})
@@ -0,0 +1,79 @@
+import datetime
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+
+import netCDF4
+import numpy as np
+import rasterio
+from django.test import SimpleTestCase
+from rasterio.transform import from_origin
+
+from eo_engine.common.cube import DEFAULT_CUBE_CONFIG, append_file, extract_point, extract_window
+
+CONFIG = DEFAULT_CUBE_CONFIG._replace(time_chunk=2, chunk=2)
+TRANSFORM = from_origin(10, 20, 1, 1)
+
+
+def write_product(file_path: Path, data: np.ndarray, nodata: Optional[int] = 255, mtime: Optional[int] = None):
+    with rasterio.open(file_path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs='EPSG:4326', transform=TRANSFORM, nodata=nodata) as dst:
+        dst.write(data, 1)
+        dst.scales = (0.5,)
+    if mtime is not None:
+        os.utime(file_path, (mtime, mtime))
+
+
+class TestCube(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.settings = self.settings(CUBE_STORE_ROOT=self.root, CUBE_STORE_GROUPS={'TEST': {}})
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.temp_dir.cleanup()
+
+    def test_append_and_extract(self):
+        cube = self.root / 'TEST.nc'
+        data = np.arange(12, dtype='uint8').reshape(3, 4)
+        data[0, 0] = 255
+        write_product(self.root / 'a.tif', data, mtime=1000)
+        data_b = data + 1
+        data_b[0, 0] = 7
+        write_product(self.root / 'b.tif', data_b, mtime=1000)
+
+        self.assertTrue(append_file(cube, self.root / 'b.tif', datetime.date(2021, 1, 11), CONFIG, rows=2))
+        self.assertTrue(append_file(cube, self.root / 'a.tif', datetime.date(2021, 1, 1), CONFIG, rows=2))
+        # the same file again
+        self.assertFalse(append_file(cube, self.root / 'a.tif', datetime.date(2021, 1, 1), CONFIG, rows=2))
+
+        # physical values, in date order, None for nodata
+        self.assertEqual(extract_point('TEST', 10.5, 19.5), [(datetime.date(2021, 1, 1), None),
+                                                             (datetime.date(2021, 1, 11), 3.5)])
+        self.assertEqual(extract_point('TEST', 11.5, 19.5), [(datetime.date(2021, 1, 1), 0.5),
+                                                             (datetime.date(2021, 1, 11), 1.0)])
+        series = extract_window('TEST', (11, 17, 13, 19), date_from=datetime.date(2021, 1, 5))
+        self.assertEqual(series.dates, [datetime.date(2021, 1, 11)])
+        np.testing.assert_array_equal(series.values[0], data_b[1:3, 1:3] * 0.5)
+
+        # a regenerated product overwrites the slice of its date
+        write_product(self.root / 'a.tif', data * 2 % 250, mtime=2000)
+        self.assertTrue(append_file(cube, self.root / 'a.tif', datetime.date(2021, 1, 1), CONFIG, rows=2))
+        with netCDF4.Dataset(cube) as ds:
+            self.assertEqual(len(ds.dimensions['time']), 2)
+        self.assertEqual(extract_point('TEST', 11.5, 19.5)[0], (datetime.date(2021, 1, 1), 1.0))
+
+    def test_product_without_nodata(self):
+        cube = self.root / 'TEST.nc'
+        data = np.zeros((2, 2), dtype='uint8')
+        write_product(self.root / 'a.tif', data, nodata=None)
+
+        self.assertTrue(append_file(cube, self.root / 'a.tif', datetime.date(2021, 1, 1), CONFIG))
+        with netCDF4.Dataset(cube) as ds:
+            self.assertNotIn('_FillValue', ds.variables['values'].ncattrs())
+        # every value is valid
+        self.assertEqual(extract_point('TEST', 10.5, 19.5), [(datetime.date(2021, 1, 1), 0.0)])
@@ -0,0 +1,141 @@
+import datetime
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from eo_engine.common.dependencies import drain_pending_dependencies
+from eo_engine.common.readiness import inputs_ready, recount_readiness
+from eo_engine.common.reconciliation import reconcile_product_pipeline, reconcile_products
+from eo_engine.models import (EOProduct, EOProductGroup, EOProductStateChoices, EOSource, EOSourceGroup,
+                              EOSourceStateChoices, PendingDependency, Pipeline, PipelineReadiness)
+
+REFERENCE_DATE = datetime.date(2021, 5, 1)
+
+
+class TestDependencyResolver(TestCase):
+
+    def setUp(self):
+        self.input_groups = [
+            EOSourceGroup.objects.create(name=f'INPUT_{idx}', date_regex='') for idx in range(2)]
+        output_group = EOProductGroup.objects.create(name='OUTPUT')
+        self.pipeline = pipeline = Pipeline.objects.create(
+            package=Pipeline.PackageChoices.S02P02, output_group=output_group,
+            output_filename_template='output_{YYYYMMDD}.nc', output_folder='output',
+            task_name='task_s02p02_ndvi300m_v2')
+        pipeline.input_groups.set(self.input_groups)
+        self.sources = []
+        for idx, group in enumerate(self.input_groups):
+            eo_source = EOSource.objects.create(filename=f'input_{idx}.nc', domain='example.org',
+                                                filesize_reported=1, reference_date=REFERENCE_DATE,
+                                                datetime_seen=now(), url='https://example.org/input.nc')
+            eo_source.group.add(group)
+            self.sources.append(eo_source)
+
+    def _make_available(self, eo_source: EOSource):
+        eo_source.state = EOSourceStateChoices.AVAILABLE_LOCALLY
+        eo_source.save()
+
+    def test_saves_only_queue_keys(self):
+        self._make_available(self.sources[0])
+        self._make_available(self.sources[0])
+
+        self.assertEqual(PendingDependency.objects.count(), 1)
+        self.assertFalse(EOProduct.objects.exists())
+
+    def test_resolution(self):
+        self._make_available(self.sources[0])
+        report = drain_pending_dependencies(debounce=0)
+
+        self.assertEqual((report.keys, report.created, report.updated), (1, 1, 0))
+        self.assertEqual(EOProduct.objects.get().state, EOProductStateChoices.MISSING_SOURCE)
+        self.assertFalse(PendingDependency.objects.exists())
+
+        self._make_available(self.sources[1])
+        # not quiet long enough
+        self.assertEqual(drain_pending_dependencies(debounce=3600).keys, 0)
+        report = drain_pending_dependencies(debounce=0)
+
+        self.assertEqual((report.created, report.updated), (0, 1))
+        product = EOProduct.objects.get()
+        self.assertEqual((product.filename, product.state), ('output_20210501.nc', EOProductStateChoices.AVAILABLE))
+
+    def test_readiness_counts_transitions(self):
+        self._make_available(self.sources[0])
+        self._make_available(self.sources[0])
+        readiness = PipelineReadiness.objects.get()
+        self.assertEqual((readiness.expected, readiness.available), (2, 1))
+
+        self._make_available(self.sources[1])
+        self.assertTrue(inputs_ready(self.pipeline, REFERENCE_DATE))
+
+        eo_source = EOSource.objects.get(pk=self.sources[1].pk)
+        eo_source.state = EOSourceStateChoices.DOWNLOAD_FAILED
+        eo_source.save()
+        self.assertFalse(inputs_ready(self.pipeline, REFERENCE_DATE))
+        self.assertEqual(PipelineReadiness.objects.get().available, 1)
+
+    def test_discovered_sources_are_expected(self):
+        for eo_source in self.sources:
+            self._make_available(eo_source)
+        self.assertTrue(inputs_ready(self.pipeline, REFERENCE_DATE))
+
+        # a source discovered later is an input of the date too
+        late = EOSource.objects.create(filename='input_late.nc', domain='example.org', filesize_reported=1,
+                                       reference_date=REFERENCE_DATE, datetime_seen=now(),
+                                       url='https://example.org/input_late.nc')
+        late.group.add(self.input_groups[0])
+        self.assertFalse(inputs_ready(self.pipeline, REFERENCE_DATE))
+
+        # saved AVAILABLE_LOCALLY before it joins a group
+        local = EOSource.objects.create(filename='input_local.nc', domain='example.org', filesize_reported=1,
+                                        reference_date=REFERENCE_DATE, datetime_seen=now(),
+                                        url='https://example.org/input_local.nc',
+                                        state=EOSourceStateChoices.AVAILABLE_LOCALLY)
+        self.input_groups[1].eosource_set.add(local)
+        readiness = PipelineReadiness.objects.get()
+        self.assertEqual((readiness.expected, readiness.available), (4, 3))
+
+        late.delete()
+        self.assertTrue(inputs_ready(self.pipeline, REFERENCE_DATE))
+
+    def test_expected_inputs_from_the_pipeline(self):
+        # e.g. the tiles of a mosaic: the known sources are not all the inputs of the date
+        self.pipeline.expected_inputs = 3
+        self.pipeline.save()
+        for eo_source in self.sources:
+            self._make_available(eo_source)
+        recount_readiness([self.pipeline])
+        drain_pending_dependencies(debounce=0)
+
+        self.assertFalse(inputs_ready(self.pipeline, REFERENCE_DATE))
+        self.assertEqual(EOProduct.objects.get().state, EOProductStateChoices.MISSING_SOURCE)
+
+    def test_reconciliation(self):
+        # bypasses the signals: the counters are stale, no pending key
+        EOSource.objects.filter(pk__in=[s.pk for s in self.sources]).update(
+            state=EOSourceStateChoices.AVAILABLE_LOCALLY)
+        report = reconcile_products()
+
+        self.assertEqual((report.created, report.updated), (1, 0))
+        self.assertEqual(EOProduct.objects.get().state, EOProductStateChoices.AVAILABLE)
+        self.assertEqual(reconcile_products().created, 0)
+
+    def test_reconciliation_of_the_floods_season(self):
+        input_group = EOProductGroup.objects.create(name='FLOODS_INPUT')
+        output_group = EOProductGroup.objects.create(name='FLOODS')
+        pipeline = Pipeline.objects.create(
+            package=Pipeline.PackageChoices.S04P03, output_group=output_group,
+            output_filename_template='floods_{YYYYMMDD}.tif', output_folder='floods',
+            task_name='task_s04p03_floods10m')
+        pipeline.input_groups.add(input_group)
+        dates = [datetime.date(2021, 8, 13), datetime.date(2021, 8, 14), datetime.date(2021, 9, 30),
+                 datetime.date(2021, 10, 16), datetime.date(2021, 10, 17)]
+        for reference_date in dates:
+            EOProduct.objects.create(filename=f'input_{reference_date:%Y%m%d}.tif', group=input_group,
+                                     reference_date=reference_date, state=EOProductStateChoices.AVAILABLE)
+        # bypasses the signals
+        EOProduct.objects.filter(group=input_group).update(state=EOProductStateChoices.READY)
+
+        self.assertEqual(reconcile_product_pipeline(pipeline), 3)
+        self.assertEqual(sorted(EOProduct.objects.filter(group=output_group).values_list(
+            'reference_date', flat=True)), dates[1:4])
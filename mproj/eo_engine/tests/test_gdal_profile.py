@@ -0,0 +1,57 @@
+from django.test import SimpleTestCase, override_settings
+
+from osgeo import gdal
+
+from eo_engine.common.gdal_profile import get_gdal_profile, creation_options, command_line_args, \
+    activate_gdal_profile, deactivate_gdal_profile, rasterio_creation_options
+
+PROFILES = {
+    'default': {'num_threads': 4},
+    'task_s06p04_et250m': {
+        'cache_max_mb': 2048,
+        'creation_options': {'GTiff': {'COMPRESS': 'ZSTD', 'ZSTD_LEVEL': 9}}
+    }
+}
+
+
+@override_settings(GDAL_PERFORMANCE_PROFILES=PROFILES)
+class TestGDALProfile(SimpleTestCase):
+
+    def test_task_profile_overrides_default(self):
+        profile = get_gdal_profile('eo_engine.tasks.s06p04.task_s06p04_et250m')
+
+        self.assertEqual(profile.num_threads, 4)
+        self.assertEqual(profile.cache_max_mb, 2048)
+        options = creation_options('GTiff', profile)
+        self.assertIn('COMPRESS=ZSTD', options)
+        self.assertIn('ZSTD_LEVEL=9', options)
+        # options that are not overridden are kept
+        self.assertIn('TILED=YES', options)
+
+    @override_settings(PRODUCT_LAYOUT_PROFILES={'default': {'blocksize': 256, 'gtiff_compress': 'DEFLATE'},
+                                                'S06P01_WB_10M_*': {'predictor': 2}})
+    def test_layout_of_the_group_wins(self):
+        profile = get_gdal_profile('task_s06p04_et250m')
+        options = creation_options('GTiff', profile, group_name='S06P01_WB_10M_KZN')
+
+        self.assertIn('COMPRESS=DEFLATE', options)
+        self.assertIn('BLOCKXSIZE=256', options)
+        self.assertIn('PREDICTOR=2', options)
+        # not set by the layout
+        self.assertIn('ZSTD_LEVEL=9', options)
+        self.assertIn('BIGTIFF=IF_SAFER', options)
+        self.assertEqual(rasterio_creation_options('GTiff', profile, group_name='S06P01_WB_10M_KZN')['tiled'], True)
+
+    def test_command_line_args(self):
+        args = command_line_args('gdalwarp', profile=get_gdal_profile('task_unknown'))
+
+        self.assertIn('-multi', args)
+        self.assertEqual(args[args.index('-wo') + 1], 'NUM_THREADS=4')
+
+    def test_deactivation_restores_cache_max(self):
+        cache_max = gdal.GetCacheMax()
+        activate_gdal_profile('task_s06p04_et250m')
+        self.assertEqual(gdal.GetCacheMax(), 2048 * 1024 * 1024)
+        deactivate_gdal_profile()
+
+        self.assertEqual(gdal.GetCacheMax(), cache_max)
@@ -0,0 +1,50 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from eo_engine.common import RemoteFile
+from eo_engine.common.db_ops import bulk_add_eo_sources, ingest_remote_files
+from eo_engine.models import EOSource, EOSourceGroup, EOSourceStateChoices, PendingDependency
+
+
+def remote_file(filename: str) -> RemoteFile:
+    return RemoteFile(domain='example.org', url=f'sftp://example.org/{filename}', filename=filename,
+                      filesize_reported=1)
+
+
+@override_settings(INGESTION_LOOKBACK_DAYS=2)
+class TestIngestion(TestCase):
+
+    def test_high_water_mark(self):
+        group = EOSourceGroup.objects.create(name='TEST_GROUP', date_regex=r'DMET_(?P<YYYYMMDD>\d{8})\.nc')
+        eo_source = EOSource.objects.create(filename='DMET_20210110.nc', domain='example.org', filesize_reported=1,
+                                            reference_date=datetime.date(2021, 1, 10), datetime_seen=now(),
+                                            url='sftp://example.org/DMET_20210110.nc')
+        eo_source.group.add(group)
+
+        listing = [remote_file(f'DMET_202101{day:02}.nc') for day in range(1, 13)] + [remote_file('README')]
+        report = ingest_remote_files(listing, group)
+
+        # 1-7: older than the mark, README: no date
+        self.assertEqual(report._asdict(), {'seen': 13, 'skipped': 8, 'created': 4, 'attached': 1})
+        self.assertEqual(group.eosource_set.count(), 5)
+        self.assertEqual(ingest_remote_files(listing, group).created, 0)
+
+    def test_attached_available_source_is_queued(self):
+        group = EOSourceGroup.objects.create(name='TEST_GROUP', date_regex='')
+        eo_source = EOSource.objects.create(filename='DMET_20210110.nc', domain='example.org', filesize_reported=1,
+                                            reference_date=datetime.date(2021, 1, 10), datetime_seen=now(),
+                                            url='sftp://example.org/DMET_20210110.nc',
+                                            state=EOSourceStateChoices.AVAILABLE_LOCALLY)
+        PendingDependency.objects.all().delete()
+
+        report = bulk_add_eo_sources([EOSource(filename='DMET_20210110.nc'), EOSource(
+            filename='DMET_20210111.nc', domain='example.org', filesize_reported=1,
+            reference_date=datetime.date(2021, 1, 11), datetime_seen=now(), url='sftp://example.org/DMET_20210111.nc')
+        ], group)
+
+        self.assertEqual((report.created, report.attached), (1, 1))
+        # the remote source is not queued
+        self.assertEqual(list(PendingDependency.objects.values_list('group_id', 'reference_date')),
+                         [(group.pk, eo_source.reference_date)])
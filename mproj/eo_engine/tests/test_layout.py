@@ -0,0 +1,31 @@
+from django.test import SimpleTestCase, override_settings
+
+from eo_engine.common.layout import get_layout_profile, gtiff_creation_options, product_spec
+from eo_engine.common.netcdf import VariableSpec
+
+PROFILES = {
+    'default': {'chunksizes': (256, 256), 'complevel': 4},
+    'S02P02_NDVIA_250M_*': {'chunksizes': (128, 128), 'compression': 'zstd'},
+    'S06P01_WB_10M_KZN': {'predictor': 2},
+}
+
+
+@override_settings(PRODUCT_LAYOUT_PROFILES=PROFILES)
+class TestLayoutProfiles(SimpleTestCase):
+
+    def test_pattern_match(self):
+        spec = product_spec(VariableSpec(name='NDVIA', complevel=9), 'S02P02_NDVIA_250M_KEN')
+
+        self.assertEqual(spec.chunksizes, (128, 128))
+        self.assertEqual(spec.compression, 'zstd')
+        # not overridden by the group, taken from 'default'
+        self.assertEqual(spec.complevel, 4)
+
+    def test_default(self):
+        self.assertEqual(get_layout_profile('S04P01_LULC_500M_AFR').chunksizes, (256, 256))
+
+    def test_gtiff_options(self):
+        options = gtiff_creation_options(get_layout_profile('S06P01_WB_10M_KZN'))
+
+        self.assertEqual(options['predictor'], 2)
+        self.assertTrue(options['tiled'])
@@ -0,0 +1,46 @@
+import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import netCDF4
+import numpy as np
+from django.test import TestCase
+from rasterio.transform import from_origin
+
+from eo_engine.common.lts import accumulator_path, export_lts, fold_product
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+
+
+class TestNDVILTS(TestCase):
+
+    def test_fold_and_export(self):
+        spec = VariableSpec(name='NDVI', dtype='uint8', fill_value=255)
+        first = np.array([[10, 200], [251, 255]], dtype='uint8')
+        second = np.array([[30, 100], [50, 255]], dtype='uint8')
+
+        with TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            products = []
+            for idx, data in enumerate((first, second)):
+                products.append(write_netcdf_product(
+                    root / f'ndvi_{idx}.nc', data, spec, transform=from_origin(0, 2, 1, 1)))
+
+            self.assertTrue(fold_product(products[0], datetime.date(2020, 1, 1), root=root))
+            self.assertTrue(fold_product(products[1], datetime.date(2021, 1, 1), root=root))
+            # already folded
+            self.assertFalse(fold_product(products[1], datetime.date(2021, 1, 1), root=root))
+
+            with netCDF4.Dataset(accumulator_path('0101', root)) as acc:
+                acc.set_auto_maskandscale(False)
+                np.testing.assert_array_equal(acc.variables['count'][:][::-1], [[2, 2], [1, 0]])
+
+            files = {f.name: f for f in export_lts('0101', root=root)}
+            with netCDF4.Dataset(files['cgls_NDVI-LTS_0101_V3_min.nc']) as ds:
+                ds.set_auto_maskandscale(False)
+                np.testing.assert_array_equal(ds.variables['min'][:][::-1], [[10, 100], [50, 255]])
+            with netCDF4.Dataset(files['cgls_NDVI-LTS_0101_V3_max.nc']) as ds:
+                ds.set_auto_maskandscale(False)
+                np.testing.assert_array_equal(ds.variables['max'][:][::-1], [[30, 200], [50, 255]])
+            with netCDF4.Dataset(files['cgls_NDVI-LTS_0101_V3_mean.nc']) as ds:
+                ds.set_auto_maskandscale(False)
+                np.testing.assert_array_equal(ds.variables['mean'][:][::-1], [[20, 150], [50, 255]])
@@ -0,0 +1,41 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import netCDF4
+import numpy as np
+from django.test import SimpleTestCase
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from eo_engine.common.netcdf import VariableSpec, write_netcdf_product
+
+
+class TestWriteNetcdfProduct(SimpleTestCase):
+
+    def test_blocks_are_written_bottom_up(self):
+        data = np.arange(12, dtype='uint8').reshape(4, 3)
+        transform = from_origin(10, 20, 1, 1)
+        spec = VariableSpec(name='NDVI', dtype='uint8', fill_value=255, scale_factor=0.004,
+                            attrs={'short_name': 'NDVI'})
+        blocks = [(Window(0, 0, 3, 2), data[:2]), (Window(0, 2, 3, 2), data[2:])]
+
+        with TemporaryDirectory() as temp_dir:
+            out = write_netcdf_product(Path(temp_dir) / 'out.nc', blocks, spec, transform=transform,
+                                       crs='EPSG:4326', width=3, height=4)
+            with netCDF4.Dataset(out) as ds:
+                ds.set_auto_maskandscale(False)
+                var = ds.variables['NDVI']
+                np.testing.assert_array_equal(var[:], data[::-1])
+                np.testing.assert_allclose(ds.variables['lat'][:], [16.5, 17.5, 18.5, 19.5])
+                np.testing.assert_allclose(ds.variables['lon'][:], [10.5, 11.5, 12.5])
+                self.assertEqual(var.getncattr('_FillValue'), 255)
+                self.assertEqual(var.getncattr('grid_mapping'), 'crs')
+                self.assertEqual(var.getncattr('short_name'), 'NDVI')
+
+    def test_array_keeps_dtype(self):
+        data = np.ones((1, 2, 2), dtype='int16')
+        with TemporaryDirectory() as temp_dir:
+            out = write_netcdf_product(Path(temp_dir) / 'out.nc', data, VariableSpec(name='Band1'),
+                                       transform=from_origin(0, 2, 1, 1))
+            with netCDF4.Dataset(out) as ds:
+                self.assertEqual(ds.variables['Band1'].dtype, np.dtype('int16'))
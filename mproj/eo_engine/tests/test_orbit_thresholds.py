@@ -0,0 +1,35 @@
+import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase
+
+from eo_engine.common.orbit_thresholds import OrbitThresholdStore
+from eo_engine.models import OrbitThreshold
+
+
+class TestOrbitThresholdStore(TestCase):
+
+    def test_legacy_csv_is_imported_once(self):
+        with TemporaryDirectory() as temp_dir:
+            csv_file = Path(temp_dir) / 'Listparams_kzn.csv'
+            csv_file.write_text('date,threshold,relative_orbit\n'
+                                '2021-01-01,-17.5,29\n'
+                                '2021-01-13,-16.0,29\n'
+                                '2021-01-05,-18.0,131\n')
+            store = OrbitThresholdStore('KZN', legacy_csv_file_path=csv_file)
+            self.assertEqual(OrbitThreshold.objects.filter(aoi='KZN').count(), 3)
+            self.assertEqual(store.latest(29).threshold, -16.0)
+
+            csv_file.write_text('date,threshold,relative_orbit\n2022-01-01,-15.0,29\n')
+            OrbitThresholdStore('KZN', legacy_csv_file_path=csv_file)
+            self.assertEqual(OrbitThreshold.objects.filter(aoi='KZN').count(), 3)
+
+    def test_add_updates_latest(self):
+        store = OrbitThresholdStore('BAG')
+        self.assertIsNone(store.latest(29))
+        store.add(29, datetime.date(2021, 3, 1), -17.0)
+        store.add(29, datetime.date(2021, 3, 1), -16.5)
+        self.assertEqual(store.latest(29).threshold, -16.5)
+        self.assertEqual(OrbitThreshold.objects.filter(aoi='BAG').count(), 1)
+        self.assertEqual(OrbitThresholdStore('BAG').latest(29).date, datetime.date(2021, 3, 1))
@@ -0,0 +1,36 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import rasterio
+from django.test import TestCase, override_settings
+from rasterio.transform import from_origin
+
+from eo_engine.models import PreFloodEvent
+from eo_engine.tasks.s04p03 import find_pre_flood_event_file, get_prevent_dir, index_pre_flood_event_archive
+
+
+def write_raster(file_path: Path):
+    with rasterio.open(file_path, 'w', driver='GTiff', width=4, height=4, count=1, dtype='uint8',
+                       crs='EPSG:4326', transform=from_origin(-1.788, 11.74, 0.01, 0.01)) as dst:
+        dst.write(np.zeros((1, 4, 4), dtype='uint8'))
+
+
+class TestPreFloodEventIndex(TestCase):
+
+    def test_archive_is_indexed_once(self):
+        with TemporaryDirectory() as temp_dir, override_settings(AUX_FILES_ROOT=Path(temp_dir)):
+            archive = get_prevent_dir()
+            # the 1st of August is outside the pre-event date range
+            for name in ('20200801_wb.tif', '20200815_wb.tif', '20200816_wb.tif'):
+                write_raster(archive / name)
+
+            self.assertEqual(index_pre_flood_event_archive(2020, 'BAG'), 3)
+            self.assertEqual(index_pre_flood_event_archive(2020, 'BAG'), 0)
+            self.assertEqual(find_pre_flood_event_file(2020, 'BAG'), archive / '20200815_wb.tif')
+            self.assertIsNone(find_pre_flood_event_file(2021, 'BAG'))
+
+            # the rows of deleted files are dropped
+            (archive / '20200815_wb.tif').unlink()
+            self.assertEqual(find_pre_flood_event_file(2020, 'BAG'), archive / '20200816_wb.tif')
+            self.assertEqual(PreFloodEvent.objects.filter(aoi='BAG', year=2020).count(), 2)
@@ -0,0 +1,27 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from eo_engine.common.resample import flag_aware_mean
+
+
+class TestFlagAwareMean(SimpleTestCase):
+
+    def test_flags_are_not_averaged(self):
+        block = np.array([
+            [10, 20, 251, 253, 253, 255],
+            [30, 255, 252, 253, 254, 255],
+            [251, 252, 40, 251, 255, 255],
+        ], dtype='uint8')
+
+        result = flag_aware_mean(block, 3, nodata=255, flags=(251, 252, 253, 254, 255))
+
+        # mean of the valid pixels, rounded half up
+        self.assertEqual(result[0, 0], 25)
+        # no valid pixels: the most frequent flag
+        self.assertEqual(result[0, 1], 255)
+        self.assertEqual(result.dtype, np.dtype('uint8'))
+
+    def test_only_nodata(self):
+        block = np.full((3, 3), -1, dtype='int16')
+        result = flag_aware_mean(block, 3, nodata=-1)
+        self.assertEqual(result[0, 0], -1)
@@ -0,0 +1,65 @@
+import datetime
+import logging
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from eo_engine.models import EOSource, EOSourceGroup
+from eo_scraper.pipelines import DefaultPipeline
+from eo_scraper.spiders.abstract_spiders import AfricultureCrawlerMixin
+
+
+class FakeSpider:
+    name = 'TEST_GROUP'
+    logger = logging.getLogger(__name__)
+
+    def get_group_settings(self):
+        return EOSourceGroup.objects.get(name=self.name)
+
+    def is_expected_filename(self, filename):
+        return filename.endswith('.nc')
+
+    def should_process_filename(self, filename):
+        return True
+
+    def date_reference_from_filename(self, filename):
+        return datetime.datetime.strptime(filename[:8], '%Y%m%d').date()
+
+
+class TestDefaultPipeline(TestCase):
+
+    def test_batches(self):
+        group = EOSourceGroup.objects.create(name='TEST_GROUP', date_regex='')
+        existing = EOSource.objects.create(filename='20210101.nc', domain='example.org', filesize_reported=1,
+                                           reference_date=datetime.date(2021, 1, 1), datetime_seen=now(),
+                                           url='https://example.org/20210101.nc')
+        spider = FakeSpider()
+        pipeline = DefaultPipeline(batch_size=2)
+        pipeline.open_spider(spider)
+        # the credentials of the domain, once
+        with self.assertNumQueries(1):
+            pipeline.process_item({'domain': 'example.org', 'filename': '20210111.nc', 'url': 'https://example.org/b'},
+                                  spider)
+        for day in ('01', '21', '21'):
+            pipeline.process_item(
+                {'domain': 'example.org', 'filename': f'202101{day}.nc', 'url': f'https://example.org/{day}'}, spider)
+        pipeline.close_spider(spider)
+
+        self.assertEqual(EOSource.objects.count(), 3)
+        self.assertEqual(group.eosource_set.count(), 3)
+        self.assertIn(group, existing.group.all())
+
+    def test_date_pattern_is_compiled_once(self):
+        EOSourceGroup.objects.create(name='TEST_GROUP', date_regex=r'DMET_(?P<YYYYMMDD>\d{8})\.nc')
+
+        class Spider(AfricultureCrawlerMixin):
+            name = 'TEST_GROUP'
+            logger = logging.getLogger(__name__)
+
+        spider = Spider()
+        self.assertEqual(spider.date_reference_from_filename('DMET_20210110.nc'), datetime.date(2021, 1, 10))
+        pattern = spider.get_date_pattern()
+        with self.assertNumQueries(0):
+            self.assertTrue(spider.is_expected_filename('dmet_20210111.nc'))
+            self.assertEqual(spider.date_reference_from_filename('DMET_20210111.nc'), datetime.date(2021, 1, 11))
+        self.assertIs(spider.get_date_pattern(), pattern)
@@ -0,0 +1,50 @@
+import datetime
+import uuid
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from django_celery_results.models import TaskResult
+
+from eo_engine.common.task_history import latest_tasks, purge_task_history
+from eo_engine.models import EOProduct, EOProductGroup, EOSource, GeopGroupTask, GeopTask
+
+
+@override_settings(TASK_HISTORY_RETENTION_DAYS=90, TASK_RESULT_RETENTION_DAYS=30)
+class TestTaskHistory(TestCase):
+
+    def task(self, status: str, days_ago: int, group_task: GeopGroupTask = None) -> GeopTask:
+        task = GeopTask.objects.create(task_id=uuid.uuid4(), task_name='eo_engine.tasks.other.task_download_file',
+                                       status=status, group_task=group_task)
+        GeopTask.objects.filter(pk=task.pk).update(datetime_submitted=now() - datetime.timedelta(days=days_ago))
+        return task
+
+    def test_purge(self):
+        eo_source = EOSource.objects.create(filename='input.nc', domain='example.org', filesize_reported=1,
+                                            reference_date=datetime.date(2021, 1, 1), datetime_seen=now(),
+                                            url='https://example.org/input.nc')
+        group_task = GeopGroupTask.objects.create(group_task_id=uuid.uuid4())
+        GeopGroupTask.objects.filter(pk=group_task.pk).update(timestamp=now() - datetime.timedelta(days=100))
+        old = self.task(GeopTask.TaskTypeChoices.SUCCESS, 100, group_task)
+        old.eo_source.add(eo_source)
+        running = self.task(GeopTask.TaskTypeChoices.STARTED, 100)
+        recent = self.task(GeopTask.TaskTypeChoices.FAILURE, 10)
+        result = TaskResult.objects.create(task_id=str(old.task_id), status='SUCCESS')
+        TaskResult.objects.filter(pk=result.pk).update(date_done=now() - datetime.timedelta(days=40))
+
+        report = purge_task_history(batch_size=1)
+
+        self.assertEqual(report._asdict(), {'tasks': 1, 'group_tasks': 1, 'results': 1})
+        self.assertEqual(set(GeopTask.objects.values_list('pk', flat=True)), {running.pk, recent.pk})
+        self.assertFalse(eo_source.task.exists())
+        self.assertFalse(TaskResult.objects.exists())
+
+    def test_latest_tasks(self):
+        group = EOProductGroup.objects.create(name='OUTPUT')
+        eo_products = [EOProduct.objects.create(filename=f'product_{idx}.nc', group=group,
+                                                reference_date=datetime.date(2021, 1, 1 + idx)) for idx in range(2)]
+        for days_ago in (3, 2, 1):
+            self.task(GeopTask.TaskTypeChoices.SUCCESS, days_ago).eo_product.add(eo_products[0])
+        latest = self.task(GeopTask.TaskTypeChoices.FAILURE, 0)
+        latest.eo_product.add(eo_products[0])
+
+        self.assertEqual(latest_tasks([p.pk for p in eo_products]), {eo_products[0].pk: latest})
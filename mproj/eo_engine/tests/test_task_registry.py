@@ -0,0 +1,35 @@
+from importlib import import_module
+
+from django.test import SimpleTestCase, override_settings
+
+from eo_engine.common.task_registry import queue_modules, task_modules, task_queue
+from eo_engine.tasks import TASK_MODULES
+
+ROUTES = {
+    '*.task_s02p02_ndvi300m_v2': 'process',
+    '*.task_init_spider': 'crawl',
+    '*.task_download_file': {'queue': 'download'}
+}
+
+
+class TestTaskRegistry(SimpleTestCase):
+
+    def test_task_modules_match_the_modules(self):
+        for module, tasks in task_modules().items():
+            self.assertEqual(sorted(import_module(module).__all__), sorted(t.rsplit('.', 1)[-1] for t in tasks))
+
+    def test_lazy_attribute(self):
+        from eo_engine import tasks
+
+        self.assertEqual(tasks.task_debug_add.name, 'eo_engine.tasks.example.task_debug_add')
+        with self.assertRaises(AttributeError):
+            getattr(tasks, 'task_does_not_exist')
+
+    @override_settings(CELERY_ROUTES=ROUTES)
+    def test_queue_modules(self):
+        self.assertEqual(task_queue('eo_engine.tasks.other.task_download_file'), 'download')
+        self.assertEqual(task_queue('eo_engine.tasks.example.task_debug_add'), 'celery')
+        self.assertEqual(queue_modules(['download']), ['eo_engine.tasks.other'])
+        self.assertEqual(queue_modules(['process']), ['eo_engine.tasks.s02p02'])
+        # the other s02p02 tasks are not routed: the default queue needs the module too
+        self.assertEqual(len(queue_modules(['celery'])), len(TASK_MODULES))
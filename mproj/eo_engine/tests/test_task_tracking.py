@@ -0,0 +1,76 @@
+import datetime
+import uuid
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from eo_engine.common.task_tracking import Published, TaskTracker
+from eo_engine.models import EOSource, GeopGroupTask, GeopTask
+
+
+class TestTaskTracker(TestCase):
+
+    def published(self, task_id: str, group_task_id: str, eo_source_pk: int) -> Published:
+        return Published(task_id=task_id, task_name='eo_engine.tasks.other.task_download_file', task_args='()',
+                         task_kwargs={'eo_source_pk': eo_source_pk}, parent_id=None, root_id=task_id,
+                         group_task_id=group_task_id, group_root_id=None, eo_source_pks=(eo_source_pk,),
+                         eo_product_pks=())
+
+    def test_batched_writes(self):
+        eo_source = EOSource.objects.create(filename='input.nc', domain='example.org', filesize_reported=1,
+                                            reference_date=datetime.date(2021, 1, 1), datetime_seen=now(),
+                                            url='https://example.org/input.nc')
+        tracker = TaskTracker(background=False)
+        group_task_id = str(uuid.uuid4())
+        task_ids = [str(uuid.uuid4()) for _ in range(50)]
+        for task_id in task_ids:
+            tracker.task_published(self.published(task_id, group_task_id, eo_source.pk))
+        # a retry republishes the task
+        tracker.task_published(self.published(task_ids[0], group_task_id, eo_source.pk))
+        for status in (GeopTask.TaskTypeChoices.STARTED, GeopTask.TaskTypeChoices.RETRY,
+                       GeopTask.TaskTypeChoices.SUCCESS):
+            tracker.task_transition(task_ids[0], status)
+        # published by another process, not written yet
+        tracker.task_transition(str(uuid.uuid4()), GeopTask.TaskTypeChoices.STARTED)
+
+        self.assertFalse(GeopTask.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tracker.flush(), (51, 3))
+        # a handful of statements, not a few per task
+        self.assertLess(len(queries), 12)
+
+        self.assertEqual(GeopTask.objects.count(), 50)
+        self.assertEqual(eo_source.task.count(), 50)
+        task = GeopTask.objects.get(task_id=task_ids[0])
+        self.assertEqual((task.status, task.retries), (GeopTask.TaskTypeChoices.SUCCESS, 1))
+        self.assertTrue(task.time_to_complete)
+        self.assertIsNotNone(GeopGroupTask.objects.get().datetime_started)
+        # the unknown task waits
+        self.assertEqual(tracker.flush(), (0, 0))
+
+    def test_worker_flushes_before_the_publisher(self):
+        eo_source = EOSource.objects.create(filename='input.nc', domain='example.org', filesize_reported=1,
+                                            reference_date=datetime.date(2021, 1, 1), datetime_seen=now(),
+                                            url='https://example.org/input.nc')
+        task_id, group_task_id = str(uuid.uuid4()), str(uuid.uuid4())
+        published = self.published(task_id, group_task_id, eo_source.pk)
+        # a pool process that runs one task and exits before the publisher flushes
+        worker = TaskTracker(background=False)
+        for status in (GeopTask.TaskTypeChoices.STARTED, GeopTask.TaskTypeChoices.SUCCESS):
+            worker.task_transition(task_id, status, published=published)
+        worker.close()
+
+        task = GeopTask.objects.get(task_id=task_id)
+        self.assertEqual(task.status, GeopTask.TaskTypeChoices.SUCCESS)
+        self.assertTrue(task.time_to_complete)
+        self.assertEqual(list(task.eo_source.all()), [eo_source])
+        self.assertEqual(worker.flush(), (0, 0))
+
+        # the publication written later does not change the row
+        publisher = TaskTracker(background=False)
+        publisher.task_published(published)
+        self.assertEqual(publisher.flush(), (1, 0))
+        self.assertEqual(GeopTask.objects.get(task_id=task_id).status, GeopTask.TaskTypeChoices.SUCCESS)
+        self.assertEqual(eo_source.task.count(), 1)
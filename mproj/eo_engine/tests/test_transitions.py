@@ -0,0 +1,50 @@
+import datetime
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from eo_engine.models import (EOProductGroup, EOSource, EOSourceGroup, EOSourceStateChoices, PendingDependency,
+                              Pipeline, PipelineReadiness, StateTransition, transition_eo_source)
+from eo_engine.models.transitions import eo_source_transition
+
+
+class TestStateTransitions(TestCase):
+
+    def setUp(self):
+        group = EOSourceGroup.objects.create(name='INPUT', date_regex='')
+        pipeline = Pipeline.objects.create(package=Pipeline.PackageChoices.S02P02,
+                                           output_group=EOProductGroup.objects.create(name='OUTPUT'),
+                                           output_filename_template='output_{YYYYMMDD}.nc', output_folder='output',
+                                           task_name='task_s02p02_ndvi300m_v2')
+        pipeline.input_groups.set([group])
+        self.eo_source = EOSource.objects.create(filename='input.nc', domain='example.org', filesize_reported=1,
+                                                 reference_date=datetime.date(2021, 5, 1), datetime_seen=now(),
+                                                 url='https://example.org/input.nc')
+        self.eo_source.group.add(group)
+        self.transitions = []
+        eo_source_transition.connect(self.receiver, sender=EOSource)
+        self.addCleanup(eo_source_transition.disconnect, self.receiver, sender=EOSource)
+
+    def receiver(self, transition: StateTransition, **kwargs):
+        self.transitions.append(transition)
+
+    def test_conditional(self):
+        downloadable = (EOSourceStateChoices.AVAILABLE_REMOTELY, EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD)
+        with self.assertNumQueries(3):  # savepoint, update, release
+            self.assertTrue(transition_eo_source(self.eo_source.pk, EOSourceStateChoices.DOWNLOADING, downloadable))
+        # another worker lost the race
+        self.assertFalse(transition_eo_source(self.eo_source.pk, EOSourceStateChoices.DOWNLOADING, downloadable))
+        self.assertEqual(self.transitions, [StateTransition(
+            pk=self.eo_source.pk, reference_date=datetime.date(2021, 5, 1),
+            previous=EOSourceStateChoices.AVAILABLE_REMOTELY, state=EOSourceStateChoices.DOWNLOADING)])
+
+    def test_available_locally(self):
+        self.assertTrue(transition_eo_source(self.eo_source.pk, EOSourceStateChoices.AVAILABLE_LOCALLY,
+                                             file='input.nc'))
+        eo_source = EOSource.objects.get(pk=self.eo_source.pk)
+        self.assertEqual((eo_source.state, eo_source.file.name), (EOSourceStateChoices.AVAILABLE_LOCALLY, 'input.nc'))
+        self.assertEqual(PipelineReadiness.objects.get().available, 1)
+        self.assertTrue(PendingDependency.objects.exists())
+
+        self.assertTrue(transition_eo_source(self.eo_source.pk, EOSourceStateChoices.IGNORE))
+        self.assertEqual(PipelineReadiness.objects.get().available, 0)
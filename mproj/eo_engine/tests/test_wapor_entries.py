@@ -0,0 +1,27 @@
+import datetime
+
+from django.test import TestCase
+
+from eo_engine.common.time import running_dekads
+from eo_engine.models import EOSource, EOSourceGroup
+from eo_engine.models.factories import bulk_create_wapor_entries
+
+
+class TestWaporEntries(TestCase):
+
+    def test_running_dekads(self):
+        self.assertEqual(list(running_dekads(datetime.date(2019, 12, 25), datetime.date(2020, 1, 11))),
+                         [(2019, 36), (2020, 1), (2020, 2)])
+
+    def test_bulk_create(self):
+        names = ['S06P04_WAPOR_L1_AETI_D_AFRICA', 'S06P04_WAPOR_L2_AETI_D_ETH']
+        for name in names:
+            EOSourceGroup.objects.create(name=name, date_regex='')
+
+        reports = bulk_create_wapor_entries(names, datetime.date(2019, 1, 5), datetime.date(2019, 2, 1))
+        self.assertEqual([report.created for report in reports.values()], [4, 4])
+        eo_source = EOSource.objects.get(filename='L2_AETI_D_1904_ETH.tif')
+        self.assertEqual(eo_source.reference_date, datetime.date(2019, 2, 1))
+
+        reports = bulk_create_wapor_entries(names[:1], datetime.date(2019, 1, 1), datetime.date(2019, 1, 31))
+        self.assertEqual(reports[names[0]].created, 0)
@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase, override_settings
+
+from mproj.celery import worker_profile
+
+PROFILES = {
+    'default': {'max_tasks_per_child': 1},
+    'download': {'max_tasks_per_child': 200, 'max_memory_per_child_mb': 512},
+    'process': {'max_tasks_per_child': 20, 'max_memory_per_child_mb': 4096, 'max_jvm_heap_mb': 2048}
+}
+
+
+@override_settings(WORKER_PROFILES=PROFILES)
+class TestWorkerProfiles(SimpleTestCase):
+
+    def test_queue_profile(self):
+        profile = worker_profile(['download'])
+
+        self.assertEqual(profile.max_tasks_per_child, 200)
+        self.assertEqual(profile.max_memory_per_child_mb, 512)
+        self.assertIsNone(profile.max_jvm_heap_mb)
+        # queues without a profile use the default one
+        self.assertEqual(worker_profile(['crawl']).max_tasks_per_child, 1)
+
+    def test_several_queues_apply_the_strictest_limits(self):
+        profile = worker_profile(['download', 'process'])
+
+        self.assertEqual(profile.max_tasks_per_child, 20)
+        self.assertEqual(profile.max_memory_per_child_mb, 512)
+        self.assertEqual(profile.max_jvm_heap_mb, 2048)
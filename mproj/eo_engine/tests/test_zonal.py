@@ -0,0 +1,55 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from osgeo import ogr, osr
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from eo_engine.common.raster import GridSignature
+from eo_engine.common.zonal import ValueSpec, ZonalAccumulator, ZoneSet, tap_blocks
+
+
+def _write_zones(shapefile: Path):
+    """ Two zones: the west and the east half of a 4x4 grid at (0, 0)-(4, 4) """
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(shapefile.as_posix())
+    layer = ds.CreateLayer('zones', srs=srs, geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('CODE', ogr.OFTString))
+    for code, wkt in (('W', 'POLYGON ((0 0, 2 0, 2 4, 0 4, 0 0))'), ('E', 'POLYGON ((2 0, 4 0, 4 4, 2 4, 2 0))')):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('CODE', code)
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+        layer.CreateFeature(feature)
+    ds = None
+
+
+class TestZonalAccumulator(SimpleTestCase):
+
+    def test_blocks_are_accumulated_per_zone(self):
+        data = np.array([[1, 2, 10, 20],
+                         [3, 255, 30, 40],
+                         [1, 2, 10, 20],
+                         [3, 4, 30, 40]], dtype='uint8')
+        grid = GridSignature(crs=CRS.from_epsg(4326).to_wkt(), transform=tuple(from_origin(0, 4, 1, 1)[:6]),
+                             width=4, height=4)
+
+        with TemporaryDirectory() as temp_dir, override_settings(AUX_FILES_ROOT=Path(temp_dir)):
+            shapefile = Path(temp_dir) / 'zones.shp'
+            _write_zones(shapefile)
+            accumulator = ZonalAccumulator(
+                ZoneSet(name='test', shapefile=shapefile, id_field='CODE', name_field=None), grid,
+                ValueSpec(nodata=255, scale_factor=0.5, add_offset=0, valid_range=None))
+            blocks = [(Window(0, 0, 4, 2), data[:2]), (Window(0, 2, 4, 2), data[2:])]
+            self.assertEqual(len(list(tap_blocks(blocks, [accumulator]))), 2)
+            accumulator.close()
+
+        west, east = 1, 2
+        self.assertEqual(accumulator.pixels[west], 8)
+        self.assertEqual(accumulator.count[west], 7)
+        self.assertAlmostEqual(accumulator.sum[west] / accumulator.count[west], 8 / 7)
+        self.assertEqual(accumulator.min[east], 5)
+        self.assertEqual(accumulator.max[east], 20)
@@ -22,6 +22,9 @@ urlpatterns = [
          name='discover-inputs-for-pipeline'),
 
     # json responses
+    path('zonal-statistics/<str:group_name>/<str:zone_set>/<str:zone_id>',
+         views.zonal_statistics_series,
+         name='zonal-statistics-series'),
     # 'c/task/done/<task_pattern:task_id>/'
     # 'c/task/status/<task_pattern:task_id>/'
     path('c/', include(celery_urls))
@@ -16,15 +16,23 @@ from django.utils.http import urlencode
 from more_itertools import collapse
 
 from eo_engine import forms
+from eo_engine.common.task_history import latest_tasks
 from eo_engine.common.tasks import get_task_ref_from_name
 from eo_engine.errors import AfriCultuReSError
-from eo_engine.models import EOSource, EOProduct, EOProductStateChoices, EOSourceGroup, EOProductGroup
-from eo_engine.models.factories import create_or_get_wapor_object_from_filename
+from eo_engine.models import (EOSource, EOProduct, EOProductStateChoices, EOSourceGroup, EOProductGroup,
+                              EOSourceStateChoices, GeopTask, transition_eo_product, transition_eo_source)
+from eo_engine.models.factories import WAPOR_GROUP_PATTERN, bulk_create_wapor_entries
 from eo_engine.models.other import CrawlerConfiguration, Pipeline
 
 logger = logging.getLogger('eo_engine.frontend_ops')
 url_template = '{base_url}?{querystring}'
 
+# a product being made, or a source being downloaded, is not scheduled again
+SCHEDULABLE_PRODUCT_STATES = [state for state in EOProductStateChoices.values
+                              if state != EOProductStateChoices.GENERATING]
+SCHEDULABLE_SOURCE_STATES = [state for state in EOSourceStateChoices.values
+                             if state != EOSourceStateChoices.DOWNLOADING]
+
 
 def create_query_dict(**kwargs) -> QueryDict:
     query_dict = QueryDict('', mutable=True)
@@ -125,16 +133,18 @@ def delete_file(request, resource_type: Literal['eo_source', 'eo_product'], pk:
 
 
 def trigger_generate_product(request, filename):
-    from eo_engine.common.tasks import get_task_ref_from_name
-    from .models import EOProduct, EOProductStateChoices
     eo_product = EOProduct.objects.get(filename=filename)
     out_pipeline = eo_product.group.eoproductgroup.pipelines_from_output.first()
     task_name = out_pipeline.task_name
     task_kwargs = out_pipeline.task_kwargs
     task = get_task_ref_from_name(task_name).s(eo_product_pk=eo_product.pk, **task_kwargs)
+    # before the task is sent: it could start (GENERATING) before a later update
+    if not transition_eo_product(eo_product.pk, EOProductStateChoices.SCHEDULED,
+                                 from_states=SCHEDULABLE_PRODUCT_STATES):
+        messages.add_message(request, messages.WARNING,
+                             f'{eo_product.filename} is being generated, not scheduling it again')
+        return redirect(request.META.get('HTTP_REFERER') or reverse('eo_engine:main-page'))
     job: AsyncResult = task.apply_async()
-    eo_product.state = EOProductStateChoices.SCHEDULED
-    eo_product.save()
     context = {'card_info':
                    {'task_name': task.name,
                     'param': eo_product.task_kwargs,
@@ -152,15 +162,17 @@ def trigger_generate_product(request, filename):
 
 def trigger_download_eosource(request, eo_source_pk):
     from .tasks import task_download_file
-    from .models import EOSource, EOSourceStateChoices
 
     template_header_title = 'Download file'
 
-    obj = EOSource.objects.get(pk=eo_source_pk)
     task = task_download_file.s(eo_source_pk=eo_source_pk)
+    # before the task is sent: it could start (DOWNLOADING) before a later update
+    if not transition_eo_source(eo_source_pk, EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD,
+                                from_states=SCHEDULABLE_SOURCE_STATES):
+        messages.add_message(request, messages.WARNING,
+                             f'EOSource {eo_source_pk} is being downloaded or does not exist, not scheduling it')
+        return redirect(request.META.get('HTTP_REFERER') or reverse('eo_engine:list-eosources'))
     job: AsyncResult = task.apply_async()
-    obj.state = EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD
-    obj.save()
 
     context = {
         'header': template_header_title,
@@ -223,10 +235,12 @@ def submit_task(request):
     # mark it as scheduled
     from eo_engine.tasks import task_download_file
     if task_download_file == get_task_ref_from_name(task_name):
-        from eo_engine.models import EOSourceStateChoices
-        eo_source = EOSource.objects.get(pk=task_kwargs['eo_source_pk'])
-        eo_source.state = EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD
-        eo_source.save()
+        eo_source_pk = int(task_kwargs['eo_source_pk'])
+        if not transition_eo_source(eo_source_pk, EOSourceStateChoices.SCHEDULED_FOR_DOWNLOAD,
+                                    from_states=SCHEDULABLE_SOURCE_STATES):
+            messages.add_message(request, messages.WARNING,
+                                 f'EOSource {eo_source_pk} is being downloaded or does not exist, not scheduling it')
+            return redirect(next_page)
     if eager:
         job = task.apply()
         job.get()
@@ -258,7 +272,6 @@ def trigger_crawler(request, group_name: str):
 
 
 def view_revoke_task(request, task_id: str):
-    from eo_engine.models import GeopTask
     from eo_engine.common.tasks import revoke_task
 
     return_page = request.GET.get('return_page', '')
@@ -292,13 +305,10 @@ def view_revoke_task(request, task_id: str):
 
 
 def utilities_save_rows(request):
-    # 'save' all rows in EOSource/Product to trigger the post-save signal
-    all_eosource = EOSource.objects.all()
-    all_eoproduct = EOProduct.objects.all()
-    for model in [all_eoproduct, all_eosource]:
-        for e in model:
-            e.save()
-    messages.info(request, 'Done!')
+    # reconcile the EOProducts of all the pipelines with their inputs, in the background
+    from eo_engine.tasks import task_reconcile_products
+    job = task_reconcile_products.delay()
+    messages.info(request, f'Reconciliation of the products submitted, task id: {job}')
     return redirect(reverse('eo_engine:main-page'))
 
 
@@ -362,12 +372,7 @@ def create_sentinel_entry(request, group_name: str):
 
 
 def create_wapor_entry(request, group_name: str):
-    from eo_engine.common.time import month_dekad_to_running_decad, day2dekad
-
-    pat = re.compile(
-        r'S06P04_WAPOR_(?P<LEVEL>(L1|L2))_(?P<PROD>(AETI|QUAL_LST|QUAL_NDVI))_D_(?P<LOCATION>(AFRICA|\w{3}|))',
-        re.IGNORECASE)
-    match = pat.match(group_name)
+    match = WAPOR_GROUP_PATTERN.match(group_name)
     if match is None:
         raise
 
@@ -375,14 +380,13 @@ def create_wapor_entry(request, group_name: str):
     product_level = group_dict['LEVEL']
     product_name = group_dict['PROD']
     location = group_dict['LOCATION']
-    product_dimension = 'D'  # it's always D (DEKAD) at this stage
 
     context = {
         'group_name': group_name,
         'product_name': product_name,
         'product_level': product_level,
         'product_location': location,
-        'product_dimension': 'D'
+        'product_dimension': 'D'  # it's always D (DEKAD) at this stage
     }
 
     form_class = forms.WaporForm
@@ -392,34 +396,10 @@ def create_wapor_entry(request, group_name: str):
         return render(request, 'utilities/create-wapor.html', context=context)
     if request.method == 'POST':
         form = form_class(request.POST)
-        from datetime import datetime
-        from dateutil.rrule import rrule, DAILY
         if form.is_valid():
-            data = form.data
-            from_date_str = data['from_date']
-            to_date_str = data['to_date']
-            from_date = datetime.strptime(from_date_str, '%Y-%m-%d')
-            to_date = datetime.strptime(to_date_str, '%Y-%m-%d')
-
-            obj_created = 0
-            obj_exist = 0
-            dt: datetime
-            for idx, dt in enumerate(rrule(DAILY, dtstart=from_date, until=to_date), 1):
-                year = dt.year
-                month = dt.month
-                day = dt.day
-                yearly_dekad = month_dekad_to_running_decad(month, day2dekad(day))
-                YYKK = f'{str(year)[2:]}{yearly_dekad}'  # last two digits of the year + running dekad
-                if location:
-                    filename = f'{product_level}_{product_name}_{product_dimension}_{YYKK}_{location}.tif'
-                else:
-                    filename = f'{product_level}_{product_name}_{product_dimension}_{YYKK}.tif'
-                obj, created = create_or_get_wapor_object_from_filename(filename)
-                if created:
-                    obj_created += 1
-                else:
-                    obj_exist += 1
-            messages.success(request, f' Added {obj_created} entries in the database.')
+            reports = bulk_create_wapor_entries(
+                [group_name], from_date=form.cleaned_data['from_date'], to_date=form.cleaned_data['to_date'])
+            messages.success(request, f' Added {reports[group_name].created} entries in the database.')
         else:
             # form is not valid
             context.update(form=form)
@@ -515,6 +495,8 @@ def pipeline_outputs(request, pipeline_pk: int):
     group = pipeline.output_group
     output_group = group.eoproductgroup
     output_eo_product_qs = EOProduct.objects.filter(group=output_group).order_by('-reference_date')
+    # the latest task of every product, in two queries
+    tasks = latest_tasks(output_eo_product_qs.values_list('pk', flat=True))
 
     task_name = pipeline.task_name
     task_kwargs = pipeline.task_kwargs
@@ -526,6 +508,18 @@ def pipeline_outputs(request, pipeline_pk: int):
             (reverse('eo_engine:submit-task'),
              urlencode({'task_name': task_name, 'eo_product_pk': eo_product.pk, **task_kwargs})))
 
+    def latest_task(eo_product: EOProduct) -> Optional[dict]:
+        task = tasks.get(eo_product.pk)
+        if task is None:
+            return None
+        revocable = task.status in (GeopTask.TaskTypeChoices.SUBMITTED, GeopTask.TaskTypeChoices.STARTED,
+                                    GeopTask.TaskTypeChoices.RETRY)
+        return {'status': task.status,
+                'datetime_submitted': task.datetime_submitted,
+                'revoke_url': '?'.join(
+                    (reverse('eo_engine:revoke-task', kwargs={'task_id': task.task_id}),
+                     urlencode({'return_page': request.get_full_path()}))) if revocable else None}
+
     context = {
         'task_name': pipeline.task_name,
         "pipeline_pk": pipeline_pk,
@@ -534,6 +528,7 @@ def pipeline_outputs(request, pipeline_pk: int):
             {'pk': eo_product.pk,
              'filename': eo_product.filename,
              'state': eo_product.get_state_display,
+             'latest_task': latest_task(eo_product),
              'generate_trigger_task': {
                  "disabled": [EOProductStateChoices.AVAILABLE, EOProductStateChoices.READY,
                               EOProductStateChoices.FAILED].count(eo_product.state) != 1,
@@ -606,3 +601,20 @@ def discover_inputs_for_pipeline(request: HttpRequest, pipeline_pk: int):
 
 def download_available_remote_files_for_pipeline(request):
     return None
+
+
+def zonal_statistics_series(request: HttpRequest, group_name: str, zone_set: str, zone_id: str):
+    """ JSON time series of the zonal statistics of a zone. Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD """
+    from django.http import JsonResponse
+    from eo_engine.common.zonal import zone_time_series
+
+    try:
+        date_from = date.fromisoformat(request.GET['from']) if request.GET.get('from') else None
+        date_to = date.fromisoformat(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        return JsonResponse({'error': 'from/to should be ISO dates (YYYY-MM-DD)'}, status=400)
+
+    series = zone_time_series(group_name, zone_set, zone_id, date_from, date_to)
+    for entry in series:
+        entry['reference_date'] = entry['reference_date'].isoformat()
+    return JsonResponse({'group': group_name, 'zone_set': zone_set, 'zone_id': zone_id, 'series': series})
@@ -5,8 +5,11 @@
 
 # useful for handling different item types with a single interface
 from datetime import datetime
+from typing import Dict, Optional
+
 from scrapy.exceptions import DropItem
 
+from eo_engine.common.db_ops import bulk_add_eo_sources
 from eo_engine.models import EOSource, Credentials, EOSourceStateChoices, EOSourceGroup
 from eo_scraper.items import RemoteSourceItem
 
@@ -19,13 +22,37 @@ def try_parse_reference_date(token):
 
 
 class DefaultPipeline:
+    """ Buffers the scraped files and stores them in batches (settings.EO_SOURCE_BATCH_SIZE): the new EOSources
+    in one bulk insert, their group membership in another. Files that already exist are attached to the group of
+    the spider. The group, its date pattern and the credentials are read once per spider.
+
+    Bulk inserts do not send post_save: new sources are AVAILABLE_REMOTELY, the signals would ignore them. """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.eo_source_group: Optional[EOSourceGroup] = None
+        self.credentials: Dict[str, Optional[Credentials]] = {}
+        self.buffer: Dict[str, EOSource] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(batch_size=crawler.settings.getint('EO_SOURCE_BATCH_SIZE', 1000))
+
+    def open_spider(self, spider):
+        self.eo_source_group = spider.get_group_settings()
+
+    def close_spider(self, spider):
+        self.flush(spider)
+
+    def get_credentials(self, domain: str) -> Optional[Credentials]:
+        if domain not in self.credentials:
+            self.credentials[domain] = Credentials.objects.filter(domain=domain).first()
+        return self.credentials[domain]
 
-    # noinspection PyMethodMayBeStatic
     def process_item(self, item: RemoteSourceItem, spider):
 
         domain = item['domain']
         filename = item['filename']
-        eo_source_group = EOSourceGroup.objects.get(name=spider.name)
 
         if not spider.is_expected_filename(filename):
             spider.logger.warn(f'SCRAPY_CRAWLER:PIPLINE: {filename} should not be processed. Dropping!')
@@ -35,30 +62,30 @@ class DefaultPipeline:
             spider.logger.warn(f'SCRAPY_CRAWLER:PIPLINE: {filename} did not pass check. Dropping!')
             raise DropItem()
 
-        try:  # don't process (drop) duplicates
-            eo_source = EOSource.objects.get(filename=filename)
-            spider.logger.warn(
-                f'SCRAPY_CRAWLER:PIPLINE: {filename} already exists in the database.'
-                f'Attaching it to more to more EOSourceGroups if necessary!')
-            eo_source.group.add(eo_source_group)
-        except EOSource.DoesNotExist:
-            try:
-                cred_obj = Credentials.objects.get(domain=domain)
-            except Credentials.DoesNotExist:
-                cred_obj = None
-
-            datetime_ref = spider.date_reference_from_filename(filename)
-            eo_source_object = EOSource.objects.create(
+        if filename not in self.buffer:
+            self.buffer[filename] = EOSource(
                 state=EOSourceStateChoices.AVAILABLE_REMOTELY,
                 file=None,
                 filename=filename,  # unique, acts as id
                 domain=domain,
-                reference_date=datetime_ref,
+                reference_date=spider.date_reference_from_filename(filename),
                 filesize_reported=item.get('size', -1),
                 datetime_seen=item.get('datetime_seen', datetime.utcnow()),
                 url=item.get('url'),
-                credentials=cred_obj,
+                credentials=self.get_credentials(domain),
             )
-            eo_source_object.group.add(eo_source_group)
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+        return item
 
-            return item
+    def flush(self, spider):
+        """ Stores the buffered files, a handful of queries whatever the size of the batch """
+        if not self.buffer:
+            return
+        report = bulk_add_eo_sources(self.buffer.values(), self.eo_source_group, batch_size=self.batch_size)
+        if report.attached:
+            spider.logger.warn(
+                f'SCRAPY_CRAWLER:PIPLINE: {report.attached} files already exist in the database.'
+                f' Attaching them to {self.eo_source_group.name} if necessary!')
+        spider.logger.info(f'SCRAPY_CRAWLER:PIPLINE: stored {report.created} new files')
+        self.buffer.clear()
@@ -71,6 +71,8 @@ DOWNLOAD_HANDLERS = {
 ITEM_PIPELINES = {
     'eo_scraper.pipelines.DefaultPipeline': 300,
 }
+# EOSources per bulk insert of the DefaultPipeline
+EO_SOURCE_BATCH_SIZE = 1000
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
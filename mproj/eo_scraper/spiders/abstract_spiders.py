@@ -12,7 +12,7 @@ from scrapy.loader import ItemLoader
 from scrapy.selector.unified import Selector
 from scrapy.spiders import Spider
 from scrapy.spiders.init import InitSpider
-from typing import Optional
+from typing import Optional, Pattern
 from urllib.parse import urlsplit, urlparse
 
 from eo_engine.models import EOSourceGroup
@@ -68,7 +68,18 @@ class AfricultureCrawlerMixin:
         return CrawlerConfiguration.objects.filter(group=self.name).get()
 
     def get_group_settings(self) -> EOSourceGroup:
-        return EOSourceGroup.objects.get(name=self.name)
+        # cached per spider: the item pipeline asks for every scraped file
+        group = getattr(self, '_eo_source_group', None)
+        if group is None:
+            group = self._eo_source_group = EOSourceGroup.objects.get(name=self.name)
+        return group
+
+    def get_date_pattern(self) -> Pattern:
+        # compiled once per spider, not for every scraped file
+        pattern = getattr(self, '_date_pattern', None)
+        if pattern is None:
+            pattern = self._date_pattern = re.compile(self.get_group_settings().date_regex, re.IGNORECASE)
+        return pattern
 
     def should_process_response(self, response: Response) -> bool:
         """if false, the request will not be processed. Overrider if needed """
@@ -76,19 +87,17 @@ class AfricultureCrawlerMixin:
 
     def date_reference_from_filename(self, filename) -> Optional[dt_date]:
         from eo_engine.common.misc import str_to_date
-        eo_source_group = EOSourceGroup.objects.get(name=self.name)
 
-        return str_to_date(token=filename, regex_string=eo_source_group.date_regex)
+        return str_to_date(token=filename, regex_string=self.get_date_pattern())
 
     def is_expected_filename(self, filename: str) -> bool:
         """Return True if filename passes the date_regex check. False otherwise"""
 
-        group_settings = self.get_group_settings()
-        filename_regex = group_settings.date_regex_cached  # cached version
-        match = re.match(filename_regex, filename, re.IGNORECASE)
+        pattern = self.get_date_pattern()
+        match = pattern.match(filename)
         if match is None:
             self.logger.info(
-                f'SHOULD_PROCESS_FILENAME:FAILED: +{filename}+ did not pass regex check: +{filename_regex}+')
+                f'SHOULD_PROCESS_FILENAME:FAILED: +{filename}+ did not pass regex check: +{pattern.pattern}+')
             return False
         return True
 
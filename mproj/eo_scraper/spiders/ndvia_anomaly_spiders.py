@@ -71,12 +71,11 @@ class NDVIAnomaly(Spider, AfricultureCrawlerMixin):
             yield None
 
     def is_expected_filename(self, filename: str) -> bool:
-        group_settings = self.get_group_settings()
-        filename_regex = group_settings.date_regex_cached  # cached version
-        match = re.match(filename_regex, filename, re.IGNORECASE)
+        pattern = self.get_date_pattern()
+        match = pattern.match(filename)
         if match is None:
             self.logger.info(
-                f'SHOULD_PROCESS_FILENAME:FAILED: +{filename}+ did not pass regex check: +{filename_regex}+')
+                f'SHOULD_PROCESS_FILENAME:FAILED: +{filename}+ did not pass regex check: +{pattern.pattern}+')
             return False
         return True
 
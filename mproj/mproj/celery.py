@@ -2,10 +2,13 @@ from __future__ import absolute_import
 
 import inspect
 import os
+import sys
+from typing import Iterable, NamedTuple, Optional
 
 from celery import Celery
 from celery.schedules import crontab
-from celery.signals import before_task_publish
+from celery.signals import (before_task_publish, celeryd_after_setup, celeryd_init, task_prerun, task_postrun,
+                            worker_process_init, worker_process_shutdown)
 from django.conf import settings
 
 from eo_engine.signals import logger
@@ -42,64 +45,155 @@ app.conf.beat_schedule = {
         'task': 'eo_engine.tasks.task_schedule_download_eosource',
         'schedule': crontab(minute='0', hour='*/8')  # 0 minute every  8th hour
     },
+    'resolve_dependencies': {
+        'task': 'eo_engine.tasks.dependencies.task_resolve_dependencies',
+        'schedule': settings.DEPENDENCY_RESOLVER_DEBOUNCE
+    },
     'queue_create_eoproduct': {
         'task': 'eo_engine.tasks.task_schedule_create_eoproduct',
         'schedule': crontab(minute='*/2')
     },
+    'purge_task_history': {
+        'task': 'eo_engine.tasks.maintenance.task_purge_task_history',
+        'schedule': crontab(minute='30', hour='3')  # 3:30 am every day
+    },
 }
 
 
+# recycling of the pool processes of a worker, see settings.WORKER_PROFILES
+WorkerProfile = NamedTuple('WorkerProfile', [
+    # tasks a process runs before it is replaced. None: no limit
+    ('max_tasks_per_child', Optional[int]),
+    # resident memory (MB) after a task above which the process is replaced. None: no limit
+    ('max_memory_per_child_mb', Optional[int]),
+    # heap (MB) of the SNAP JVM after a task above which the process is replaced. None: no limit
+    ('max_jvm_heap_mb', Optional[int])
+])
+
+DEFAULT_WORKER_PROFILE = WorkerProfile(max_tasks_per_child=1, max_memory_per_child_mb=None, max_jvm_heap_mb=None)
+
+# the profile of this worker, set on celeryd_init and inherited by the pool processes
+_worker_profile: Optional[WorkerProfile] = None
+# highest JVM heap (MB) seen after a task of this pool process
+_jvm_heap_high_water_mb = 0.0
+
+
+def worker_profile(queues: Iterable[str]) -> WorkerProfile:
+    """ The profile of a worker of queues: the strictest limits of the profiles of the queues """
+    configured = getattr(settings, 'WORKER_PROFILES', {})
+    base = DEFAULT_WORKER_PROFILE._replace(**configured.get('default', {}))
+    profiles = [base._replace(**configured.get(queue, {})) for queue in queues] or [base]
+
+    def strictest(values) -> Optional[int]:
+        values = [v for v in values if v]
+        return min(values) if values else None
+
+    return WorkerProfile(*(strictest(values) for values in zip(*profiles)))
+
+
+@celeryd_init.connect
+def handles_worker_init(sender=None, conf=None, options=None, **kwargs):
+    """ Applies the profile of the queues of the worker (-Q) to the pool, before the pool is set up """
+    from eo_engine.common.task_registry import default_queue
+    global _worker_profile
+
+    queues = (options or {}).get('queues') or [default_queue()]
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    profile = worker_profile(queues)
+    conf.worker_max_tasks_per_child = profile.max_tasks_per_child
+    memory_mb = profile.max_memory_per_child_mb
+    if profile.max_jvm_heap_mb and not memory_mb:
+        # the JVM check rides on the memory check of the pool, which only runs with a limit
+        memory_mb = sys.maxsize // 1024 ** 2
+    conf.worker_max_memory_per_child = memory_mb * 1024 if memory_mb else None
+    _worker_profile = profile
+    logger.info(f'{inspect.stack()[0][3]}: queues: {", ".join(queues)}, profile: {profile}')
+
+
+@worker_process_init.connect
+def handles_worker_process_init(**kwargs):
+    """ A pool process whose JVM heap went over the limit reports an exhausted memory, so the pool replaces
+    it after the task, the same way as a process over worker_max_memory_per_child """
+    if not (_worker_profile and _worker_profile.max_jvm_heap_mb):
+        return
+    import billiard.pool
+
+    mem_rss = billiard.pool.mem_rss
+
+    def usage_kb() -> int:
+        if _jvm_heap_high_water_mb > _worker_profile.max_jvm_heap_mb:
+            logger.warning(f'JVM heap {_jvm_heap_high_water_mb:.0f} MB over {_worker_profile.max_jvm_heap_mb} MB, '
+                           f'recycling the process')
+            return sys.maxsize
+        return mem_rss()
+
+    billiard.pool.mem_rss = usage_kb
+
+
+@worker_process_shutdown.connect
+def handles_worker_process_shutdown(**kwargs):
+    """ A recycled pool process writes its buffered task events before it exits """
+    from eo_engine.common.task_tracking import tracker
+
+    tracker.close()
+
+
 @before_task_publish.connect
 def handles_task_publish(sender: str = None, headers=None, body=None, **kwargs):
-    """ Essential procedures before a task is published on the broker.
+    """ Records the task before it is published on the broker. The GeopTask is written in the background,
+    in batches (see eo_engine.common.task_tracking).
     This function is connected to the  before_task_publish signal """
+    from eo_engine.common.task_tracking import Published, is_tracked, linked_pks, tracker
 
-    from eo_engine.models import GeopGroupTask, GeopTask
-
-    if not (sender.startswith('eo_engine') or
-            sender.startswith('app')):
+    if not is_tracked(sender):
         return
     info = headers
 
     task_id = info['id']
     group_task_id = info.get('group', None)
     root_id = None if task_id == info.get('root_id') else info.get('root_id', task_id)
-    if group_task_id:
-        group_task_obj, created = GeopGroupTask.objects.get_or_create(group_task_id=group_task_id, root_id=root_id)
-
-    else:
-        group_task_obj = None
-    # in case of Retry, celery will try to
-    # republish the task with the same task_id
-    # _kwargs_repr = json.dumps(body[1])
-
-    task_obj, created = GeopTask.objects.get_or_create(task_id=task_id)
-
-    if created:
-        task_kwargs = body[1]
-        _data = dict()
-        _data.update(
-            task_name=info['task'],
-            task_args=info['argsrepr'],
-            task_kwargs=task_kwargs,
-            parent_id=info['parent_id'],
-            root_id=info['root_id'],
-            group_task=group_task_obj,
-        )
-        for k, v in _data.items():
-            setattr(task_obj, k, v)
-        task_obj.save()
-
-        eo_source_pk = task_kwargs.get('eo_source_pk')
-        eo_product_pk = task_kwargs.get('eo_product_pk')
-        for pk_bag in [eo_source_pk, eo_product_pk]:
-            if pk_bag:
-                if isinstance(pk_bag, list):
-                    task_obj.eo_source.add(*pk_bag)
-                else:  # not a list
-                    task_obj.eo_source.add(pk_bag)
-
-        logger.info(f'{inspect.stack()[0][3]}: Created task: {info["id"]}')
-    else:
-        logger.info(f'{inspect.stack()[0][3]}: Task {info["id"]} found.')
-    return
+    task_kwargs = body[1]
+    eo_source_pks, eo_product_pks = linked_pks(task_kwargs)
+
+    tracker.task_published(Published(
+        task_id=task_id,
+        task_name=info['task'],
+        task_args=info['argsrepr'],
+        task_kwargs=task_kwargs,
+        parent_id=info['parent_id'],
+        root_id=info['root_id'],
+        group_task_id=group_task_id,
+        group_root_id=root_id,
+        eo_source_pks=eo_source_pks,
+        eo_product_pks=eo_product_pks
+    ))
+
+
+@celeryd_after_setup.connect
+def handles_worker_setup(sender=None, instance=None, **kwargs):
+    """ Registers the tasks of the queues the worker consumes (see eo_engine.common.task_registry).
+    Runs after the -Q option is applied and before the pool starts. """
+    from eo_engine.common.task_registry import import_queue_tasks
+
+    import_queue_tasks(instance.app.amqp.queues.consume_from.keys())
+
+
+@task_prerun.connect
+def handles_task_prerun(sender=None, **kwargs):
+    """ Applies the GDAL performance profile of the task (see settings.GDAL_PERFORMANCE_PROFILES) """
+    from eo_engine.common.gdal_profile import activate_gdal_profile
+
+    activate_gdal_profile(sender.name)
+
+
+@task_postrun.connect
+def handles_task_postrun(sender=None, **kwargs):
+    from eo_engine.common.gdal_profile import deactivate_gdal_profile
+    global _jvm_heap_high_water_mb
+
+    deactivate_gdal_profile()
+    if _worker_profile and _worker_profile.max_jvm_heap_mb:
+        from eo_engine.common.snap import jvm_heap_used_mb
+
+        _jvm_heap_high_water_mb = max(_jvm_heap_high_water_mb, jvm_heap_used_mb() or 0.0)
@@ -137,19 +137,100 @@ MEDIA_ROOT = Path("/local_files_root")
 AUX_FILES_ROOT = Path('/aux_files')
 PRODUCTS_ROOT = Path(MEDIA_ROOT) / 'products'
 
+# NDVI long-term statistics
+# static CGLS LTS files read by the VCI task. Point it to NDVI_LTS_ROOT to use the incremental statistics
+NDVI_LTS_DIR = AUX_FILES_ROOT / 'NDVI_LTS'
+# incremental statistics, updated when a product of NDVI_LTS_GROUPS becomes READY (eo_engine.common.lts)
+NDVI_LTS_ROOT = AUX_FILES_ROOT / 'NDVI_LTS_INCREMENTAL'
+NDVI_LTS_GROUPS = ('S02P02_NDVI_1KM_V3_AFR',)
+NDVI_LTS_WITH_MEAN = True
+
+# zonal statistics (eo_engine.common.zonal)
+# zone sets: a shapefile of administrative units and the attributes with their code and name
+ZONE_SETS = {
+    'countries': {
+        'shapefile': AUX_FILES_ROOT / 'Admin_shp/africa_adm0.shp',
+        'id_field': 'ISO3',
+        'name_field': 'NAME'
+    },
+    'districts': {
+        'shapefile': AUX_FILES_ROOT / 'Admin_shp/africa_adm2.shp',
+        'id_field': 'ADM2_CODE',
+        'name_field': 'ADM2_NAME'
+    }
+}
+# product groups (glob patterns) -> zone sets, netCDF variable and valid range (physical units) of the values
+ZONAL_STATISTICS_GROUPS = {
+    'S02P02_NDVIA_250M_*': {'zone_sets': ['countries', 'districts'], 'variable': 'NDVIA', 'valid_range': (-1, 1)},
+    'S02P02_VCI_1KM_V2_AFR': {'zone_sets': ['countries', 'districts'], 'variable': 'VCI',
+                              'valid_range': (-0.125, 1.125)},
+    'S06P04_AETI_*_D_*': {'zone_sets': ['countries', 'districts']}
+}
+
+# cube store (eo_engine.common.cube): per group netCDF cubes, chunked along time, for time-series extraction
+CUBE_STORE_ROOT = MEDIA_ROOT / 'cubes'
+# product groups (glob patterns) -> netCDF variable of the products, time/spatial chunk sizes
+CUBE_STORE_GROUPS = {
+    'S02P02_NDVI_1KM_V3_AFR': {'variable': 'NDVI'},
+    'S02P02_VCI_1KM_V2_AFR': {'variable': 'VCI'},
+}
+
+# temporal aggregation pipelines (eo_engine.common.aggregation)
+TEMPORAL_AGGREGATION_ROOT = MEDIA_ROOT / 'accumulators'
+TEMPORAL_AGGREGATION_SEASONS = {
+    'DJF': (12, 1, 2),
+    'MAM': (3, 4, 5),
+    'JJA': (6, 7, 8),
+    'SON': (9, 10, 11)
+}
+
 # celery
 CELERY_RESULT_BACKEND = 'django-db'
+# 0: celery does not expire the results, the purge of the task history does (see below)
 CELERY_RESULT_EXPIRES = 0
 BROKER_URL = f"amqp://{os.getenv('RABBIT_USERNAME', 'rabbit')}:{os.getenv('RABBIT_PASSWORD', 'carror')}@{os.getenv('RABBIT_HOST', 'host.docker.internal')}//"
-CELERYD_MAX_TASKS_PER_CHILD = 1
+# recycling of the pool processes, per queue (see mproj.celery). 'default' applies to every queue.
+# max_tasks_per_child: tasks before a process is replaced. max_memory_per_child_mb: resident memory after a
+# task above which the process is replaced. max_jvm_heap_mb: same, for the heap of the SNAP JVM.
+# None: no limit. A worker of several queues applies the strictest limits.
+WORKER_PROFILES = {
+    'default': {'max_tasks_per_child': 1},
+    'download': {'max_tasks_per_child': 200, 'max_memory_per_child_mb': 512},
+    'crawl': {'max_tasks_per_child': 100, 'max_memory_per_child_mb': 1024},
+    'process': {
+        'max_tasks_per_child': int(os.getenv('PROCESS_MAX_TASKS_PER_CHILD', 20)),
+        'max_memory_per_child_mb': int(os.getenv('PROCESS_MAX_MEMORY_PER_CHILD_MB', 6144)),
+        'max_jvm_heap_mb': int(os.getenv('PROCESS_MAX_JVM_HEAP_MB', 4096))
+    }
+}
+# GeopTask tracking (eo_engine.common.task_tracking): events are written by a background thread every
+# TASK_TRACKING_FLUSH_INTERVAL seconds, or once TASK_TRACKING_BATCH_SIZE events wait. False: written at once
+TASK_TRACKING_BUFFERED = os.getenv('TASK_TRACKING_BUFFERED', 'true').lower() != 'false'
+TASK_TRACKING_FLUSH_INTERVAL = 1.0
+TASK_TRACKING_BATCH_SIZE = 500
+# task history (eo_engine.common.task_history): every night the finished GeopTasks older than
+# TASK_HISTORY_RETENTION_DAYS and the celery results older than TASK_RESULT_RETENTION_DAYS are deleted,
+# TASK_HISTORY_PURGE_BATCH_SIZE rows per transaction
+TASK_HISTORY_RETENTION_DAYS = int(os.getenv('TASK_HISTORY_RETENTION_DAYS', 90))
+TASK_RESULT_RETENTION_DAYS = int(os.getenv('TASK_RESULT_RETENTION_DAYS', 30))
+TASK_HISTORY_PURGE_BATCH_SIZE = 5000
 CELERY_ACKS_LATE = True
 CELERYD_PREFETCH_MULTIPLIER = 1
+# AVAILABLE products scheduled per task by task_utils_generate_eoproducts_for_eo_product_group.
+# 0/1: one task per product. Larger batches share the task start-up (SNAP operators, aux files).
+EOPRODUCT_BATCH_SIZE = 0
 CELERY_ROUTES = {
     '*.task_s02p02_ndvianom250m': 'process',
     '*.task_s02p02_ndvi300m_v2': 'process',
     '*.task_s02p02_nvdi1km_v3': 'process',
     '*.task_s02p02_vci1km_v2': 'process',
     '*.task_s02p02_lai300m_v1': 'process',
+    '*.task_update_ndvi_lts': 'process',
+    '*.task_fold_temporal_aggregation': 'process',
+    '*.task_temporal_aggregation': 'process',
+    '*.task_zonal_statistics': 'process',
+    '*.task_cube_append': 'process',
+    '*.task_batch_generate_eoproducts': 'process',
     '*.task_s06p01_wb300m_v2': 'process',
     '*.task_s04p01_lulc500m': 'process',
     '*.task_s04p03_convert_to_tiff': 'process',
@@ -167,11 +248,63 @@ CELERY_ROUTES = {
     '*.task_sftp_parse_remote_dir': 'crawl',
     '*.task_download_file': 'download'
 }
+# dependency resolution (eo_engine.common.dependencies): a key is resolved once it is quiet for
+# DEPENDENCY_RESOLVER_DEBOUNCE seconds, DEPENDENCY_RESOLVER_BATCH_SIZE keys per transaction
+DEPENDENCY_RESOLVER_DEBOUNCE = int(os.getenv('DEPENDENCY_RESOLVER_DEBOUNCE', 30))
+DEPENDENCY_RESOLVER_BATCH_SIZE = 5000
+# listings (eo_engine.common.db_ops.ingest_remote_files) skip the files older than the latest known file of the
+# group less INGESTION_LOOKBACK_DAYS
+INGESTION_LOOKBACK_DAYS = int(os.getenv('INGESTION_LOOKBACK_DAYS', 7))
+# workers import only the task modules of the queues they consume (see eo_engine.common.task_registry)
+LAZY_TASK_IMPORTS = os.getenv('LAZY_TASK_IMPORTS', 'true').lower() != 'false'
 
 # Application specific
 GDAL_TRANSLATE = os.getenv("GDAl_TRANSLATE_PATH", "/srv/conda/envs/env_snap/bin/gdal_translate")
 GDAL_WRAP = os.getenv("GDAL_WARP_PATH", '/srv/conda/envs/env_snap/bin/gdalwarp')
 
+# GDAL threads, memory and creation options, per task name. 'default' applies to every task.
+# see eo_engine.common.gdal_profile for the options. The GeoTIFF products of a group take their tiling and
+# compression from PRODUCT_LAYOUT_PROFILES
+GDAL_PERFORMANCE_PROFILES = {
+    'default': {
+        'num_threads': os.getenv('GDAL_PROFILE_NUM_THREADS', 'ALL_CPUS'),
+        'warp_memory_mb': int(os.getenv('GDAL_PROFILE_WARP_MEMORY_MB', 512)),
+        'cache_max_mb': int(os.getenv('GDAL_PROFILE_CACHE_MAX_MB', 512)),
+    },
+    # the African 250m rasters are large, give them more block cache and warp memory
+    'task_s06p04_et250m': {
+        'warp_memory_mb': 1024,
+        'cache_max_mb': 1024,
+    },
+    'task_s02p02_ndvianom250m': {
+        'cache_max_mb': 1024,
+    },
+}
+
+# On-disk chunking and compression of the products, per product group name (or glob pattern of names).
+# Small chunks keep per-pixel time series reads cheap. See eo_engine.common.layout and the
+# benchmark_layouts management command. The GeoTIFF options of a group (tiled, blocksize, gtiff_compress,
+# predictor) win over the GTiff creation_options of GDAL_PERFORMANCE_PROFILES, see eo_engine.common.gdal_profile.
+PRODUCT_LAYOUT_PROFILES = {
+    'default': {
+        'chunksizes': (256, 256),
+        'shuffle': True,
+        'compression': 'zlib',
+        'complevel': 4,
+        'tiled': True,
+        'blocksize': 256,
+        'gtiff_compress': 'DEFLATE',
+    },
+    'S06P04_AETI_250M_D_AFR': {
+        'complevel': 8,
+    },
+    # the water masks are integer rasters, they compress better with the horizontal predictor
+    'S06P01_WB_10M_*': {
+        'blocksize': 512,
+        'predictor': 2,
+    },
+}
+
 MESSAGE_TAGS = {
     messages.DEBUG: 'alert-secondary',
     messages.INFO: 'alert-info',